@@ -0,0 +1,492 @@
+"""
+Event-driven backtest of the live strategy over the trades table.
+
+    python backtest.py --days 30
+    python backtest.py --start 1717200000 --end 1719792000 --param rsi_buy=30 --param num_bars=9
+
+Trades are replayed in time order through the same code live.py runs: the dollar bars are extended trade
+by trade with DollarBarBuilder, the order flow totals of each bar are accumulated from the replayed trades
+(so nothing is re-queried or rebuilt over the 72 hour window), and every analysis interval of replay time
+the cycle calls get_market_signal, get_rsi on 5 minute candles built from the trades, and the entry and
+exit rules of strategy_runner. The stop loss and take profit rest on the simulated exchange and the
+trailing stop is checked on every trade, like the protective orders and trade-batch check of live.py.
+
+Results are written to the backtest_runs, backtest_trades and backtest_equity tables.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sqlite3
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import constants
+from bar_engine import BarFlow
+from dollar_bars import DollarBarBuilder
+from get_signals import get_market_signal, get_rsi
+from position_trackers import ExcursionTracker
+from strategy_runner import get_stops, is_us_market_opening_soon, exit_reason, entry_side
+
+
+# Strategy knobs, the values live.py trades with
+default_params = {
+    'dollar_threshold': constants.dollar_threshold,
+    'num_bars': 7,
+    'num_ratings': 3,
+    'long_term_bars': 49,
+    'rsi_buy': 35,
+    'rsi_sell': 65,
+    'stop_multiplier': 0.7,
+    'trailing_threshold': 500,
+    'trailing_drop': 0.20,
+}
+
+
+class FillModel:
+    """
+    Market orders fill at the last trade price moved against the order by slippage_bps, take profit limit
+    orders fill at their price once a trade reaches it. Fees are charged on the notional of every fill.
+    """
+
+    def __init__(self, slippage_bps=2.0, taker_fee=0.0005, maker_fee=0.0002):
+        self.slippage = slippage_bps / 10000
+        self.taker_fee = taker_fee
+        self.maker_fee = maker_fee
+
+    def market(self, side, price):
+        return price * (1 + self.slippage) if side == 'buy' else price * (1 - self.slippage)
+
+    def fee(self, price, size, maker=False):
+        return price * size * (self.maker_fee if maker else self.taker_fee)
+
+
+class CandleSeries:
+    """Closes of the last num_candles candles of interval seconds, the forming one included like Kraken's OHLC."""
+
+    def __init__(self, interval=300, num_candles=60):
+        self.interval = interval
+        self.candles = deque(maxlen=num_candles)  # [candle start, close]
+
+    def add_trade(self, timestamp, price):
+        start = int(timestamp // self.interval) * self.interval
+        if self.candles and self.candles[-1][0] == start:
+            self.candles[-1][1] = price
+        else:
+            self.candles.append([start, price])
+
+    def __len__(self):
+        return len(self.candles)
+
+    def to_frame(self):
+        return pd.DataFrame({'close': [close for start, close in self.candles]})
+
+
+class Account:
+    """Simulated account trading one parameter set: its position, fills, closed trades and equity curve."""
+
+    def __init__(self, symbol, size, params, fill_model):
+        self.symbol = symbol
+        self.size = size
+        self.params = params
+        self.fill_model = fill_model
+        self.position = None  # dict with the tracker, fill and stops of the open position
+        self.realized = 0.0
+        self.trades = []  # closed positions
+        self.equity = []  # (timestamp, equity, position side, signal, score, rsi) at every cycle
+
+    def check_position(self, timestamp, price, volume):
+        # What the exchange and the trade-batch path of live.py do between cycles
+        position = self.position
+        tracker = position['tracker']
+        tracker.update_batch(((price, timestamp, volume),))
+
+        if position['side'] == 'long':
+            if price <= position['stop_loss']:
+                self.close(timestamp, self.fill_model.market('sell', price), 'stop_loss_order')
+            elif price >= position['take_profit']:
+                self.close(timestamp, position['take_profit'], 'take_profit_order', maker=True)
+            elif tracker.trailing_stop_hit(price, self.params['trailing_threshold'], self.params['trailing_drop']):
+                self.close(timestamp, self.fill_model.market('sell', price), 'trailing_stop')
+        else:
+            if price >= position['stop_loss']:
+                self.close(timestamp, self.fill_model.market('buy', price), 'stop_loss_order')
+            elif price <= position['take_profit']:
+                self.close(timestamp, position['take_profit'], 'take_profit_order', maker=True)
+            elif tracker.trailing_stop_hit(price, self.params['trailing_threshold'], self.params['trailing_drop']):
+                self.close(timestamp, self.fill_model.market('buy', price), 'trailing_stop')
+
+    def decide(self, now, dollar_bars, signal, rsi, current_price, market_opening):
+        """The decision part of manage_positions, with the cycle's signal and RSI."""
+        params = self.params
+        position = self.position
+
+        if market_opening:
+            if position is not None:
+                self.close_at_market(now, current_price, 'market_open_avoidance')
+
+        elif position is not None:
+            reason = exit_reason(position['side'], current_price, position['take_profit'], position['stop_loss'],
+                                 position['tracker'].dollar_volume, params['dollar_threshold'] * params['num_bars'],
+                                 signal['signal'])
+            if reason is not None:
+                self.close_at_market(now, current_price, reason)
+
+        else:
+            side = entry_side(signal['signal'], rsi, params['rsi_buy'], params['rsi_sell'])
+            if side is not None:
+                take_profit, stop_loss = get_stops(dollar_bars, side, current_price, params['stop_multiplier'])
+                self.open(now, side, current_price, take_profit, stop_loss)
+
+        self.equity.append((now, self.mark_to_market(current_price),
+                            self.position['side'] if self.position else None, signal['signal'], signal['score'], rsi))
+
+    def open(self, now, side, current_price, take_profit, stop_loss):
+        fill_price = self.fill_model.market(side, current_price)
+        fee = self.fill_model.fee(fill_price, self.size)
+        self.position = {
+            'side': 'long' if side == 'buy' else 'short',
+            'open_time': now,
+            'fill_price': fill_price,
+            'take_profit': take_profit,
+            'stop_loss': stop_loss,
+            'fees': fee,
+            # Stops and excursions are measured from the decision price, like insert_position records it
+            'tracker': ExcursionTracker(None, self.symbol, 'long' if side == 'buy' else 'short', self.size,
+                                        current_price, int(now)),
+        }
+        self.realized -= fee
+
+    def close_at_market(self, now, current_price, reason):
+        close_side = 'sell' if self.position['side'] == 'long' else 'buy'
+        self.close(now, self.fill_model.market(close_side, current_price), reason)
+
+    def close(self, now, fill_price, reason, maker=False):
+        position = self.position
+        direction = 1 if position['side'] == 'long' else -1
+        fee = self.fill_model.fee(fill_price, self.size, maker)
+        gross = (fill_price - position['fill_price']) * self.size * direction
+        self.realized += gross - fee
+
+        tracker = position['tracker']
+        self.trades.append({
+            'side': position['side'],
+            'open_time': position['open_time'],
+            'open_price': position['fill_price'],
+            'close_time': now,
+            'close_price': fill_price,
+            'size': self.size,
+            'take_profit': position['take_profit'],
+            'stop_loss': position['stop_loss'],
+            'close_reason': reason,
+            'pnl': gross - position['fees'] - fee,
+            'fees': position['fees'] + fee,
+            'max_favorable_excursion': tracker.max_favorable_excursion,
+            'max_adverse_excursion': tracker.max_adverse_excursion,
+        })
+        self.position = None
+
+    def mark_to_market(self, price):
+        equity = self.realized
+        if self.position is not None:
+            direction = 1 if self.position['side'] == 'long' else -1
+            equity += (price - self.position['fill_price']) * self.size * direction
+        return equity
+
+    def summary(self):
+        pnls = [trade['pnl'] for trade in self.trades]
+        wins = [pnl for pnl in pnls if pnl > 0]
+        losses = [pnl for pnl in pnls if pnl <= 0]
+
+        peak = 0.0
+        max_drawdown = 0.0
+        for row in self.equity:
+            peak = max(peak, row[1])
+            max_drawdown = max(max_drawdown, peak - row[1])
+
+        return {
+            'trades': len(pnls),
+            'win_rate': len(wins) / len(pnls) if pnls else 0,
+            'pnl': sum(pnls),
+            'fees': sum(trade['fees'] for trade in self.trades),
+            'profit_factor': sum(wins) / -sum(losses) if losses and sum(losses) < 0 else None,
+            'max_drawdown': max_drawdown,
+        }
+
+
+class Backtest:
+    """
+    Replays the trades of one symbol and runs the analysis cycles on the replay clock for one or more accounts.
+
+    The accounts share the dollar bars, order flow totals and candles, so they must all use the same dollar
+    threshold. Each cycle computes the signal once per distinct (num_bars, num_ratings, long_term_bars).
+    """
+
+    def __init__(self, symbol='PF_XBTUSD', params=None, fill_model=None, interval=constants.analysis_interval,
+                 hours=72, quiet=True):
+        """
+        :param params: Overrides of default_params, or a list of them for one account each.
+        :param interval: Seconds of replay time between analysis cycles.
+        :param hours: Window of the dollar bars, like the 72 hours live.py analyses.
+        :param quiet: Silence the strategy's prints during the cycles.
+        """
+        self.symbol = symbol
+        self.config = constants.symbols[symbol]
+        params_list = params if isinstance(params, list) else [params]
+        self.fill_model = fill_model or FillModel()
+        self.accounts = [Account(symbol, self.config['size'], dict(default_params, **(overrides or {})),
+                                 self.fill_model) for overrides in params_list]
+        thresholds = {account.params['dollar_threshold'] for account in self.accounts}
+        if len(thresholds) != 1:
+            raise ValueError(f"Accounts of one backtest share their bars, got thresholds {sorted(thresholds)}")
+
+        self.interval = interval
+        self.hours = hours
+        self.quiet = quiet
+        self.builder = DollarBarBuilder(thresholds.pop(), self.config['pair'], hours)
+        self.flow = BarFlow(self.builder)
+        self.candles = CandleSeries()
+        self.last_price = None
+        self.last_time = None
+        self.next_cycle = None
+        self.cycles = 0
+        self.replayed = 0
+
+    def run(self, trades, start=None, end=None):
+        """
+        :param trades: Iterable of (timestamp, price, volume, side, type_order) in time order. Trades before
+                       start only warm up the bars and candles, trading starts at start.
+        :param start: Epoch seconds of the first cycle, defaults to one bar window after the first trade.
+        :param end: Epoch seconds to stop at, defaults to the last trade.
+        :return: List of result dicts with the params, summary, closed trades and equity curve, one per account.
+        """
+        started = time.perf_counter()
+        accounts = self.accounts
+        sink = open(os.devnull, 'w') if self.quiet else None
+        try:
+            for timestamp, price, volume, side, type_order in trades:
+                if end is not None and timestamp >= end:
+                    break
+                if self.next_cycle is None:
+                    self.next_cycle = start if start is not None else timestamp + self.hours * 3600
+                if timestamp >= self.next_cycle:
+                    # One cycle per gap in the data, missed cycles would all see the same bars
+                    with contextlib.redirect_stdout(sink) if sink else contextlib.nullcontext():
+                        self.cycle(self.next_cycle)
+                    self.next_cycle += ((timestamp - self.next_cycle) // self.interval + 1) * self.interval
+
+                self.replayed += 1
+                self.last_price = price
+                self.last_time = timestamp
+                self.flow.add_trade(timestamp, price, volume, side, type_order)
+                self.candles.add_trade(timestamp, price)
+                for account in accounts:
+                    if account.position is not None:
+                        account.check_position(timestamp, price, volume)
+        finally:
+            if sink:
+                sink.close()
+
+        seconds = time.perf_counter() - started
+        results = []
+        for account in accounts:
+            if account.position is not None:
+                account.close_at_market(self.last_time, self.last_price, 'end_of_backtest')
+            summary = account.summary()
+            summary.update({'cycles': self.cycles, 'replayed': self.replayed, 'seconds': seconds})
+            results.append({
+                'symbol': self.symbol,
+                'params': account.params,
+                'start': start,
+                'end': end,
+                'summary': summary,
+                'trades': account.trades,
+                'equity': account.equity,
+            })
+        return results
+
+    def cycle(self, now):
+        """One analysis cycle of manage_positions at replay time now, for every account."""
+        self.flow.drop_expired(now)
+        self.cycles += 1
+
+        # get_stops needs 7 bars and the RSI 15 candles, live.py never runs with less than 72 hours
+        if len(self.builder.bars) < 7 or len(self.candles) <= 14:
+            return
+
+        dollar_bars = self.builder.to_frame()
+        cache = self.flow.cache()
+        rsi = get_rsi(self.candles.to_frame())
+        market_opening = is_us_market_opening_soon(datetime.fromtimestamp(now, timezone.utc))
+
+        signals = {}
+        for account in self.accounts:
+            params = account.params
+            key = (params['num_bars'], params['num_ratings'], params['long_term_bars'])
+            if key not in signals:
+                signals[key] = get_market_signal(dollar_bars, params['num_bars'], params['num_ratings'],
+                                                 self.config['pair'], cache, params['long_term_bars'])
+            account.decide(now, dollar_bars, signals[key], rsi, self.last_price, market_opening)
+
+
+def stream_trades(conn, start=None, end=None, pair=None, batch_size=100000):
+    """Yield (timestamp, price, volume, side, type_order) rows in time order, batch by batch."""
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT timestamp, price, volume, side, type_order
+    FROM trades
+    WHERE (? IS NULL OR timestamp >= ?) AND (? IS NULL OR timestamp < ?) AND (? IS NULL OR pair = ?)
+    ORDER BY timestamp ASC
+    """, (start, start, end, end, pair, pair))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield from rows
+
+
+def run_backtest(conn, symbol='PF_XBTUSD', start=None, end=None, params=None, fill_model=None, hours=72,
+                 interval=constants.analysis_interval, quiet=True):
+    """
+    Backtest over the stored trades of the symbol's pair, warming up on the hours before start.
+
+    :return: Result dict of the account, see Backtest.run.
+    """
+    backtest = Backtest(symbol, params, fill_model, interval, hours, quiet)
+    warm_up = start - hours * 3600 if start is not None else None
+    return backtest.run(stream_trades(conn, warm_up, end, backtest.config['pair']), start, end)[0]
+
+
+def create_backtest_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS backtest_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created INTEGER,
+        symbol TEXT,
+        start REAL,
+        end REAL,
+        params TEXT,
+        trades INTEGER,
+        win_rate REAL,
+        pnl REAL,
+        fees REAL,
+        max_drawdown REAL,
+        replayed INTEGER,
+        seconds REAL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS backtest_trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run_id INTEGER,
+        side TEXT,
+        open_time REAL,
+        open_price REAL,
+        close_time REAL,
+        close_price REAL,
+        size REAL,
+        take_profit REAL,
+        stop_loss REAL,
+        close_reason TEXT,
+        pnl REAL,
+        fees REAL,
+        max_favorable_excursion REAL,
+        max_adverse_excursion REAL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS backtest_equity (
+        run_id INTEGER,
+        timestamp REAL,
+        equity REAL,
+        position TEXT,
+        signal TEXT,
+        score INTEGER,
+        rsi INTEGER
+    )
+    """)
+
+
+def store_backtest(cursor, result):
+    """
+    Write a backtest result to the backtest tables. Doesn't commit.
+
+    :return: The run id.
+    """
+    create_backtest_tables(cursor)
+    summary = result['summary']
+    cursor.execute("""
+    INSERT INTO backtest_runs (created, symbol, start, end, params, trades, win_rate, pnl, fees, max_drawdown,
+                               replayed, seconds)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (int(time.time()), result['symbol'], result['start'], result['end'], json.dumps(result['params']),
+          summary['trades'], summary['win_rate'], summary['pnl'], summary['fees'], summary['max_drawdown'],
+          summary['replayed'], summary['seconds']))
+    run_id = cursor.lastrowid
+
+    cursor.executemany("""
+    INSERT INTO backtest_trades (run_id, side, open_time, open_price, close_time, close_price, size, take_profit,
+                                 stop_loss, close_reason, pnl, fees, max_favorable_excursion, max_adverse_excursion)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(run_id, trade['side'], trade['open_time'], trade['open_price'], trade['close_time'],
+           trade['close_price'], trade['size'], trade['take_profit'], trade['stop_loss'], trade['close_reason'],
+           trade['pnl'], trade['fees'], trade['max_favorable_excursion'], trade['max_adverse_excursion'])
+          for trade in result['trades']])
+    cursor.executemany("INSERT INTO backtest_equity VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(run_id,) + row for row in result['equity']])
+    return run_id
+
+
+def parse_params(pairs):
+    """Turn ['rsi_buy=30', 'stop_multiplier=0.8'] into a params dict, values typed like default_params."""
+    params = {}
+    for pair in pairs:
+        name, value = pair.split('=', 1)
+        if name not in default_params:
+            raise ValueError(f"Unknown parameter {name}, expected one of {', '.join(default_params)}")
+        params[name] = type(default_params[name])(float(value))
+    return params
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay stored trades through the live strategy.")
+    parser.add_argument('--symbol', default='PF_XBTUSD')
+    parser.add_argument('--start', type=float, default=None, help="first cycle, Unix seconds")
+    parser.add_argument('--end', type=float, default=None, help="end, Unix seconds")
+    parser.add_argument('--days', type=float, default=None, help="last N days of the table, instead of --start")
+    parser.add_argument('--param', action='append', default=[], help="strategy parameter override, name=value")
+    parser.add_argument('--slippage-bps', type=float, default=2.0)
+    parser.add_argument('--taker-fee', type=float, default=0.0005)
+    parser.add_argument('--maker-fee', type=float, default=0.0002)
+    parser.add_argument('--verbose', action='store_true', help="keep the strategy's prints")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(constants.db_path)
+    cursor = conn.cursor()
+
+    start, end = args.start, args.end
+    if args.days is not None:
+        cursor.execute("SELECT MAX(timestamp) FROM trades WHERE pair = ?", (constants.symbols[args.symbol]['pair'],))
+        end = end if end is not None else cursor.fetchone()[0]
+        start = end - args.days * 86400
+
+    fill_model = FillModel(args.slippage_bps, args.taker_fee, args.maker_fee)
+    result = run_backtest(conn, args.symbol, start, end, parse_params(args.param), fill_model,
+                          quiet=not args.verbose)
+
+    run_id = store_backtest(cursor, result)
+    conn.commit()
+    conn.close()
+
+    summary = result['summary']
+    print(f"Run {run_id}: {summary['trades']} trades, win rate {summary['win_rate'] * 100:.1f}%, "
+          f"PnL {summary['pnl']:.2f}, fees {summary['fees']:.2f}, max drawdown {summary['max_drawdown']:.2f}")
+    print(f"Replayed {summary['replayed']} trades and {summary['cycles']} cycles in {summary['seconds']:.1f}s "
+          f"({summary['replayed'] / summary['seconds']:,.0f} trades/s)")
+
+
+if __name__ == '__main__':
+    main()
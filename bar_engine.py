@@ -0,0 +1,374 @@
+"""
+Tick, volume, dollar and imbalance bars of one trade stream, any number of series built in a single scan.
+
+    python bar_engine.py --days 7 --bars dollar:2500000 --bars dollar:3500000 --bars volume:60 \\
+        --bars tick:1500 --bars tick_imbalance:1500 --bars volume_imbalance:1500
+
+Every series has the bar schema of DollarBarBuilder (open, high, low, close, dollar volume, start and end
+time) plus the volume and trade count, and keeps the order flow totals of its bars, so each one feeds
+calculate_order_flow_metrics and get_market_signal like the live dollar bars do.
+
+The command replays the stored trades, computes every series' signal each analysis interval and prints
+how often each one signalled and the return over the following horizon in the signal's direction.
+"""
+import argparse
+import contextlib
+import os
+import sqlite3
+import statistics
+import time
+from collections import deque
+
+import pandas as pd
+
+import constants
+from get_signals import get_market_signal
+from indicators import AdjustedEWM
+from order_flow_tools import trade_totals
+
+
+bar_columns = ['open', 'high', 'low', 'close', 'dollar_volume', 'start_time', 'end_time', 'volume', 'ticks']
+
+
+class BarBuilder:
+    """
+    Bars closed by a rule on the trades they hold, the common part of every bar type.
+
+    Completed bars are (open, high, low, close, dollar_volume, start_time, end_time, volume, ticks) tuples,
+    times in epoch seconds. The trade that closes a bar opens the next one at its price and time, without
+    counting its volume twice, like create_dollar_bars. Bars older than the window are dropped.
+    """
+
+    def __init__(self, threshold, hours=72):
+        self.threshold = threshold
+        self.hours = hours
+        self.bars = []
+        self.partial = None  # [open, high, low, close, dollar_volume, start_time, volume, ticks] of the bar being built
+        self.completed = 0  # bars completed since the builder was created, expired ones included
+        self.metrics = {}  # (start, end) of a completed bar -> cached order flow totals, see order_flow_tools
+
+    def closes(self, bar, price, volume, side):
+        """Whether the bar being built, the trade already added, is complete. Defined by each bar type."""
+        raise NotImplementedError
+
+    def add_trade(self, timestamp, price, volume, side=None):
+        if self.partial is None:
+            self.partial = [price, price, price, price, 0, timestamp, 0, 0]
+
+        bar = self.partial
+        bar[1] = max(bar[1], price)
+        bar[2] = min(bar[2], price)
+        bar[3] = price
+        bar[4] += price * volume
+        bar[6] += volume
+        bar[7] += 1
+
+        if self.closes(bar, price, volume, side):
+            self.bars.append((bar[0], bar[1], bar[2], bar[3], bar[4], bar[5], timestamp, bar[6], bar[7]))
+            self.completed += 1
+            self.partial = [price, price, price, price, 0, timestamp, 0, 0]
+
+    def drop_expired(self, now=None):
+        """
+        :param now: Epoch seconds the window ends at, the wall clock by default. Backtests pass the replay time.
+        """
+        cutoff = (now if now is not None else time.time()) - self.hours * 3600
+        expired = 0
+        while expired < len(self.bars) and self.bars[expired][5] < cutoff:
+            expired += 1
+        if expired:
+            for bar in self.bars[:expired]:
+                self.metrics.pop((int(bar[5]), int(bar[6])), None)
+            del self.bars[:expired]
+
+    def to_frame(self):
+        """Completed bars in the DataFrame layout of create_dollar_bars, with the volume and ticks columns added."""
+        bars = pd.DataFrame(self.bars, columns=bar_columns)
+        bars['start_time'] = pd.to_datetime(bars['start_time'], unit='s')
+        bars['end_time'] = pd.to_datetime(bars['end_time'], unit='s')
+        return bars
+
+
+class DollarBars(BarBuilder):
+    """A bar closes once it traded threshold dollars."""
+
+    def closes(self, bar, price, volume, side):
+        return bar[4] >= self.threshold
+
+
+class VolumeBars(BarBuilder):
+    """A bar closes once it traded threshold units of the base currency."""
+
+    def closes(self, bar, price, volume, side):
+        return bar[6] >= self.threshold
+
+
+class TickBars(BarBuilder):
+    """A bar closes after threshold trades."""
+
+    def closes(self, bar, price, volume, side):
+        return bar[7] >= self.threshold
+
+
+class ImbalanceBars(BarBuilder):
+    """
+    A bar closes once the signed flow inside it exceeds what is expected of a bar: |sum of b| >= E[T] * |E[b]|,
+    b being +1 / -1 per buy / sell trade (tick imbalance) or the signed volume (volume imbalance).
+
+    E[T], the trades per bar, is an EWMA over the completed bars starting at expected_ticks, and E[b] an EWMA
+    over the trades. Balanced flow drives E[b] towards 0 and the bars towards a single trade, so a bar
+    holds between expected_ticks / clamp and expected_ticks * clamp trades whatever the estimates say.
+    """
+
+    def __init__(self, expected_ticks, hours=72, weight='tick', bar_span=20, trade_span=None, clamp=4):
+        """
+        :param expected_ticks: Trades per bar before any bar completed, the threshold of the series.
+        :param weight: 'tick' or 'volume'.
+        :param bar_span: EWMA span of E[T], in bars.
+        :param trade_span: EWMA span of E[b], in trades, expected_ticks by default.
+        """
+        super().__init__(expected_ticks, hours)
+        self.weight = weight
+        self.min_ticks = max(1, int(expected_ticks // clamp))
+        self.max_ticks = int(expected_ticks * clamp)
+        self.expected_ticks = AdjustedEWM(2 / (bar_span + 1))
+        self.expected_imbalance = AdjustedEWM(2 / ((trade_span or expected_ticks) + 1))
+        self.imbalance = 0.0  # signed flow of the bar being built
+
+    def closes(self, bar, price, volume, side):
+        signed = 1.0 if side == 'buy' else -1.0
+        if self.weight == 'volume':
+            signed *= volume
+
+        # The expectation only includes the trades before this one
+        expected_imbalance = self.expected_imbalance.value
+        self.expected_imbalance.update(signed)
+        self.imbalance += signed
+
+        ticks = bar[7]
+        if ticks < self.min_ticks:
+            return False
+        if ticks < self.max_ticks and not abs(self.imbalance) >= self.expected_bar_ticks() * abs(expected_imbalance):
+            return False
+
+        self.expected_ticks.update(ticks)
+        self.imbalance = 0.0
+        return True
+
+    def expected_bar_ticks(self):
+        expected = self.expected_ticks.value
+        return expected if expected == expected else self.threshold
+
+
+bar_types = {
+    'dollar': DollarBars,
+    'volume': VolumeBars,
+    'tick': TickBars,
+    'tick_imbalance': lambda threshold, hours: ImbalanceBars(threshold, hours, 'tick'),
+    'volume_imbalance': lambda threshold, hours: ImbalanceBars(threshold, hours, 'volume'),
+}
+
+
+def parse_bar_spec(spec, hours=72):
+    """Turn 'dollar:3500000', 'volume:60', 'tick:1500' or 'tick_imbalance:1500' into a builder."""
+    kind, threshold = spec.split(':', 1)
+    if kind not in bar_types:
+        raise ValueError(f"Unknown bar type {kind}, expected one of {', '.join(bar_types)}")
+    threshold = float(threshold)
+    return bar_types[kind](int(threshold) if threshold.is_integer() else threshold, hours)
+
+
+class BarFlow:
+    """
+    Order flow totals of the builder's completed bars, accumulated from the replayed trades.
+
+    Matches bar_trade_totals: a bar keyed (start, end) in whole seconds counts every trade with
+    start <= timestamp <= end, so a trade in a boundary second counts in both bars. A bar's totals are final
+    once a trade after its end second arrives and are then stored in builder.metrics, which
+    calculate_order_flow_metrics uses as its cache. Until then they are recomputed at each analysis.
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.recent = deque()  # (timestamp, side, volume, type_order) since the oldest bar still open
+        self.unsettled = deque()  # keys of completed bars that can still gain trades
+        self.completed = len(builder.bars)
+
+    def add_trade(self, timestamp, price, volume, side, type_order):
+        builder = self.builder
+        while self.unsettled and self.unsettled[0][1] < timestamp:
+            key = self.unsettled.popleft()
+            builder.metrics[key] = self.totals(key)
+
+        self.recent.append((timestamp, side, volume, type_order))
+        builder.add_trade(timestamp, price, volume, side)
+        if len(builder.bars) > self.completed:
+            bar = builder.bars[-1]
+            self.unsettled.append((int(bar[5]), int(bar[6])))
+            self.completed = len(builder.bars)
+
+        # Trades before the first second any open bar covers can't count anymore
+        floor = int(builder.partial[5])
+        if self.unsettled:
+            floor = min(floor, self.unsettled[0][0])
+        while self.recent[0][0] < floor:
+            self.recent.popleft()
+
+    def totals(self, key):
+        start, end = key
+        return trade_totals((side, volume, type_order) for timestamp, side, volume, type_order in self.recent
+                            if start <= timestamp <= end)
+
+    def drop_expired(self, now):
+        self.builder.drop_expired(now)
+        self.completed = len(self.builder.bars)
+
+    def cache(self):
+        """Metrics cache for calculate_order_flow_metrics, with the totals so far of the unsettled bars."""
+        for key in self.unsettled:
+            self.builder.metrics[key] = self.totals(key)
+        return self.builder.metrics
+
+
+class BarEngine:
+    """Several bar series of one trade stream, each trade is read once and fed to all of them."""
+
+    def __init__(self, builders):
+        """
+        :param builders: Dict of name -> BarBuilder, DollarBarBuilder included.
+        """
+        self.flows = {name: BarFlow(builder) for name, builder in builders.items()}
+
+    def add_trade(self, timestamp, price, volume, side, type_order):
+        for flow in self.flows.values():
+            flow.add_trade(timestamp, price, volume, side, type_order)
+
+    def run(self, trades):
+        """
+        :param trades: Iterable of (timestamp, price, volume, side, type_order) in time order.
+        :return: Number of trades read.
+        """
+        flows = list(self.flows.values())
+        count = 0
+        for timestamp, price, volume, side, type_order in trades:
+            for flow in flows:
+                flow.add_trade(timestamp, price, volume, side, type_order)
+            count += 1
+        return count
+
+    def drop_expired(self, now=None):
+        for flow in self.flows.values():
+            flow.drop_expired(now)
+
+    def frames(self):
+        return {name: flow.builder.to_frame() for name, flow in self.flows.items()}
+
+    def signals(self, num_bars=7, num_ratings=3, pair=None, long_term_bars=49):
+        """
+        :return: Dict of name -> get_market_signal result, None for a series without bars yet.
+        """
+        signals = {}
+        for name, flow in self.flows.items():
+            if not flow.builder.bars:
+                signals[name] = None
+                continue
+            signals[name] = get_market_signal(flow.builder.to_frame(), num_bars, num_ratings, pair, flow.cache(),
+                                              long_term_bars)
+        return signals
+
+
+def compare_signals(engine, trades, start, interval=constants.analysis_interval, horizon=1800, pair=None):
+    """
+    Replay the trades through the engine and score every series' signal at each analysis interval from start
+    on by the return over the next horizon seconds, taken in the signal's direction.
+
+    :return: Dict of name -> dict with the bars, buy and sell signals, hit rate and mean return in basis points.
+    """
+    cycles = []  # (time, price, {name: signal})
+    next_cycle = start
+    last_price = None
+    sink = open(os.devnull, 'w')
+    try:
+        for timestamp, price, volume, side, type_order in trades:
+            if timestamp >= next_cycle and last_price is not None:
+                engine.drop_expired(next_cycle)
+                with contextlib.redirect_stdout(sink):
+                    signals = engine.signals(pair=pair)
+                cycles.append((next_cycle, last_price, {name: signal['signal'] if signal else None
+                                                        for name, signal in signals.items()}))
+                next_cycle += ((timestamp - next_cycle) // interval + 1) * interval
+            engine.add_trade(timestamp, price, volume, side, type_order)
+            last_price = price
+    finally:
+        sink.close()
+
+    steps = max(1, int(horizon // interval))
+    report = {}
+    for name, flow in engine.flows.items():
+        returns = []
+        counts = {'buy': 0, 'sell': 0}
+        for (cycle_time, price, signals), (later_time, later_price, _) in zip(cycles, cycles[steps:]):
+            signal = signals[name]
+            if signal not in counts:
+                continue
+            counts[signal] += 1
+            direction = 1 if signal == 'buy' else -1
+            returns.append(direction * (later_price - price) / price * 10000)
+
+        bars = flow.builder.bars
+        report[name] = {
+            'bars': flow.builder.completed,
+            'median_bar_seconds': statistics.median(bar[6] - bar[5] for bar in bars) if bars else None,
+            'buy_signals': counts['buy'],
+            'sell_signals': counts['sell'],
+            'hit_rate': sum(value > 0 for value in returns) / len(returns) if returns else None,
+            'mean_return_bps': statistics.fmean(returns) if returns else None,
+        }
+    return report
+
+
+def main():
+    from backtest import stream_trades
+
+    parser = argparse.ArgumentParser(description="Compare the signals of several bar types over stored trades.")
+    parser.add_argument('--symbol', default='PF_XBTUSD')
+    parser.add_argument('--bars', action='append', default=[], help="type:threshold, e.g. dollar:3500000, "
+                                                                    "volume:60, tick:1500, tick_imbalance:1500")
+    parser.add_argument('--start', type=float, default=None, help="first cycle, Unix seconds")
+    parser.add_argument('--end', type=float, default=None, help="end, Unix seconds")
+    parser.add_argument('--days', type=float, default=None, help="last N days of the table, instead of --start")
+    parser.add_argument('--hours', type=float, default=72, help="bar window, also warmed up before the start")
+    parser.add_argument('--horizon', type=float, default=30, help="minutes a signal is scored over")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(constants.db_path)
+    cursor = conn.cursor()
+    pair = constants.symbols[args.symbol]['pair']
+
+    start, end = args.start, args.end
+    if args.days is not None:
+        cursor.execute("SELECT MAX(timestamp) FROM trades WHERE pair = ?", (pair,))
+        end = end if end is not None else cursor.fetchone()[0]
+        start = end - args.days * 86400
+    if start is None:
+        cursor.execute("SELECT MIN(timestamp) FROM trades WHERE pair = ?", (pair,))
+        start = cursor.fetchone()[0] + args.hours * 3600
+
+    specs = args.bars or [f'dollar:{constants.dollar_threshold}']
+    engine = BarEngine({spec: parse_bar_spec(spec, args.hours) for spec in specs})
+
+    started = time.perf_counter()
+    report = compare_signals(engine, stream_trades(conn, start - args.hours * 3600, end, pair), start,
+                             horizon=args.horizon * 60, pair=pair)
+    print(f"Replayed in {time.perf_counter() - started:.1f}s, signals scored over {args.horizon:g} minutes")
+    for name, row in report.items():
+        hit_rate = f"{row['hit_rate'] * 100:.1f}%" if row['hit_rate'] is not None else 'n/a'
+        mean_return = f"{row['mean_return_bps']:.2f} bps" if row['mean_return_bps'] is not None else 'n/a'
+        duration = f"{row['median_bar_seconds']:.0f}s" if row['median_bar_seconds'] is not None else 'n/a'
+        print(f"{name}: {row['bars']} bars, median {duration}, "
+              f"{row['buy_signals']} buy / {row['sell_signals']} sell, hit rate {hit_rate}, mean {mean_return}")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
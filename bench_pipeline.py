@@ -0,0 +1,318 @@
+"""
+Stage-by-stage benchmark of the trade pipeline on synthetic trades, with scaling curves and a JSON report.
+
+    TRADING_DB=bench.db python bench_pipeline.py --sizes 10000,100000,1000000 --output bench.json
+    TRADING_DB=bench.db python bench_pipeline.py --sizes 10000,100000,1000000 --compare bench.json
+
+For every size the trades table is refilled with that many trades of trade_generator (same seed, so runs
+compare), then each stage is timed on them: insert_trade, fetch_trades, create_dollar_bars,
+calculate_order_flow_metrics, calculate_volume_profile, get_market_signal (without and with the metrics
+cache) and get_rsi. A stage runs --repeat times for the timings, then once more under tracemalloc for its
+peak memory, so the tracing doesn't slow the timed runs. What the stages print goes to /dev/null.
+
+insert_trade writes the stream the way the websocket loop does, in small batches with one commit each, so it
+is timed on at most --insert-trades trades. The report holds the seconds, throughput and peak memory of
+every stage and size, and the exponent of each stage's time against its input size: about 1 is linear.
+With --compare, stages more than --tolerance slower than in an earlier report are listed and the exit
+status is 1.
+
+The benchmark clears the trades table, so TRADING_DB has to point at a scratch database.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+import constants
+from candles import CandleBuilder
+from dollar_bars import DollarBarBuilder, fetch_trades, create_dollar_bars
+from get_signals import get_market_signal, get_rsi
+from ingest import store_trades
+from order_flow_tools import calculate_order_flow_metrics
+from position_trackers import PositionTrackers
+from schema import create_trades_table, create_candles_table
+from trade_generator import TradeGenerator, write_database
+from volume_profile_tools import calculate_volume_profile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def kraken_batches(chunk, batch_size):
+    """Trades of a generator chunk as websocket trade messages: [price, volume, time, side, type, misc]."""
+    sides = np.array(['s', 'b'])[chunk['side']].tolist()
+    order_types = np.array(['l', 'm'])[chunk['market']].tolist()
+    trades = [[f'{price:.1f}', f'{volume:.8f}', f'{timestamp:.4f}', side, order_type, '']
+              for price, volume, timestamp, side, order_type in zip(chunk['price'].tolist(), chunk['volume'].tolist(),
+                                                                   chunk['timestamp'].tolist(), sides, order_types)]
+    return [trades[index:index + batch_size] for index in range(0, len(trades), batch_size)]
+
+
+def minute_candles(conn, pair):
+    """1 minute candles of the trades table in Kraken's OHLC row layout, the input of calculate_volume_profile."""
+    frame = pd.read_sql_query("SELECT timestamp, price, volume FROM trades WHERE pair = ? ORDER BY timestamp",
+                              conn, params=(pair,))
+    minutes = (frame['timestamp'] // 60 * 60).astype(np.int64)
+    grouped = frame.assign(value=frame['price'] * frame['volume']).groupby(minutes)
+    candles = pd.DataFrame({
+        'open': grouped['price'].first(),
+        'high': grouped['price'].max(),
+        'low': grouped['price'].min(),
+        'close': grouped['price'].last(),
+        'vwap': grouped['value'].sum() / grouped['volume'].sum(),
+        'volume': grouped['volume'].sum(),
+        'count': grouped['price'].size(),
+    })
+    return [[time_, *row] for time_, row in zip(candles.index.tolist(), candles.itertuples(index=False, name=None))]
+
+
+def measure(function, args, repeat):
+    """
+    Time a call repeat times, then run it once more under tracemalloc for its peak allocation.
+
+    :return: (list of seconds, peak bytes)
+    """
+    seconds = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function(*args)
+            seconds.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            function(*args)
+            peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+    return seconds, peak
+
+
+def stage_result(stage, size, rows, unit, seconds, peak):
+    median = statistics.median(seconds)
+    return {
+        'stage': stage,
+        'size': size,  # trades in the table
+        'rows': rows,  # input of the stage, in unit
+        'unit': unit,
+        'seconds': seconds,
+        'median': median,
+        'min': min(seconds),
+        'throughput': rows / median if median else None,  # units per second
+        'peak_bytes': peak,
+    }
+
+
+def clear_trades(conn):
+    cursor = conn.cursor()
+    cursor.execute(create_trades_table)
+    cursor.execute(create_candles_table)  # insert_trade stores the candles it closes
+    cursor.execute("DELETE FROM trades")
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'trades'")
+    conn.commit()
+
+
+def bench_insert_trade(conn, args, size):
+    # The websocket loop's work on every message: store the batch, feed the trackers and candles, commit
+    cursor = conn.cursor()
+    symbol = next((symbol for symbol, config in constants.symbols.items() if config['pair'] == args.pair), None)
+    position_trackers = PositionTrackers(cursor, {symbol: args.pair} if symbol else None)
+    candle_builder = CandleBuilder(args.pair)
+
+    count = min(size, args.insert_trades)
+    parts = list(TradeGenerator(args.seed, time.time() - 3600).chunks(count))
+    batches = kraken_batches({name: np.concatenate([part[name] for part in parts]) for name in parts[0]}, args.batch)
+
+    def insert_all():
+        for batch in batches:
+            store_trades(cursor, batch, args.pair, position_trackers, symbol, candle_builder)
+            conn.commit()
+
+    seconds, peak = measure(insert_all, (), 1)
+    clear_trades(conn)
+    return stage_result('insert_trade', size, count, 'trades', seconds, peak)
+
+
+def bench_size(conn, args, size):
+    """Refill the trades table with size trades and time every stage on them."""
+    results = []
+
+    def run(stage, function, stage_args, rows, unit):
+        if stage in args.skip:
+            return
+        seconds, peak = measure(function, stage_args, args.repeat)
+        results.append(stage_result(stage, size, rows, unit, seconds, peak))
+        print(f"  {stage}: {results[-1]['median'] * 1000:,.1f} ms, {results[-1]['throughput']:,.0f} {unit}/s, "
+              f"peak {peak / 1e6:,.1f} MB")
+
+    clear_trades(conn)
+    if 'insert_trade' not in args.skip:
+        results.append(bench_insert_trade(conn, args, size))
+        print(f"  insert_trade: {results[-1]['throughput']:,.0f} trades/s")
+
+    generator = TradeGenerator(args.seed)
+    generator.time = time.time() - generator.expected_span(size)
+    started = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        write_database(conn, generator, size, args.pair)
+    results.append(stage_result('generate_trades', size, size, 'trades', [time.perf_counter() - started], None))
+
+    # Every trade falls in the window, some of the last ones can be slightly in the future
+    first = conn.execute("SELECT MIN(timestamp) FROM trades").fetchone()[0]
+    hours = math.ceil((time.time() - first) / 3600) + 1
+
+    run('fetch_trades', fetch_trades, (hours, args.pair), size, 'trades')
+    trade_data = fetch_trades(hours, args.pair)
+    run('create_dollar_bars', create_dollar_bars, (trade_data, args.threshold), size, 'trades')
+    del trade_data
+
+    # The later stages take the bars the live loop has, from the incremental builder
+    builder = DollarBarBuilder(args.threshold, args.pair, hours)
+    builder.update()
+    bars = builder.to_frame()
+    if bars.empty:
+        print("  no dollar bars at this size, the bar stages are skipped")
+    else:
+        run('calculate_order_flow_metrics', calculate_order_flow_metrics, (bars, args.pair), len(bars), 'bars')
+        run('get_market_signal', get_market_signal, (bars, args.num_bars, 3, args.pair), len(bars), 'bars')
+        metrics_cache = {}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            get_market_signal(bars, args.num_bars, 3, args.pair, metrics_cache)
+        run('get_market_signal_cached', get_market_signal, (bars, args.num_bars, 3, args.pair, metrics_cache),
+            len(bars), 'bars')
+        if len(bars) > 14:  # get_rsi needs a full period
+            run('get_rsi', get_rsi, (bars,), len(bars), 'bars')
+
+    minute_bars = minute_candles(conn, args.pair)
+    run('calculate_volume_profile', calculate_volume_profile, (minute_bars,), len(minute_bars), 'candles')
+    return results
+
+
+def scaling_exponents(results):
+    """Slope of log(seconds) against log(rows) per stage, over the sizes it ran at."""
+    exponents = {}
+    for stage in dict.fromkeys(result['stage'] for result in results):
+        points = [(result['rows'], result['median']) for result in results
+                  if result['stage'] == stage and result['rows'] and result['median']]
+        if len({rows for rows, _ in points}) >= 2:
+            rows, seconds = np.log(np.array(points)).T
+            exponents[stage] = round(float(np.polyfit(rows, seconds, 1)[0]), 3)
+    return exponents
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'commit': commit,
+    }
+
+
+def compare_reports(report, previous, tolerance):
+    """
+    :return: List of (stage, size, previous median, median) of the stages slower by more than tolerance.
+    """
+    earlier = {(result['stage'], result['size']): result['median'] for result in previous['results']}
+    regressions = []
+    for result in report['results']:
+        before = earlier.get((result['stage'], result['size']))
+        if before is None or result['stage'] == 'generate_trades':
+            continue
+        ratio = result['median'] / before if before else math.inf
+        flag = '  REGRESSION' if ratio > 1 + tolerance else ''
+        print(f"{result['stage']:<30} {result['size']:>11,} {before * 1000:>12,.1f} ms -> "
+              f"{result['median'] * 1000:>12,.1f} ms  x{ratio:.2f}{flag}")
+        if flag:
+            regressions.append((result['stage'], result['size'], before, result['median']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the trade pipeline stage by stage on synthetic trades.")
+    parser.add_argument('--sizes', default='10000,100000,1000000', help="comma-separated trade counts")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--pair', default='XBT/USD')
+    parser.add_argument('--threshold', type=float, default=constants.dollar_threshold, help="dollar bar size")
+    parser.add_argument('--num-bars', type=int, default=constants.symbols['PF_XBTUSD']['num_bars'])
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage")
+    parser.add_argument('--insert-trades', type=int, default=20000, help="most trades timed through insert_trade")
+    parser.add_argument('--batch', type=int, default=10, help="trades per insert_trade call, like one message")
+    parser.add_argument('--skip', action='append', default=[], help="stage to leave out, repeatable")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', default=None, help="earlier report to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(constants.db_path)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'trades' in tables and conn.execute("SELECT COUNT(*) FROM trades").fetchone()[0]:
+        if 'bench_runs' not in tables:
+            sys.exit(f"{constants.db_path} already holds trades, point TRADING_DB at a scratch database")
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_runs (started INTEGER)")  # marks the database as the benchmark's
+    conn.execute("INSERT INTO bench_runs (started) VALUES (?)", (int(time.time()),))
+    conn.commit()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(),
+        'params': {'sizes': sizes, 'seed': args.seed, 'pair': args.pair, 'threshold': args.threshold,
+                   'num_bars': args.num_bars, 'repeat': args.repeat, 'insert_trades': args.insert_trades,
+                   'batch': args.batch},
+        'environment': environment(),
+        'results': [],
+        'max_rss_bytes': {},
+    }
+
+    for size in sizes:
+        print(f"{size:,} trades")
+        report['results'] += bench_size(conn, args, size)
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS, and never goes down within the process
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report['max_rss_bytes'][size] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+    report['scaling'] = scaling_exponents(report['results'])
+    print("Scaling exponents (seconds ~ rows^k):")
+    for stage, exponent in report['scaling'].items():
+        print(f"  {stage:<30} {exponent}")
+
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+        regressions = compare_reports(report, previous, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} stages slower than {args.compare} by more than {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import requests
+
+import kraken_toolbox
+
+
+# Variables
+num_cycles = 50  # Number of analysis cycles to time for each client
+handshake_ms = 30  # Simulated TCP + TLS setup cost paid once per new connection
+response_ms = 5  # Simulated server processing time per request
+pair = 'XXBTZUSD'
+symbol = 'PF_XBTUSD'
+interval = 5
+
+
+def make_candles(start, count):
+    price = 60000.0
+    candles = []
+    for i in range(count):
+        candles.append([start + i * interval * 60, str(price), str(price + 20), str(price - 20),
+                        str(price + 5), str(price), '12.5', 340])
+        price += 5
+    return candles
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers the public Kraken endpoints used by kraken_toolbox with canned payloads."""
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def setup(self):
+        super().setup()
+        time.sleep(handshake_ms / 1000)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        time.sleep(response_ms / 1000)
+
+        if url.path.endswith('/OHLC'):
+            now = int(time.time()) // (interval * 60) * (interval * 60)
+            since = int(params['since'][0]) if 'since' in params else now - 720 * interval * 60
+            count = max(1, min(720, (now - since) // (interval * 60) + 1))
+            candles = make_candles(now - (count - 1) * interval * 60, count)
+            body = {'error': [], 'result': {pair: candles, 'last': candles[-1][0] - interval * 60}}
+        elif url.path.endswith('/tickers'):
+            tickers = [{'symbol': f'PF_{i}USD', 'last': 1.0, 'bid': 1.0, 'ask': 1.0} for i in range(300)]
+            tickers.append({'symbol': symbol, 'last': 60000.0, 'bid': 59999.5, 'ask': 60000.5})
+            body = {'result': 'success', 'tickers': tickers}
+        elif url.path.endswith('/instruments'):
+            body = {'result': 'success', 'instruments': [{'symbol': f'PF_{i}USD'} for i in range(300)]}
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def baseline_cycle(base, open_timestamp):
+    # What every cycle cost before the shared session: one-shot requests without pooling or caching
+    requests.get(base + '/derivatives/api/v3/tickers').json()
+    requests.get(base + '/0/public/OHLC', params={'pair': pair, 'interval': interval}).json()
+    requests.get(base + '/0/public/OHLC', params={'pair': pair, 'interval': interval,
+                                                  'since': open_timestamp}).json()
+    requests.get(base + '/derivatives/api/v3/instruments').json()
+
+
+def session_cycle(open_timestamp):
+    kraken_toolbox.fetch_live_price(symbol)
+    kraken_toolbox.fetch_last_n_candles(pair, interval, 60)
+    kraken_toolbox.fetch_candles_since(pair, interval, open_timestamp)
+    kraken_toolbox.get_instruments()
+
+
+def time_cycles(cycle, *args):
+    timings = []
+    for _ in range(num_cycles):
+        start = time.perf_counter()
+        cycle(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def summarize(name, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(f"{name:<10} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms   "
+          f"mean {statistics.mean(timings):8.2f} ms")
+
+
+"""__________________________________________________________________________________________________________________"""
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+# Point the toolbox at the stub server
+kraken_toolbox.spot_api_url = base_url + '/0/public'
+kraken_toolbox.api_url = base_url + '/derivatives/api/v3'
+
+position_open = int(time.time()) - 6 * 3600
+
+baseline = time_cycles(baseline_cycle, base_url, position_open)
+pooled = time_cycles(session_cycle, position_open)
+
+print(f"Per-cycle REST latency over {num_cycles} cycles "
+      f"({handshake_ms} ms simulated handshake, {response_ms} ms server time):")
+summarize('baseline', baseline)
+summarize('session', pooled)
+print(f"Median improvement: {statistics.median(baseline) - statistics.median(pooled):.2f} ms per cycle")
+
+server.shutdown()
@@ -0,0 +1,251 @@
+import time
+from collections import deque
+
+import constants
+import kraken_toolbox
+from schema import create_candles_table
+
+
+class CandleBuilder:
+    """
+    OHLCV, VWAP and trade count candles of one pair at several intervals, updated trade by trade from the
+    ingested stream.
+
+    Rows have the layout of Kraken's OHLC endpoint, [time, open, high, low, close, vwap, volume, count], and
+    the last one is the candle still forming, so to_frame returns what fetch_last_n_candles would. Closed
+    candles are kept in memory and written to the candles table, REST is only used to backfill gaps.
+
+    A period without trades on the stream is a quiet market, not a gap: it gets a flat candle at the last
+    close with no volume. Only silences longer than quiet_limit, and the downtime load finds in the trades
+    table, are left as gaps for backfill.
+    """
+
+    def __init__(self, pair, intervals=constants.candle_intervals, history=constants.candle_history,
+                 quiet_limit=constants.candle_quiet_limit):
+        """
+        :param pair: Pair of the trades in the trades table, e.g. 'XBT/USD'.
+        :param intervals: Candle intervals in minutes.
+        :param history: Closed candles kept in memory per interval.
+        :param quiet_limit: Longest silence in seconds filled with flat candles.
+        """
+        self.pair = pair
+        self.intervals = tuple(intervals)
+        self.history = history
+        self.quiet_limit = quiet_limit
+        self.closed = {interval: deque(maxlen=history) for interval in self.intervals}
+        # [time, open, high, low, close, SUM(price * volume), volume, count] of the candle being formed
+        self.forming = {interval: None for interval in self.intervals}
+        self.pending = []  # (interval, row) closed since the last persist
+
+    def update(self, interval, timestamp, price, volume, fill_quiet=True):
+        """
+        :param fill_quiet: Fill the periods without trades since the forming candle with flat candles, off
+                           when replaying stored trades that may have a downtime in them.
+        """
+        seconds = interval * 60
+        start = int(timestamp // seconds * seconds)
+        candle = self.forming[interval]
+        if candle is not None and start == candle[0] and not candle[7]:
+            candle = None  # flat candle of a quiet period so far, its first trade opens it
+
+        if candle is None or start > candle[0]:
+            if candle is not None:
+                self.advance(interval, start, fill_quiet)
+            self.forming[interval] = [start, price, price, price, price, price * volume, volume, 1]
+        elif start == candle[0]:
+            if price > candle[2]:
+                candle[2] = price
+            if price < candle[3]:
+                candle[3] = price
+            candle[4] = price
+            candle[5] += price * volume
+            candle[6] += volume
+            candle[7] += 1
+        # A trade older than the forming candle arrived late, its candle is already closed and stored
+
+    def advance(self, interval, start, fill_quiet=True):
+        """Close the forming candle for a later period starting at start, with flat candles in between."""
+        seconds = interval * 60
+        candle = self.forming[interval]
+        self.close_candle(interval, candle)
+        if fill_quiet and start - candle[0] - seconds <= self.quiet_limit:
+            close = candle[4]
+            for quiet in range(candle[0] + seconds, start, seconds):
+                self.close_candle(interval, [quiet, close, close, close, close, 0.0, 0.0, 0])
+
+    def catch_up(self, now=None):
+        """
+        Bring the candles up to the clock when no trade came since the forming candle's period ended: it is
+        closed, the quiet periods since get flat candles and the current one a flat forming candle.
+        """
+        now = time.time() if now is None else now
+        for interval in self.intervals:
+            seconds = interval * 60
+            start = int(now // seconds * seconds)
+            candle = self.forming[interval]
+            if candle is None or start <= candle[0] or start - candle[0] - seconds > self.quiet_limit:
+                continue
+            self.advance(interval, start)
+            close = candle[4]
+            self.forming[interval] = [start, close, close, close, close, 0.0, 0.0, 0]
+
+    def add_trade(self, timestamp, price, volume):
+        for interval in self.intervals:
+            self.update(interval, timestamp, price, volume)
+
+    def add_trades(self, trades):
+        """
+        :param trades: Iterable of (timestamp, price, volume) in time order.
+        """
+        for timestamp, price, volume in trades:
+            self.add_trade(timestamp, price, volume)
+
+    def close_candle(self, interval, candle):
+        row = self.to_row(candle)
+        self.closed[interval].append(row)
+        self.pending.append((interval, row))
+
+    @staticmethod
+    def to_row(candle):
+        start, open_, high, low, close, price_volume, volume, count = candle
+        vwap = price_volume / volume if volume else close
+        return [start, open_, high, low, close, vwap, volume, count]
+
+    def candles(self, interval, num_candles=None):
+        """
+        :return: List of rows, oldest first, the forming candle last.
+        """
+        rows = list(self.closed[interval])
+        if self.forming[interval] is not None:
+            rows.append(self.to_row(self.forming[interval]))
+        return rows[-num_candles:] if num_candles else rows
+
+    def to_frame(self, interval=5, num_candles=60):
+        """Same DataFrame as kraken_toolbox.fetch_last_n_candles."""
+        return kraken_toolbox.ohlc_to_dataframe(self.candles(interval, num_candles))
+
+    def ready(self, interval, num_candles, now=None):
+        """
+        Check that the last num_candles candles are all there, without gaps, and up to date with the clock.
+
+        A stalled trade feed or a restart after downtime shows up as missing candles, callers then use REST.
+        """
+        seconds = interval * 60
+        rows = self.candles(interval, num_candles)
+        if len(rows) < num_candles:
+            return False
+
+        now = time.time() if now is None else now
+        if rows[-1][0] + 2 * seconds <= now:
+            return False
+        return all(later[0] - earlier[0] == seconds for earlier, later in zip(rows, rows[1:]))
+
+    def persist(self, cursor):
+        """Write the candles closed since the last call. Doesn't commit, the caller commits with the trades."""
+        if not self.pending:
+            return
+
+        cursor.executemany("""
+        INSERT OR REPLACE INTO candles (pair, interval, time, open, high, low, close, vwap, volume, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(self.pair, interval, *row) for interval, row in self.pending])
+        self.pending = []
+
+    def load(self, cursor, now=None):
+        """
+        Restore the stored candles and rebuild the rest from the trades table.
+
+        Each interval resumes after its newest stored candle, or history candles back when nothing is stored,
+        and replays the trades from there, so the forming candles pick up the trades of before the restart.
+
+        :return: Number of trades replayed.
+        """
+        cursor.execute(create_candles_table)
+        now = time.time() if now is None else now
+
+        resume = {}
+        for interval in self.intervals:
+            seconds = interval * 60
+            cursor.execute("""
+            SELECT time, open, high, low, close, vwap, volume, count
+            FROM candles
+            WHERE pair = ? AND interval = ?
+            ORDER BY time DESC
+            LIMIT ?
+            """, (self.pair, interval, self.history))
+            rows = [list(row) for row in reversed(cursor.fetchall())]
+            self.closed[interval].extend(rows)
+            earliest = int(now // seconds * seconds) - self.history * seconds
+            resume[interval] = max(rows[-1][0] + seconds, earliest) if rows else earliest
+
+        cursor.execute("""
+        SELECT timestamp, price, volume
+        FROM trades
+        WHERE pair = ? AND timestamp >= ?
+        ORDER BY timestamp ASC
+        """, (self.pair, min(resume.values())))
+
+        replayed = 0
+        for timestamp, price, volume in cursor:
+            for interval in self.intervals:
+                if timestamp >= resume[interval]:
+                    self.update(interval, timestamp, price, volume, fill_quiet=False)
+            replayed += 1
+
+        self.persist(cursor)
+        return replayed
+
+    def backfill(self, cursor, rest_pair, interval, request_ohlc=kraken_toolbox.request_ohlc):
+        """
+        Fill the closed candles of an interval that are missing locally from Kraken's OHLC endpoint.
+
+        :param rest_pair: Kraken REST pair of the same market, e.g. 'XXBTZUSD'.
+        :return: Number of candles added.
+        """
+        return self.merge_ohlc(cursor, interval, request_ohlc(rest_pair, interval)[rest_pair])
+
+    def merge_ohlc(self, cursor, interval, candles):
+        """
+        Add the closed candles missing locally from the rows of an OHLC response already fetched.
+
+        :return: Number of candles added.
+        """
+        # The last REST candle is still forming, and so is ours from its start on
+        forming = self.forming[interval]
+        limit = forming[0] if forming is not None else None
+        known = {row[0] for row in self.closed[interval]}
+
+        added = []
+        for candle in candles[:-1]:
+            row = kraken_toolbox.ohlc_row(candle)
+            if row[0] not in known and (limit is None or row[0] < limit):
+                added.append(row)
+
+        if added:
+            rows = sorted(list(self.closed[interval]) + added)
+            self.closed[interval].clear()
+            self.closed[interval].extend(rows)
+            self.pending += [(interval, row) for row in added]
+            self.persist(cursor)
+        return len(added)
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+candle_builder = CandleBuilder('XBT/USD')
+candle_builder.load(cursor)
+if not candle_builder.ready(5, 60):
+    candle_builder.backfill(cursor, 'XXBTZUSD', 5)
+conn.commit()
+
+# On every ingested trade batch
+candle_builder.add_trades([(float(trade[2]), float(trade[0]), float(trade[1])) for trade in trades])
+candle_builder.persist(cursor)
+conn.commit()
+
+# Before reading them, so a quiet market doesn't look like a gap
+candle_builder.catch_up()
+five_m_candles = candle_builder.to_frame(5, 60)
+print(five_m_candles)"""
@@ -1,4 +1,7 @@
+import argparse
 import sqlite3
+import time
+import constants
 from datetime import datetime
 
 
@@ -7,28 +10,238 @@ def unix_to_readable(timestamp):
     return datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
 
 
-# Connect to the SQLite database
-conn = sqlite3.connect('trading_data.db')
-cursor = conn.cursor()
-"""
-# Fetch some volume profile data
-cursor.execute("SELECT * FROM volume_profile")
-volume_profile_data = cursor.fetchall()
-print("Volume Profile Data:")
-for row in volume_profile_data:
-    readable_timestamp = unix_to_readable(row[1] * 4 * 3600)  # Convert interval to readable time
-    print((row[0], readable_timestamp, row[2], row[3]))
-"""
-# Fetch some trade data
-cursor.execute("SELECT * FROM trades")
-trade_data = cursor.fetchall()
-print("Trade Data:")
-for row in trade_data:
-    readable_timestamp = unix_to_readable(row[1])
-    print((row[0], readable_timestamp, row[2], row[3], row[4], row[5]))
+def time_filter(start, end, pair):
+    """WHERE clause and parameters shared by every query, start and end are Unix timestamps or None."""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if pair is not None:
+        conditions.append("pair = ?")
+        params.append(pair)
+    return ("WHERE " + " AND ".join(conditions)) if conditions else "", params
 
-# Close the database connection"""
-conn.close()
 
+def has_column(cursor, table, column):
+    """Older databases lack the columns schema.upgrade_tables adds, the report reads them as they are."""
+    return any(row[1] == column for row in cursor.execute(f"PRAGMA table_info({table})"))
 
 
+def trade_summary(cursor, start=None, end=None, pair=None):
+    """
+    :return: Dict with the trade count, first and last timestamp, total, buy and sell volume and the
+             market order share, computed in one aggregate query.
+    """
+    where, params = time_filter(start, end, pair)
+    cursor.execute(f"""
+    SELECT COUNT(*), MIN(timestamp), MAX(timestamp), SUM(volume),
+           SUM(CASE WHEN side = 'buy' THEN volume ELSE 0 END),
+           SUM(CASE WHEN side = 'sell' THEN volume ELSE 0 END),
+           SUM(CASE WHEN type_order = 'market' THEN 1 ELSE 0 END)
+    FROM trades
+    {where}
+    """, params)
+    count, first, last, volume, buy_volume, sell_volume, market_count = cursor.fetchone()
+    return {
+        'trades': count,
+        'first': first,
+        'last': last,
+        'volume': volume or 0,
+        'buy_volume': buy_volume or 0,
+        'sell_volume': sell_volume or 0,
+        'market_share': market_count / count if count else 0
+    }
+
+
+def trades_per_bucket(cursor, bucket=60, start=None, end=None, pair=None):
+    """
+    :param bucket: Bucket width in seconds, 60 gives trades and volume per minute.
+    :return: List of (bucket start, trades, volume, buy volume, sell volume, first trade, last trade,
+             market order trades).
+    """
+    where, params = time_filter(start, end, pair)
+    cursor.execute(f"""
+    SELECT CAST(timestamp / ? AS INTEGER) * ? AS bucket, COUNT(*), SUM(volume),
+           SUM(CASE WHEN side = 'buy' THEN volume ELSE 0 END),
+           SUM(CASE WHEN side = 'sell' THEN volume ELSE 0 END),
+           MIN(timestamp), MAX(timestamp),
+           SUM(CASE WHEN type_order = 'market' THEN 1 ELSE 0 END)
+    FROM trades
+    {where}
+    GROUP BY bucket
+    ORDER BY bucket
+    """, [bucket, bucket] + params)
+    return cursor.fetchall()
+
+
+def summary_from_buckets(buckets):
+    """Same dict as trade_summary, added up from the buckets instead of another pass over the table."""
+    count = sum(row[1] for row in buckets)
+    return {
+        'trades': count,
+        'first': buckets[0][5] if buckets else None,
+        'last': buckets[-1][6] if buckets else None,
+        'volume': sum(row[2] for row in buckets),
+        'buy_volume': sum(row[3] for row in buckets),
+        'sell_volume': sum(row[4] for row in buckets),
+        'market_share': sum(row[7] for row in buckets) / count if count else 0
+    }
+
+
+def gaps_from_buckets(buckets, min_gap, limit=100):
+    """
+    Gaps from the first and last trade of consecutive buckets, saves another pass over the table.
+
+    Only exact when min_gap >= bucket: a gap inside one bucket is shorter than the bucket, so every gap
+    longer than min_gap then runs from one non-empty bucket to the next.
+
+    :return: List of (gap start, gap end, seconds), longest first.
+    """
+    gaps = [(previous[6], current[5], current[5] - previous[6])
+            for previous, current in zip(buckets, buckets[1:])
+            if current[5] - previous[6] > min_gap]
+    gaps.sort(key=lambda gap: gap[2], reverse=True)
+    return gaps[:limit]
+
+
+def find_gaps(cursor, min_gap=60, start=None, end=None, pair=None, limit=100):
+    """
+    Stretches without a single trade, found with a window function over the timestamp index.
+
+    :return: List of (gap start, gap end, seconds), longest first.
+    """
+    where, params = time_filter(start, end, pair)
+    cursor.execute(f"""
+    SELECT previous, timestamp, timestamp - previous AS gap
+    FROM (
+        SELECT timestamp, LAG(timestamp) OVER (ORDER BY timestamp) AS previous
+        FROM trades
+        {where}
+    )
+    WHERE timestamp - previous > ?
+    ORDER BY gap DESC
+    LIMIT ?
+    """, params + [min_gap, limit])
+    return cursor.fetchall()
+
+
+def find_duplicates(cursor, start=None, end=None, pair=None, limit=100):
+    """
+    Trades stored more than once with the same time, price, volume and side, e.g. after a websocket
+    reconnect replayed a batch.
+
+    :return: (number of surplus rows, list of (timestamp, price, volume, side, copies)).
+    """
+    where, params = time_filter(start, end, pair)
+    # Trades of different pairs aren't copies, unless the table predates the pair column
+    group = 'timestamp, price, volume, side' + (', pair' if has_column(cursor, 'trades', 'pair') else '')
+    # Copies share their timestamp, grouping on the timestamp index alone narrows the candidates cheaply
+    cursor.execute(f"""
+    SELECT timestamp, price, volume, side, COUNT(*) AS copies
+    FROM trades
+    WHERE timestamp IN (
+        SELECT timestamp
+        FROM trades
+        {where}
+        GROUP BY timestamp
+        HAVING COUNT(*) > 1
+    ) {where.replace('WHERE', 'AND', 1)}
+    GROUP BY {group}
+    HAVING copies > 1
+    ORDER BY copies DESC
+    """, params + params)
+
+    surplus = 0
+    examples = []
+    # Iterate instead of fetchall, a bad replay can produce millions of groups
+    for row in cursor:
+        surplus += row[4] - 1
+        if len(examples) < limit:
+            examples.append(row)
+    return surplus, examples
+
+
+def stream_trades(cursor, limit=20, start=None, end=None, pair=None):
+    """Yield raw trade rows, newest first, without loading them all into memory."""
+    where, params = time_filter(start, end, pair)
+    for row in cursor.execute(f"""
+    SELECT id, timestamp, price, volume, side, type_order
+    FROM trades
+    {where}
+    ORDER BY timestamp DESC
+    LIMIT ?
+    """, params + [limit]):
+        yield row
+
+
+def print_report(cursor, start=None, end=None, pair=None, bucket=60, min_gap=60, rows=20, show_buckets=False):
+    started = time.perf_counter()
+
+    # One grouped pass feeds the summary, the per-bucket stats and the gaps
+    buckets = trades_per_bucket(cursor, bucket, start, end, pair)
+    summary = summary_from_buckets(buckets)
+    print("Trades:", summary['trades'])
+    if not summary['trades']:
+        return
+    print(f"Range: {unix_to_readable(summary['first'])} -> {unix_to_readable(summary['last'])}")
+    print(f"Volume: {summary['volume']:.4f} (buy {summary['buy_volume']:.4f} / sell {summary['sell_volume']:.4f}, "
+          f"{summary['buy_volume'] / summary['volume'] * 100 if summary['volume'] else 0:.1f}% buy)")
+    print(f"Market orders: {summary['market_share'] * 100:.1f}%")
+
+    counts = sorted(row[1] for row in buckets)
+    expected = int((summary['last'] - summary['first']) // bucket) + 1
+    print(f"\nTrades per {bucket}s: min {counts[0]}, median {counts[len(counts) // 2]}, max {counts[-1]} "
+          f"over {len(buckets)} buckets ({max(0, expected - len(buckets))} empty)")
+    if show_buckets:
+        for bucket_start, count, volume, buy_volume, sell_volume, *_ in buckets:
+            print(f"{unix_to_readable(bucket_start)}  {count:6d}  {volume:12.4f}  "
+                  f"buy {buy_volume:10.4f}  sell {sell_volume:10.4f}")
+
+    if min_gap >= bucket:
+        gaps = gaps_from_buckets(buckets, min_gap)
+    else:
+        gaps = find_gaps(cursor, min_gap, start, end, pair)
+    print(f"\nGaps longer than {min_gap}s: {len(gaps)}{'+' if len(gaps) == 100 else ''}")
+    for gap_start, gap_end, seconds in gaps[:10]:
+        print(f"{unix_to_readable(gap_start)} -> {unix_to_readable(gap_end)}  {seconds:.0f}s")
+
+    surplus, duplicates = find_duplicates(cursor, start, end, pair)
+    print(f"\nSuspected duplicate rows: {surplus}")
+    for timestamp, price, volume, side, copies in duplicates[:10]:
+        print(f"{unix_to_readable(timestamp)}  {price}  {volume}  {side}  x{copies}")
+
+    if rows:
+        print(f"\nLatest {rows} trades:")
+        for row in stream_trades(cursor, rows, start, end, pair):
+            print((row[0], unix_to_readable(row[1]), row[2], row[3], row[4], row[5]))
+
+    print(f"\nReport took {time.perf_counter() - started:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data health report of the trades table.")
+    parser.add_argument('--hours', type=float, default=24, help="look-back window, 0 for the whole table")
+    parser.add_argument('--pair', default=None, help="only trades of this pair, e.g. XBT/USD")
+    parser.add_argument('--bucket', type=int, default=60, help="bucket width in seconds")
+    parser.add_argument('--gap', type=float, default=60, help="report gaps longer than this many seconds")
+    parser.add_argument('--rows', type=int, default=20, help="raw rows to print, 0 for none")
+    parser.add_argument('--buckets', action='store_true', help="print every bucket")
+    args = parser.parse_args()
+
+    start = time.time() - args.hours * 3600 if args.hours else None
+
+    # Connect to the SQLite database
+    conn = sqlite3.connect(constants.db_path)
+    cursor = conn.cursor()
+    print_report(cursor, start, None, args.pair, args.bucket, args.gap, args.rows, args.buckets)
+
+    # Close the database connection
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
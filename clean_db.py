@@ -1,8 +1,9 @@
 import sqlite3
+import constants
 from datetime import datetime, timezone, timedelta
 
 # Connect to the SQLite database
-conn = sqlite3.connect('trading_data.db')
+conn = sqlite3.connect(constants.db_path)
 cursor = conn.cursor()
 
 # Get the current time and calculate the timestamp for one week ago
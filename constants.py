@@ -9,3 +9,72 @@ kraken_public_key = os.getenv('KRAKEN_PUBLIC')
 kraken_private_key = os.getenv('KRAKEN_PRIVATE')
 
 dollar_threshold = 3500000
+
+# Endpoints, overridable from the environment to run the bot against stand_in_server.py
+db_path = os.getenv('TRADING_DB', 'trading_data.db')
+spot_ws_url = os.getenv('KRAKEN_SPOT_WS_URL', 'wss://ws.kraken.com/')
+spot_api_url = os.getenv('KRAKEN_SPOT_API_URL', 'https://api.kraken.com/0/public')
+futures_api_url = os.getenv('KRAKEN_FUTURES_API_URL', 'https://futures.kraken.com/derivatives/api/v3')
+futures_ws_url = os.getenv('KRAKEN_FUTURES_WS_URL', 'wss://futures.kraken.com/ws/v1')
+analysis_interval = int(os.getenv('ANALYSIS_INTERVAL', 300))  # seconds between analysis cycles
+
+# REST client settings for kraken_toolbox
+rest_connect_timeout = 3.05  # seconds to establish a connection
+rest_read_timeout = 10  # seconds to wait for a response
+rest_max_retries = 3  # retries for idempotent GET calls, orders are never re-sent
+rest_backoff_factor = 0.3  # sleeps 0.3s, 0.6s, 1.2s between retries
+instruments_cache_ttl = 3600  # instrument specs barely change
+forming_candle_ttl = 10  # seconds the forming OHLC candle is reused, closed ones are stored for good
+
+# Candles built locally from the ingested trades, see candles.py
+candle_intervals = (1, 5, 15, 60)  # minutes
+candle_history = 120  # closed candles kept in memory per interval
+candle_quiet_limit = 3600  # seconds without trades filled with flat candles, longer silences are backfilled
+
+# Local L2 book from the spot websocket, see order_book.py
+book_depth = int(os.getenv('BOOK_DEPTH', 0))  # 10, 25, 100, 500 or 1000 levels, 0 doesn't subscribe
+book_levels = 10  # top levels the book imbalance is computed over
+
+# Footprints (volume at price by aggressor) of the bars, see footprint.py
+footprint_bin_size = 5.0  # USD per price bin
+footprint_features = os.getenv('FOOTPRINT', '0') == '1'  # report the newest bar's footprint with the signal
+
+# Streaming market data
+ticker_max_age = 5  # seconds before a streamed top-of-book quote is stale and REST is used instead
+feed_max_backoff = 30  # most seconds between reconnects of a failing futures feed, doubling from 1
+
+# Trailing stop exit of live.py on the futures ticker, see position_trackers.ExcursionTracker
+trailing_stop_enabled = os.getenv('TRAILING_STOP', '1') == '1'
+trailing_stop_retry = 30  # seconds before a rejected trailing stop exit is sent again
+
+# Client-side rate-limit budgets: (bucket capacity, tokens refilled per second)
+spot_public_budget = (15, 1)
+futures_public_budget = (20, 2)
+futures_private_budget = (500, 50)  # Kraken Futures: 500 cost units per 10 seconds
+order_budget_reserve = 0.2  # share of each budget that only order and cancel traffic may spend
+
+# Latency tracing of the trade-to-order path, see tracing.py
+tracing_enabled = os.getenv('TRACING', '0') == '1'
+
+# Per-cycle stage timings and on-demand profiling, see profiling.py
+stage_memory_tracking = os.getenv('STAGE_MEMORY', '0') == '1'  # tracemalloc during analysis cycles, slows ingest
+profile_cycles = int(os.getenv('PROFILE_CYCLES', 3))  # cycles profiled per request
+profile_flag_path = os.getenv('PROFILE_FLAG', 'profile.flag')  # create this file to profile the next cycles
+profile_dir = os.getenv('PROFILE_DIR', 'profiles')
+
+# Instruments traded by live.py, each gets its own SymbolRunner (see strategy_runner.py)
+symbols = {
+    'PF_XBTUSD': {
+        'pair': 'XBT/USD',  # spot websocket pair the dollar bars are built from
+        'candle_pair': 'XXBTZUSD',  # spot OHLC pair for the 5 minute RSI
+        'size': 0.002,
+        'num_bars': 7,
+        'dollar_threshold': dollar_threshold,
+    },
+}
+active_symbols = os.getenv('SYMBOLS', ','.join(symbols)).split(',')  # subset of symbols to run
+analysis_workers = int(os.getenv('ANALYSIS_WORKERS', 0)) or None  # bar building processes, None is one per core
+
+# Warm-start snapshots of the bar builders and signals, see snapshots.py
+snapshot_path = os.getenv('SNAPSHOT_PATH', 'snapshots/live_state.snap')
+snapshot_every = int(os.getenv('SNAPSHOT_EVERY', 1))  # analysis cycles between snapshots
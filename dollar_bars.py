@@ -1,28 +1,38 @@
 import pandas as pd
 import sqlite3
+import constants
 from datetime import datetime, timedelta
 
 from constants import dollar_threshold
+from bar_engine import DollarBars
 
 
 # Database connection
-conn = sqlite3.connect('trading_data.db')
+conn = sqlite3.connect(constants.db_path)
 cursor = conn.cursor()
 
 
-def fetch_trades(hours):
+def fetch_trades(hours, pair=None):
     # Calculate the timestamp for the starting point
     current_time = datetime.now()
     start_time = current_time - timedelta(hours=hours)
     start_timestamp = int(start_time.timestamp())
 
-    # Fetch trades from the database
-    cursor.execute("""
-    SELECT timestamp, price, volume, side, type_order
-    FROM trades
-    WHERE timestamp >= ?
-    ORDER BY timestamp ASC
-    """, (start_timestamp,))
+    # Fetch trades from the database, of every pair unless one is given
+    if pair is None:
+        cursor.execute("""
+        SELECT timestamp, price, volume, side, type_order
+        FROM trades
+        WHERE timestamp >= ?
+        ORDER BY timestamp ASC
+        """, (start_timestamp,))
+    else:
+        cursor.execute("""
+        SELECT timestamp, price, volume, side, type_order
+        FROM trades
+        WHERE timestamp >= ? AND pair = ?
+        ORDER BY timestamp ASC
+        """, (start_timestamp, pair))
 
     trades = cursor.fetchall()
 
@@ -59,7 +69,7 @@ def create_dollar_bars(trade_data, threshold):
         close_price = row['price']
         end_time = row['timestamp']
 
-        if temp_dollar >= dollar_threshold:
+        if temp_dollar >= threshold:
             dollar_bars.append({
                 'open': open_price,
                 'high': high_price,
@@ -79,9 +89,74 @@ def create_dollar_bars(trade_data, threshold):
     return pd.DataFrame(dollar_bars)
 
 
+class DollarBarBuilder(DollarBars):
+    """
+    Dollar bars kept up to date from the trades table instead of rebuilt from the whole window.
+
+    Each update only reads the trades inserted since the last one (by row id), extends the open partial bar
+    and appends the bars it completes, with the same rules as create_dollar_bars. Bars older than the
+    window are dropped. Rows inserted later but timed before the partial bar, like a historical import
+    from trade_history.py, are skipped: they would rewrite a bar that has moved on. The builder holds no
+    connection, so it can be pickled into executor workers and warm-start snapshots. Bar layout and window
+    handling are bar_engine's.
+    """
+
+    def __init__(self, threshold, pair=None, hours=72):
+        super().__init__(threshold, hours)
+        self.pair = pair
+        self.last_trade_id = 0  # highest trades.id consumed
+
+    def update(self):
+        """
+        Consume the trades inserted since the last update, the whole window on the first call.
+
+        :return: Number of trades read.
+        """
+        trades = self.read_trades()
+        self.consume(trades)
+        return len(trades)
+
+    def read_trades(self):
+        """
+        :return: (id, timestamp, price, volume) rows inserted since the last update, the whole window on the
+                 first call.
+        """
+        if self.last_trade_id:
+            cursor.execute("""
+            SELECT id, timestamp, price, volume
+            FROM trades
+            WHERE id > ? AND timestamp >= ? AND (? IS NULL OR pair = ?)
+            ORDER BY id ASC
+            """, (self.last_trade_id, self.resume_time(), self.pair, self.pair))
+        else:
+            start_timestamp = int((datetime.now() - timedelta(hours=self.hours)).timestamp())
+            cursor.execute("""
+            SELECT id, timestamp, price, volume
+            FROM trades
+            WHERE timestamp >= ? AND (? IS NULL OR pair = ?)
+            ORDER BY timestamp ASC
+            """, (start_timestamp, self.pair, self.pair))
+        return cursor.fetchall()
+
+    def consume(self, trades):
+        """Add the rows of read_trades to the bars and drop the bars that left the window."""
+        for trade_id, timestamp, price, volume in trades:
+            self.add_trade(float(timestamp), price, volume)
+            self.last_trade_id = max(self.last_trade_id, trade_id)
+
+        self.drop_expired()
+
+    def resume_time(self):
+        """Earliest timestamp a new row may have to be consumed: the start of the bar being built."""
+        if self.partial is not None:
+            return self.partial[5]
+        return self.bars[-1][6] if self.bars else 0
+
+
 """__________________________________________________________________________________________________________________"""
 
 # Fetch trades and create dollar bars
-data = fetch_trades(72)
-dollar_bars = create_dollar_bars(data, threshold=dollar_threshold)
+if __name__ == '__main__':
+    data = fetch_trades(72)
+    dollar_bars = create_dollar_bars(data, threshold=dollar_threshold)
 
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+import constants
+
+
+class Footprints:
+    """
+    Bid and ask volume per price bin of every bar, by aggressor: sells hit the bid, buys lift the ask.
+
+    Bins sit on a global grid of bin_size. A bar only stores the bins from its lowest to its highest traded
+    price, as offsets from its low: bar i's bins are rows ptr[i]:ptr[i + 1] of volumes, row ptr[i] + j being
+    the bin at price (low_bins[i] + j) * bin_size. volumes is float32 [bid, ask], so 72 hours of dollar bars
+    take a few hundred kilobytes.
+    """
+
+    def __init__(self, bin_size, low_bins, ptr, volumes, bar_volumes):
+        self.bin_size = bin_size
+        self.low_bins = low_bins  # int64 per bar, grid index of its lowest bin
+        self.ptr = ptr  # int64, len(bars) + 1
+        self.volumes = volumes  # float32 (cells, 2): bid, ask
+        self.bar_volumes = bar_volumes  # float64 (bars, 2): bid, ask totals, from the same pass
+
+    def __len__(self):
+        return len(self.low_bins)
+
+    @property
+    def nbytes(self):
+        return self.low_bins.nbytes + self.ptr.nbytes + self.volumes.nbytes + self.bar_volumes.nbytes
+
+    def bar(self, index):
+        """
+        :return: (bin prices, bid volumes, ask volumes) of one bar, lowest bin first.
+        """
+        index = range(len(self))[index]
+        rows = self.volumes[self.ptr[index]:self.ptr[index + 1]]
+        prices = (self.low_bins[index] + np.arange(len(rows))) * self.bin_size
+        return prices, rows[:, 0], rows[:, 1]
+
+    def cell_bars(self):
+        """Bar index of every row of volumes."""
+        return np.repeat(np.arange(len(self)), np.diff(self.ptr))
+
+    def poc(self):
+        """
+        Point of control of every bar: the bin with the most volume, the lowest one on ties.
+
+        :return: (prices, volumes), NaN and 0 for a bar without trades.
+        """
+        totals = self.volumes.sum(axis=1)
+        # Within each bar, the cell with the largest total comes first
+        order = np.lexsort((-totals, self.cell_bars()))
+        filled = self.ptr[1:] > self.ptr[:-1]
+        best = order[self.ptr[:-1][filled]]
+
+        prices = np.full(len(self), np.nan)
+        volumes = np.zeros(len(self))
+        prices[filled] = (self.low_bins[filled] + best - self.ptr[:-1][filled]) * self.bin_size
+        volumes[filled] = totals[best]
+        return prices, volumes
+
+    def stacked_imbalances(self, ratio=3.0, min_stack=3):
+        """
+        Count the stacks of diagonal imbalances per bar. A bin is a buy imbalance when its ask volume is at
+        least ratio times the bid volume of the bin below, a sell imbalance when its bid volume is at least
+        ratio times the ask volume of the bin above. A stack is min_stack or more consecutive imbalanced bins.
+
+        :return: (buy stacks, sell stacks), int arrays per bar.
+        """
+        bid = self.volumes[:, 0].astype(np.float64)
+        ask = self.volumes[:, 1].astype(np.float64)
+        first = np.zeros(len(bid), dtype=bool)
+        first[self.ptr[:-1][self.ptr[:-1] < len(bid)]] = True
+        last = np.zeros(len(bid), dtype=bool)
+        last[self.ptr[1:][self.ptr[1:] > 0] - 1] = True
+
+        # The neighbour bin of another bar doesn't count, nor does an empty one
+        bid_below = np.concatenate(([0.0], bid[:-1]))
+        ask_above = np.concatenate((ask[1:], [0.0]))
+        buy = ~first & (ask > 0) & (ask >= ratio * bid_below) & (bid_below > 0)
+        sell = ~last & (bid > 0) & (bid >= ratio * ask_above) & (ask_above > 0)
+
+        return self.count_runs(buy, min_stack), self.count_runs(sell, min_stack)
+
+    def count_runs(self, flags, min_stack):
+        # Runs are cut at bar boundaries, then counted per bar when long enough
+        flags = flags.astype(np.int8)
+        breaks = np.zeros(len(flags) + 1, dtype=np.int8)
+        breaks[self.ptr] = 1
+        starts = np.flatnonzero((flags == 1) & ((np.concatenate(([0], flags[:-1])) == 0) | (breaks[:-1] == 1)))
+        ends = np.flatnonzero((flags == 1) & ((np.concatenate((flags[1:], [0])) == 0) | (breaks[1:] == 1)))
+        long_runs = starts[ends - starts + 1 >= min_stack]
+        return np.bincount(np.searchsorted(self.ptr, long_runs, side='right') - 1, minlength=len(self))
+
+    def delta_at_extremes(self, levels=1):
+        """
+        Ask minus bid volume over the lowest and the highest levels bins of every bar.
+
+        :return: (delta at the low, delta at the high), float arrays per bar.
+        """
+        delta = np.concatenate(([0.0], np.cumsum(self.volumes[:, 1].astype(np.float64) -
+                                                 self.volumes[:, 0].astype(np.float64))))
+        start, end = self.ptr[:-1], self.ptr[1:]
+        low_end = np.minimum(start + levels, end)
+        high_start = np.maximum(end - levels, start)
+        return delta[low_end] - delta[start], delta[end] - delta[high_start]
+
+    def features(self, ratio=3.0, min_stack=3, levels=1):
+        """Per bar features as a DataFrame, one row per bar in bar order."""
+        poc_price, poc_volume = self.poc()
+        buy_stacks, sell_stacks = self.stacked_imbalances(ratio, min_stack)
+        delta_low, delta_high = self.delta_at_extremes(levels)
+        return pd.DataFrame({
+            'poc': poc_price,
+            'poc_volume': poc_volume,
+            'bid_volume': self.bar_volumes[:, 0],
+            'ask_volume': self.bar_volumes[:, 1],
+            'buy_stacks': buy_stacks,
+            'sell_stacks': sell_stacks,
+            'delta_at_low': delta_low,
+            'delta_at_high': delta_high,
+        })
+
+
+def compute_footprints(timestamps, prices, volumes, buys, bar_starts, bar_ends, bin_size=None):
+    """
+    Footprints of the bars from time-ordered trade arrays, in one vectorized pass.
+
+    A trade goes to the first bar ending at or after its timestamp, so a trade in a boundary second counts
+    once, in the bar it closed. Trades before the first bar or after the last one are left out.
+
+    :param timestamps: Epoch seconds, ascending.
+    :param buys: Boolean array, True where the aggressor bought.
+    :param bar_starts: Epoch seconds per bar, e.g. DollarBarBuilder.bars[:, 5].
+    :param bar_ends: Epoch seconds per bar, ascending.
+    :param bin_size: Price bin width, constants.footprint_bin_size by default.
+    :return: Footprints.
+    """
+    bin_size = bin_size or constants.footprint_bin_size
+    bar_count = len(bar_ends)
+    bar_index = np.searchsorted(bar_ends, timestamps, side='left')
+    inside = (bar_index < bar_count) & (timestamps >= (bar_starts[0] if bar_count else 0))
+    bar_index = bar_index[inside]
+    price_bins = np.floor(prices[inside] / bin_size).astype(np.int64)
+    volumes = volumes[inside]
+    buys = buys[inside]
+
+    # Trades are in bar order, so each bar is one contiguous segment
+    counts = np.bincount(bar_index, minlength=bar_count)
+    filled = counts > 0
+    segment_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+    low_bins = np.zeros(bar_count, dtype=np.int64)
+    widths = np.zeros(bar_count, dtype=np.int64)
+    if len(price_bins):
+        low_bins[filled] = np.minimum.reduceat(price_bins, segment_starts)
+        widths[filled] = np.maximum.reduceat(price_bins, segment_starts) - low_bins[filled] + 1
+
+    ptr = np.zeros(bar_count + 1, dtype=np.int64)
+    np.cumsum(widths, out=ptr[1:])
+    cells = ptr[bar_index] + price_bins - low_bins[bar_index]
+
+    cell_volumes = np.empty((ptr[-1], 2), dtype=np.float32)
+    cell_volumes[:, 0] = np.bincount(cells, weights=np.where(buys, 0.0, volumes), minlength=ptr[-1])
+    cell_volumes[:, 1] = np.bincount(cells, weights=np.where(buys, volumes, 0.0), minlength=ptr[-1])
+
+    bar_volumes = np.empty((bar_count, 2))
+    bar_volumes[:, 0] = np.bincount(bar_index, weights=np.where(buys, 0.0, volumes), minlength=bar_count)
+    bar_volumes[:, 1] = np.bincount(bar_index, weights=np.where(buys, volumes, 0.0), minlength=bar_count)
+    return Footprints(bin_size, low_bins, ptr, cell_volumes, bar_volumes)
+
+
+def bar_footprints(conn, bars, pair=None, bin_size=None):
+    """
+    Footprints of completed bars (DollarBarBuilder.bars or any bar_engine builder's) from the trades table,
+    read with one query over the bars' time span.
+
+    :return: Footprints, in the order of bars.
+    """
+    if not bars:
+        return compute_footprints(np.empty(0), np.empty(0), np.empty(0), np.empty(0, dtype=bool),
+                                  np.empty(0), np.empty(0), bin_size)
+
+    bar_starts = np.array([bar[5] for bar in bars], dtype=np.float64)
+    bar_ends = np.array([bar[6] for bar in bars], dtype=np.float64)
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT timestamp, price, volume, side = 'buy'
+    FROM trades
+    WHERE timestamp >= ? AND timestamp <= ? AND (? IS NULL OR pair = ?)
+    ORDER BY timestamp ASC
+    """, (bar_starts[0], bar_ends[-1], pair, pair))
+    rows = cursor.fetchall()
+    if rows:
+        timestamps, prices, volumes, buys = (np.array(column) for column in zip(*rows))
+    else:
+        timestamps = prices = volumes = np.empty(0)
+        buys = np.empty(0, dtype=bool)
+    return compute_footprints(timestamps.astype(np.float64), prices.astype(np.float64), volumes.astype(np.float64),
+                              buys.astype(bool), bar_starts, bar_ends, bin_size)
+
+
+def array_footprints(arrays, bars, bin_size=None):
+    """Footprints of bars from the memory-mapped trade columns of sweep.export_arrays."""
+    bar_starts = np.array([bar[5] for bar in bars], dtype=np.float64)
+    bar_ends = np.array([bar[6] for bar in bars], dtype=np.float64)
+    timestamps = arrays['timestamp']
+    first = int(np.searchsorted(timestamps, bar_starts[0])) if len(bars) else 0
+    last = int(np.searchsorted(timestamps, bar_ends[-1], side='right')) if len(bars) else 0
+    window = slice(first, last)
+    return compute_footprints(np.asarray(timestamps[window]), np.asarray(arrays['price'][window]),
+                              np.asarray(arrays['volume'][window]), np.asarray(arrays['side'][window]) == 1,
+                              bar_starts, bar_ends, bin_size)
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+builder = DollarBarBuilder(constants.dollar_threshold, 'XBT/USD')
+builder.update()
+footprints = bar_footprints(conn, builder.bars, 'XBT/USD', bin_size=5)
+print(f"{len(footprints)} bars in {footprints.nbytes / 1024:.0f} KB")
+
+prices, bid, ask = footprints.bar(-1)
+for price, bid_volume, ask_volume in zip(prices, bid, ask):
+    print(f"{price:>10.1f} {bid_volume:>10.4f} x {ask_volume:<10.4f}")
+
+print(footprints.features(ratio=3.0, min_stack=3).tail())"""
@@ -1,20 +1,21 @@
 import numpy as np
 import sqlite3
+import constants
 from datetime import datetime, timezone, timedelta
-import pandas_ta as ta
 
 from order_flow_tools import calculate_order_flow_metrics
-from dollar_bars import dollar_bars
 from kraken_toolbox import fetch_last_n_candles
+from tracing import tracer
+from indicators import WilderRSI, stochrsi_frame
 
 
 # Ensure the database connection is open
-conn = sqlite3.connect('trading_data.db')
+conn = sqlite3.connect(constants.db_path)
 cursor = conn.cursor()
 
 
 def calculate_stochastic_rsi(df):
-    df = ta.stochrsi(df['close'], length=14, rsi_length=14, k=3, d=3)
+    df = stochrsi_frame(df['close'], length=14, rsi_length=14, k=3, d=3)
     return df
 
 
@@ -24,29 +25,35 @@ def get_rsi(df, period=14):
         print("No dollar bars available.")
         return None
 
-    # Calculate RSI
-    df['RSI'] = ta.rsi(df['close'], length=period)
+    # Calculate RSI, same values as pandas_ta's and the caller's frame is left untouched
+    rsi = WilderRSI(period)
+    for close in df['close'].tolist():
+        rsi.update(close)
 
     # Return the last RSI value as an integer
-    return int(df['RSI'].iloc[-1])
+    return int(rsi.value)
 
 
-def check_stochastic_setup(df):
-
-    print(df.iloc[-1])
-
+def stochastic_setup(stoch_k, stoch_d):
     # Check for buy setup (if %K > %D and %K < 20)
-    if df['STOCHRSId_14_14_3_3'].iloc[-1] < df['STOCHRSIk_14_14_3_3'].iloc[-1] < 20:
+    if stoch_d < stoch_k < 20:
         return 'buy'
 
     # Check for sell setup (if %D > %K and %K > 80)
-    elif df['STOCHRSId_14_14_3_3'].iloc[-1] > df['STOCHRSIk_14_14_3_3'].iloc[-1] > 80:
+    elif stoch_d > stoch_k > 80:
         return 'sell'
 
     else:
         return None
 
 
+def check_stochastic_setup(df):
+
+    print(df.iloc[-1])
+
+    return stochastic_setup(df['STOCHRSIk_14_14_3_3'].iloc[-1], df['STOCHRSId_14_14_3_3'].iloc[-1])
+
+
 # Function to score signals and generate a final decision
 def get_delta_rating(deltas, num_bars):
     # Ensure there are enough bars to analyze
@@ -71,6 +78,60 @@ def get_delta_rating(deltas, num_bars):
     return rating
 
 
+rating_names = {1: 'buy', -1: 'sell', 0: 'hold'}
+
+
+def delta_rating_series(delta_values, windows):
+    """
+    Delta ratings of several windows at every bar in one vectorized pass over a cumulative delta prefix array.
+
+    The deltas come rounded to the cent from calculate_order_flow_metrics, so the prefix array is kept in
+    integer cents and every window sum is exact. get_delta_rating summed in floats, where a window or the
+    total nets out to exactly zero its rounding noise picked the side; those rare bars are re-rated the same
+    way, so the newest bar always matches what get_delta_rating and get_market_signal gave before.
+
+    :param delta_values: Delta of each bar, oldest first.
+    :param windows: Window lengths in bars, e.g. [7, 14, 21, 49].
+    :return: Dict of arrays with one row per bar: 'cum_deltas' (bars x windows, NaN while a window is longer
+             than the bars so far), 'ratings' (bars x windows, 1 buy, -1 sell, 0 hold or not enough data),
+             'total_cum_deltas' and 'setup_scores', the score get_market_signal derives from the ratings.
+    """
+    deltas = np.asarray(delta_values, dtype=float)
+    cents = np.rint(deltas * 100).astype(np.int64)
+    prefix = np.concatenate(([0], np.cumsum(cents)))
+    ends = np.arange(1, len(cents) + 1)[:, None]
+    starts = ends - np.asarray(windows, dtype=np.int64)[None, :]
+    fits = starts >= 0
+
+    sums = np.where(fits, prefix[ends] - prefix[np.maximum(starts, 0)], 0)
+    ratings = np.sign(sums).astype(np.int8)
+    total = sums.sum(axis=1)
+    total_signs = np.sign(total)
+
+    exact_zero = (fits & (sums == 0)).any(axis=1) | ((total == 0) & fits.any(axis=1))
+    for row in np.nonzero(exact_zero)[0]:
+        float_total = 0
+        for column, window in enumerate(windows):
+            if not fits[row, column]:
+                continue
+            # Summed in the same order as get_delta_rating, sum() compensates rounding on newer Pythons
+            cum_delta = 0
+            for delta in delta_values[row + 1 - window:row + 1]:
+                cum_delta += delta
+            if sums[row, column] == 0:
+                ratings[row, column] = np.sign(cum_delta)
+            if ratings[row, column]:
+                float_total += cum_delta
+        total_signs[row] = np.sign(float_total)
+
+    return {
+        'cum_deltas': np.where(fits, sums / 100, np.nan),
+        'ratings': ratings,
+        'total_cum_deltas': total / 100,
+        'setup_scores': ratings.sum(axis=1, dtype=np.int64) + total_signs,
+    }
+
+
 def get_price_action_rating(dol_bars, num_bars):
     # Ensure there are enough bars to analyze
     if len(dol_bars) < num_bars:
@@ -87,45 +148,32 @@ def get_price_action_rating(dol_bars, num_bars):
         return 'neutral', 0
 
 
-def get_market_signal(dollar_bars, num_bars, num_ratings):
+def get_market_signal(dollar_bars, num_bars, num_ratings, pair=None, metrics_cache=None, long_term_bars=49,
+                      book_features=None):
 
-    (delta_values, cumulative_delta, min_delta_values,
-     max_delta_values, market_buy_ratios, market_sell_ratios,
-     buy_volumes, sell_volumes, aggressive_buy_activities,
-     aggressive_sell_activities, aggressive_ratios, latest_bar) = calculate_order_flow_metrics(dollar_bars)
+    with tracer.span('calculate_order_flow_metrics'):
+        (delta_values, cumulative_delta, min_delta_values,
+         max_delta_values, market_buy_ratios, market_sell_ratios,
+         buy_volumes, sell_volumes, aggressive_buy_activities,
+         aggressive_sell_activities, aggressive_ratios, latest_bar) = calculate_order_flow_metrics(dollar_bars, pair, metrics_cache)
 
-    delta_ratings = []
-    setup_score = 0
-    total_cum_delta = 0
+    windows = [num_bars * (i + 1) for i in range(num_ratings)] + [long_term_bars]
+    ratings = delta_rating_series(delta_values, windows)
     result = {}
 
-    for i in range(num_ratings):
-        delta_rating = get_delta_rating(delta_values, num_bars * (i + 1))
-        delta_ratings.append(delta_rating)
-
-        if delta_rating[0] == 'buy':
-            setup_score += 1
-            total_cum_delta += delta_rating[1]
-
-        elif delta_rating[0] == 'sell':
-            setup_score -= 1
-            total_cum_delta += delta_rating[1]
-
-    long_term_rating = get_delta_rating(delta_values, 49)
-    delta_ratings.append(long_term_rating)
-
-    if long_term_rating[0] == 'buy':
-        setup_score += 1
-        total_cum_delta += long_term_rating[1]
-
-    elif long_term_rating[0] == 'sell':
-        setup_score -= 1
-        total_cum_delta += long_term_rating[1]
-
-    if total_cum_delta > 0:
-        setup_score += 1
-    elif total_cum_delta < 0:
-        setup_score -= 1
+    # Only the newest bar decides, the same ratings as get_delta_rating over each window
+    delta_ratings = []
+    for column, window in enumerate(windows):
+        if len(delta_values) < window:
+            delta_ratings.append(('Not enough data', None))
+            continue
+        cum_delta = float(ratings['cum_deltas'][-1, column])
+        delta_ratings.append([rating_names[int(ratings['ratings'][-1, column])], cum_delta])
+        print('Deltas:', delta_values[-window:])
+        print('Cumulative Delta:', cum_delta)
+
+    total_cum_delta = float(ratings['total_cum_deltas'][-1]) if len(delta_values) else 0
+    setup_score = int(ratings['setup_scores'][-1]) if len(delta_values) else 0
 
     print('Delta Ratings : ', delta_ratings)
     print('Total Cumulative Delta', total_cum_delta)
@@ -141,6 +189,11 @@ def get_market_signal(dollar_bars, num_bars, num_ratings):
     print(f"Final Signal : {signal}")
     result['signal'] = signal
     result['score'] = setup_score
+
+    # Resting liquidity from the local book (order_book.OrderBook.features), reported next to the signal
+    if book_features:
+        print('Book : ', book_features)
+        result.update(book_features)
     return result
 
 
@@ -278,30 +331,34 @@ def print_positions(positions):
 
 """__________________________________________________________________________________________________________________"""
 
+if __name__ == '__main__':
+    from dollar_bars import fetch_trades, create_dollar_bars
+
+    dollar_bars = create_dollar_bars(fetch_trades(72), threshold=constants.dollar_threshold)
 
-# print(calculate_stochastic_rsi(dollar_bars).tail(20))
-# print('\n')
+    # print(calculate_stochastic_rsi(dollar_bars).tail(20))
+    # print('\n')
 
-# Fetch last n hours signals
-print(fetch_last_n_hours_signals(24))
-# print('\n')
+    # Fetch last n hours signals
+    print(fetch_last_n_hours_signals(24))
+    # print('\n')
 
-print(get_market_signal(dollar_bars, 7, 3))
-five_m_candles = fetch_last_n_candles('XXBTZUSD', 5, 60)
-print('RSI : ', get_rsi(five_m_candles))
+    print(get_market_signal(dollar_bars, 7, 3))
+    five_m_candles = fetch_last_n_candles('XXBTZUSD', 5, 60)
+    print('RSI : ', get_rsi(five_m_candles))
 
 
-# Fetch last ten signals
-# print(fetch_last_10_signals())
+    # Fetch last ten signals
+    # print(fetch_last_10_signals())
 
-# Retrieve all open positions
-# all_opened_positions = fetch_all_opened_positions()
-# print_positions(all_opened_positions)
+    # Retrieve all open positions
+    # all_opened_positions = fetch_all_opened_positions()
+    # print_positions(all_opened_positions)
 
-# Retrieve positions opened during the past day
-positions_opened_last_day = fetch_positions_opened_last_day()
-print_positions(positions_opened_last_day)
+    # Retrieve positions opened during the past day
+    positions_opened_last_day = fetch_positions_opened_last_day()
+    print_positions(positions_opened_last_day)
 
 
-# Close the database connection
-# conn.close()
+    # Close the database connection
+    # conn.close()
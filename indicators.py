@@ -0,0 +1,311 @@
+import math
+from collections import deque
+
+import pandas as pd
+
+
+class AdjustedEWM:
+    """
+    Exponentially weighted mean updated one value at a time, with the same recurrence as pandas'
+    ewm(alpha=alpha, adjust=True, min_periods=min_periods).mean(), so streamed values match the batch ones.
+    """
+
+    def __init__(self, alpha, min_periods=0):
+        self.alpha = alpha
+        self.min_periods = min_periods
+        self.weighted = math.nan
+        self.old_weight = 1.0
+        self.observations = 0
+
+    def update(self, value):
+        is_observation = value == value
+        self.observations += is_observation
+        if self.weighted == self.weighted:
+            self.old_weight *= 1.0 - self.alpha
+            if is_observation:
+                # Skipped when equal, like pandas, so a flat series stays exactly flat
+                if self.weighted != value:
+                    self.weighted = (self.old_weight * self.weighted + value) / (self.old_weight + 1.0)
+                self.old_weight += 1.0
+        elif is_observation:
+            self.weighted = value
+        return self.value
+
+    @property
+    def value(self):
+        return self.weighted if self.observations >= self.min_periods else math.nan
+
+    def snapshot(self):
+        return {'weighted': self.weighted, 'old_weight': self.old_weight, 'observations': self.observations}
+
+    def restore(self, state):
+        self.weighted = state['weighted']
+        self.old_weight = state['old_weight']
+        self.observations = state['observations']
+
+
+class WilderRSI:
+    """
+    RSI with Wilder's smoothing (alpha = 1 / length), updated in O(1) per closed bar.
+
+    The averages of gains and losses use the bias-corrected form pandas_ta's rsi uses, so the values equal
+    ta.rsi over the same closes from the first bar on instead of only after the smoothing has converged.
+    Works on any close series: 5 minute candles, dollar bars.
+    """
+
+    def __init__(self, length=14):
+        self.length = length
+        self.gains = AdjustedEWM(1.0 / length, length)
+        self.losses = AdjustedEWM(1.0 / length, length)
+        self.last_close = None
+        self.last_time = None  # time of the last bar consumed, set by callers feeding bars by time
+        self.value = math.nan
+
+    def update(self, close, timestamp=None):
+        """
+        Consume the close of a completed bar.
+
+        :return: The RSI, NaN until length changes have been seen.
+        """
+        change = close - self.last_close if self.last_close is not None else math.nan
+        self.last_close = close
+        self.last_time = timestamp
+        gain = self.gains.update(max(change, 0.0) if change == change else change)
+        loss = self.losses.update(min(change, 0.0) if change == change else change)
+        self.value = rsi_from_averages(gain, loss)
+        return self.value
+
+    def preview(self, close):
+        """RSI if the bar being formed closed at close, e.g. the current 5 minute candle. Changes nothing."""
+        state = self.snapshot()
+        value = self.update(close)
+        self.restore(state)
+        return value
+
+    def snapshot(self):
+        return {'length': self.length, 'gains': self.gains.snapshot(), 'losses': self.losses.snapshot(),
+                'last_close': self.last_close, 'last_time': self.last_time, 'value': self.value}
+
+    def restore(self, state):
+        self.gains.restore(state['gains'])
+        self.losses.restore(state['losses'])
+        self.last_close = state['last_close']
+        self.last_time = state['last_time']
+        self.value = state['value']
+
+    @classmethod
+    def from_snapshot(cls, state):
+        indicator = cls(state['length'])
+        indicator.restore(state)
+        return indicator
+
+
+def rsi_from_averages(gain, loss):
+    denominator = gain + abs(loss)
+    if denominator != denominator or denominator == 0:
+        return math.nan
+    return 100 * gain / denominator
+
+
+class RollingExtremes:
+    """
+    Minimum and maximum of the last length values with monotonic deques, amortized O(1) per value.
+
+    A NaN in the window makes both NaN, like pandas' rolling(length).min() and max().
+    """
+
+    def __init__(self, length):
+        self.length = length
+        self.index = -1
+        self.last_gap = -length - 1  # index of the newest NaN
+        self.minima = deque()  # (index, value), values increasing
+        self.maxima = deque()  # (index, value), values decreasing
+
+    def update(self, value):
+        self.index += 1
+        oldest = self.index - self.length + 1
+        if value != value:
+            self.last_gap = self.index
+        else:
+            while self.minima and self.minima[-1][1] >= value:
+                self.minima.pop()
+            self.minima.append((self.index, value))
+            while self.maxima and self.maxima[-1][1] <= value:
+                self.maxima.pop()
+            self.maxima.append((self.index, value))
+
+        while self.minima and self.minima[0][0] < oldest:
+            self.minima.popleft()
+        while self.maxima and self.maxima[0][0] < oldest:
+            self.maxima.popleft()
+
+        if oldest < 0 or self.last_gap >= oldest:
+            return math.nan, math.nan
+        return self.minima[0][1], self.maxima[0][1]
+
+    def snapshot(self):
+        return {'index': self.index, 'last_gap': self.last_gap, 'minima': list(self.minima),
+                'maxima': list(self.maxima)}
+
+    def restore(self, state):
+        self.index = state['index']
+        self.last_gap = state['last_gap']
+        self.minima = deque(tuple(entry) for entry in state['minima'])
+        self.maxima = deque(tuple(entry) for entry in state['maxima'])
+
+
+class RollingMean:
+    """Mean of the last length values, NaN while the window isn't full or holds a NaN, like rolling().mean()."""
+
+    def __init__(self, length):
+        self.length = length
+        self.values = deque(maxlen=length)
+
+    def update(self, value):
+        self.values.append(value)
+        if len(self.values) < self.length:
+            return math.nan
+        return sum(self.values) / self.length
+
+    def snapshot(self):
+        return {'values': list(self.values)}
+
+    def restore(self, state):
+        self.values = deque(state['values'], maxlen=self.length)
+
+
+class StochRSI:
+    """
+    Stochastic RSI updated in O(1) per closed bar: the RSI's position within its rolling range, smoothed
+    into %K and %D with simple moving averages, the same definition as pandas_ta's stochrsi.
+    """
+
+    def __init__(self, length=14, rsi_length=14, k=3, d=3):
+        self.length = length
+        self.rsi_length = rsi_length
+        self.k = k
+        self.d = d
+        self.rsi = WilderRSI(rsi_length)
+        self.extremes = RollingExtremes(length)
+        self.k_mean = RollingMean(k)
+        self.d_mean = RollingMean(d)
+        self.value = (math.nan, math.nan)
+
+    @property
+    def last_time(self):
+        return self.rsi.last_time
+
+    @property
+    def count(self):
+        """Number of bars consumed."""
+        return self.extremes.index + 1
+
+    def update(self, close, timestamp=None):
+        """
+        Consume the close of a completed bar.
+
+        :return: (%K, %D), NaN until enough bars have been seen.
+        """
+        rsi = self.rsi.update(close, timestamp)
+        lowest, highest = self.extremes.update(rsi)
+        value_range = highest - lowest
+        # pandas_ta divides a flat range by machine epsilon, which makes the stochastic 0
+        stoch = 0.0 if value_range == 0 else 100 * (rsi - lowest) / value_range
+        stoch_k = self.k_mean.update(stoch)
+        stoch_d = self.d_mean.update(stoch_k)
+        self.value = (stoch_k, stoch_d)
+        return self.value
+
+    def preview(self, close):
+        """(%K, %D) if the bar being formed closed at close. Changes nothing."""
+        state = self.snapshot()
+        value = self.update(close)
+        self.restore(state)
+        return value
+
+    def snapshot(self):
+        return {'params': (self.length, self.rsi_length, self.k, self.d), 'rsi': self.rsi.snapshot(),
+                'extremes': self.extremes.snapshot(), 'k_mean': self.k_mean.snapshot(),
+                'd_mean': self.d_mean.snapshot(), 'value': self.value}
+
+    def restore(self, state):
+        self.rsi.restore(state['rsi'])
+        self.extremes.restore(state['extremes'])
+        self.k_mean.restore(state['k_mean'])
+        self.d_mean.restore(state['d_mean'])
+        self.value = tuple(state['value'])
+
+    @classmethod
+    def from_snapshot(cls, state):
+        indicator = cls(*state['params'])
+        indicator.restore(state)
+        return indicator
+
+    def column_names(self):
+        suffix = f'{self.length}_{self.rsi_length}_{self.k}_{self.d}'
+        return f'STOCHRSIk_{suffix}', f'STOCHRSId_{suffix}'
+
+
+def rsi_series(close, length=14):
+    """Batch mode: RSI of every bar of a close Series, equal to ta.rsi(close, length)."""
+    indicator = WilderRSI(length)
+    return pd.Series([indicator.update(value) for value in close.tolist()], index=close.index,
+                     name=f'RSI_{length}')
+
+
+def stochrsi_frame(close, length=14, rsi_length=14, k=3, d=3):
+    """Batch mode: %K and %D of every bar, the same columns as ta.stochrsi(close, length, rsi_length, k, d)."""
+    indicator = StochRSI(length, rsi_length, k, d)
+    values = [indicator.update(value) for value in close.tolist()]
+    return pd.DataFrame(values, index=close.index, columns=list(indicator.column_names()))
+
+
+def compare_with_pandas_ta(close, length=14, rsi_length=14, k=3, d=3):
+    """
+    Largest absolute difference between the batch mode and pandas_ta over a close Series, with the NaN
+    positions required to match.
+
+    :return: Dict of indicator -> max difference, inf where the NaN positions disagree.
+    """
+    import pandas_ta as ta
+
+    # pandas_ta returns None for series shorter than its lengths, every value is undefined then
+    nothing = pd.Series(math.nan, index=close.index)
+    differences = {}
+    theirs_rsi = ta.rsi(close, length=rsi_length)
+    pairs = [('rsi', rsi_series(close, rsi_length), theirs_rsi if theirs_rsi is not None else nothing)]
+    ours = stochrsi_frame(close, length, rsi_length, k, d)
+    theirs = ta.stochrsi(close, length=length, rsi_length=rsi_length, k=k, d=d)
+    pairs += [(column, ours[column], theirs[column] if theirs is not None else nothing) for column in ours.columns]
+
+    for name, ours_column, theirs_column in pairs:
+        if not ours_column.isna().equals(theirs_column.isna()):
+            differences[name] = math.inf
+        else:
+            differences[name] = float((ours_column - theirs_column).abs().max()) if ours_column.notna().any() else 0.0
+    return differences
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+# Dollar bars: feed each bar once it completes, the setup reads the latest %K / %D
+stoch_rsi = StochRSI()
+new_bars = min(builder.completed - stoch_rsi.count, len(builder.bars))
+for bar in builder.bars[len(builder.bars) - new_bars:]:
+    stoch_rsi.update(bar[3], bar[6])
+print(stoch_rsi.value)
+
+# 5 minute candles: closed candles update, the forming one is only previewed
+rsi = WilderRSI(14)
+for close in closed_candles['close']:
+    rsi.update(close)
+print(rsi.preview(forming_close))
+
+# Warm start
+state = stoch_rsi.snapshot()
+stoch_rsi = StochRSI.from_snapshot(state)
+
+# Batch mode against pandas_ta
+print(compare_with_pandas_ta(five_m_candles['close']))"""
@@ -0,0 +1,36 @@
+def store_trades(cursor, trades, pair='XBT/USD', position_trackers=None, symbol=None, candle_builder=None):
+    """
+    Store a trade message's batch and feed it to the position trackers and the candle builder of its pair.
+
+    This is what live.py does with every trade message, kept free of connections and feeds so the benchmark
+    and tests can run it on their own database. Doesn't commit, the caller commits the batch at once.
+
+    :param trades: Rows of a Kraken trade message, [price, volume, time, side, type, misc].
+    :param position_trackers: position_trackers.PositionTrackers of the connection, None skips them.
+    :param symbol: Futures symbol whose positions the pair's trades feed.
+    :param candle_builder: candles.CandleBuilder of the pair, None skips the candles.
+    """
+    for trade in trades:
+        print(f"Processing trade: {trade}")  # Log each trade
+        price, volume, trade_time, side, type_order, *_ = trade
+        side = 'buy' if side == 'b' else 'sell'
+        type_order = 'market' if 'm' in trade[4:] else 'limit'
+        cursor.execute("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) VALUES (?, ?, ?, ?, ?, ?)",
+                       (trade_time, price, volume, side, type_order, pair))
+
+    if position_trackers is not None:
+        position_trackers.on_trades([(float(trade[0]), float(trade[2]), float(trade[1])) for trade in trades], symbol)
+    if candle_builder is not None:
+        candle_builder.add_trades([(float(trade[2]), float(trade[0]), float(trade[1])) for trade in trades])
+        candle_builder.persist(cursor)
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+conn = sqlite3.connect(constants.db_path)
+cursor = conn.cursor()
+store_trades(cursor, [['60000.0', '0.01000000', '1720000000.1234', 'b', 'm', '']], 'XBT/USD',
+             candle_builder=CandleBuilder('XBT/USD'))
+conn.commit()"""
@@ -0,0 +1,246 @@
+import statistics
+import time
+import urllib.parse
+
+import aiohttp
+
+import constants
+import kraken_toolbox
+from rate_limiter import scheduler, futures_cost, PRIORITY_ORDER, PRIORITY_ACCOUNT
+from tracing import tracer
+
+
+class AsyncKrakenFuturesClient:
+    """
+    Asyncio counterpart of the order and position calls in kraken_toolbox.
+
+    Every method takes the same arguments as its blocking twin, including the KrakenFuturesAuth
+    object used to sign the request, so call sites only need an 'await'. One aiohttp session keeps
+    pooled keep-alive connections, and independent calls can be awaited together with asyncio.gather.
+    """
+
+    def __init__(self, max_connections=10):
+        self.max_connections = max_connections
+        self.session = None
+        self.ack_latencies = []  # decision-to-order-ack latencies in milliseconds
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+        timeout = aiohttp.ClientTimeout(sock_connect=constants.rest_connect_timeout,
+                                        sock_read=constants.rest_read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def private_get(self, auth, endpoint):
+        async def request():
+            headers = {
+                'Accept': 'application/json',
+            }
+            headers.update(auth.auth_headers(''))
+
+            async with self.session.get(kraken_toolbox.api_url + endpoint, headers=headers) as response:
+                return await response.json(content_type=None)
+
+        with tracer.span('rest ' + endpoint):
+            # Not coalesced: a waiter would get the response to a signature that isn't its own
+            return await scheduler.run_async('futures_private', request, cost=futures_cost(endpoint),
+                                             priority=PRIORITY_ACCOUNT)
+
+    async def private_post(self, auth, endpoint, payload):
+        postBody = urllib.parse.urlencode(payload)
+
+        async def request():
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            headers.update(auth.auth_headers(postBody))
+
+            async with self.session.post(kraken_toolbox.api_url + endpoint, data=postBody,
+                                         headers=headers) as response:
+                return await response.json(content_type=None)
+
+        # Orders and cancels are never coalesced and go ahead of queued reads
+        with tracer.span('order ' + endpoint):
+            return await scheduler.run_async('futures_private', request, cost=futures_cost(endpoint),
+                                             priority=PRIORITY_ORDER)
+
+    async def place_order(self, auth, symbol, side, size, orderType='mkt', limitPrice=None, stopPrice=None,
+                          clientOrderId=None, decision_time=None):
+        """
+        Send an order, see kraken_toolbox.place_order.
+
+        :param decision_time: Optional time.perf_counter() value taken when the trade decision was made.
+                              When given, the decision-to-ack latency is recorded in ack_latencies.
+        """
+        order = {
+            'orderType': orderType,
+            'symbol': symbol,
+            'side': side,
+            'size': size
+        }
+        if stopPrice is not None:
+            order['stopPrice'] = stopPrice
+
+        if limitPrice is not None:
+            order['limitPrice'] = limitPrice
+
+        if clientOrderId is not None:
+            order['cliOrdId'] = clientOrderId
+
+        print(order)
+        result = await self.private_post(auth, '/sendorder', order)
+        tracer.mark('decision_to_ack')
+        tracer.keep()
+
+        if decision_time is not None:
+            latency = (time.perf_counter() - decision_time) * 1000
+            self.ack_latencies.append(latency)
+            print(f"Decision-to-ack latency: {latency:.1f} ms")
+
+        print(result)
+        return result
+
+    async def get_open_positions(self, auth):
+        return await self.private_get(auth, '/openpositions')
+
+    async def get_open_orders(self, auth):
+        return await self.private_get(auth, '/openorders')
+
+    async def cancel_order(self, auth, order_id):
+        return await self.private_post(auth, '/cancelorder', {'order_id': order_id})
+
+    async def edit_order(self, auth, size, orderId=None, limitPrice=None, stopPrice=None, clientOrderId=None):
+        order = {
+            'size': size
+        }
+
+        if orderId is not None:
+            order['orderId'] = orderId
+
+        if clientOrderId is not None:
+            order['cliOrdId'] = clientOrderId
+
+        if stopPrice is not None:
+            order['stopPrice'] = stopPrice
+
+        if limitPrice is not None:
+            order['limitPrice'] = limitPrice
+
+        print(order)
+        result = await self.private_post(auth, '/editorder', order)
+        print(result)
+        return result
+
+    async def batch_order(self, auth, instructions, decision_time=None):
+        """
+        Send several order instructions in one round trip, see kraken_toolbox.batch_order.
+
+        :param decision_time: Optional time.perf_counter() value, recorded like in place_order.
+        """
+        batch, postBody = kraken_toolbox.batch_body(instructions)
+        print(batch)
+
+        async def request():
+            headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+            headers.update(auth.auth_headers(postBody))
+
+            async with self.session.post(kraken_toolbox.api_url + '/batchorder', data=postBody,
+                                         headers=headers) as response:
+                return await response.json(content_type=None)
+
+        with tracer.span('order /batchorder'):
+            result = await scheduler.run_async('futures_private', request,
+                                               cost=futures_cost('/batchorder', len(batch)), priority=PRIORITY_ORDER)
+        tracer.mark('decision_to_ack')
+        tracer.keep()
+
+        if decision_time is not None:
+            latency = (time.perf_counter() - decision_time) * 1000
+            self.ack_latencies.append(latency)
+            print(f"Decision-to-ack latency: {latency:.1f} ms")
+
+        print(result)
+        return kraken_toolbox.map_batch_results(batch, result)
+
+    async def fetch_live_price(self, symbol):
+        price = kraken_toolbox.top_of_book.get(symbol)
+        if price is not None:
+            return price
+
+        async def request():
+            async with self.session.get(kraken_toolbox.api_url + '/tickers') as response:
+                if response.status != 200:
+                    print(f"Failed to fetch data: {response.status}")
+                    return {}
+                return await response.json(content_type=None)
+
+        with tracer.span('rest /tickers'):
+            data = await scheduler.run_async('futures_public', request, key='tickers')
+
+        for item in data.get('tickers', []):
+            if item['symbol'] == symbol:
+                return kraken_toolbox.ticker_quote(item)
+
+    async def request_ohlc(self, pair, interval):
+        """Same as kraken_toolbox.request_ohlc, the raw 'result' object with the rows under the pair key."""
+        params = {
+            'pair': pair,
+            'interval': interval
+        }
+        async def request():
+            async with self.session.get(kraken_toolbox.spot_api_url + '/OHLC', params=params) as response:
+                return await response.json(content_type=None)
+
+        with tracer.span('rest OHLC'):
+            data = await scheduler.run_async('spot_public', request, key=('OHLC', pair, interval))
+
+        if data['error']:
+            raise Exception(f"Error fetching data from Kraken API: {data['error']}")
+        return data['result']
+
+    async def fetch_last_n_candles(self, pair, interval=5, num_candles=60):
+        result = await self.request_ohlc(pair, interval)
+        return kraken_toolbox.ohlc_to_dataframe(result[pair][-num_candles:])
+
+    def latency_summary(self):
+        """
+        Summarize the recorded decision-to-order-ack latencies.
+
+        :return: Dict with count, median, p95 and max in milliseconds, or None if nothing was recorded.
+        """
+        if not self.ack_latencies:
+            return None
+
+        latencies = sorted(self.ack_latencies)
+        return {
+            'count': len(latencies),
+            'median_ms': round(statistics.median(latencies), 2),
+            'p95_ms': round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+            'max_ms': round(latencies[-1], 2)
+        }
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+async def example():
+    open_pos_auth = kraken_toolbox.KrakenFuturesAuth(constants.kraken_public_key, constants.kraken_private_key,
+                                                     '/api/v3/openpositions')
+    async with AsyncKrakenFuturesClient() as client:
+        # Both requests are in flight at the same time on pooled connections
+        positions, price = await asyncio.gather(client.get_open_positions(open_pos_auth),
+                                                client.fetch_live_price('PF_XBTUSD'))
+        print(positions, price)
+
+
+asyncio.run(example())"""
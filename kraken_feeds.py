@@ -0,0 +1,299 @@
+import asyncio
+import json
+import time
+from collections import deque
+
+import websockets
+
+import constants
+import kraken_toolbox
+
+
+async def futures_ticker_feed(symbols, cache=None, on_update=None):
+    """
+    Keep a top-of-book cache up to date from the Kraken Futures public ticker websocket.
+
+    Reconnects and resubscribes if the connection drops or anything else fails (a rejected handshake during
+    maintenance, a malformed message), backing off up to constants.feed_max_backoff. While it is down the
+    cache ages out and fetch_live_price falls back to REST on its own, so the feed never stops the bot.
+
+    :param symbols: Futures symbols to subscribe to (e.g., ['PF_XBTUSD']).
+    :param cache: TopOfBookCache to update, defaults to kraken_toolbox.top_of_book.
+    :param on_update: Optional callable(symbol, last price) run after every ticker update with a last price.
+    """
+    cache = cache if cache is not None else kraken_toolbox.top_of_book
+    delay = 1
+
+    while True:
+        try:
+            async with websockets.connect(constants.futures_ws_url) as websocket:
+                await websocket.send(json.dumps({
+                    "event": "subscribe",
+                    "feed": "ticker",
+                    "product_ids": symbols
+                }))
+
+                async for message in websocket:
+                    data = json.loads(message)
+
+                    if data.get('feed') == 'ticker' and 'product_id' in data:
+                        timestamp = data['time'] / 1000 if 'time' in data else None
+                        cache.update(data['product_id'], data.get('last'), data.get('bid'), data.get('ask'),
+                                     timestamp)
+                        delay = 1
+                        if on_update is not None and data.get('last') is not None:
+                            on_update(data['product_id'], data['last'])
+
+                    elif data.get('event') in ('subscribed', 'error', 'alert'):
+                        print("Ticker feed:", data)
+
+        except (websockets.ConnectionClosed, OSError) as e:
+            print(f"Ticker feed disconnected ({e}), reconnecting in {delay}s")
+        except Exception as e:
+            print(f"Ticker feed failed ({e!r}), reconnecting in {delay}s")
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, constants.feed_max_backoff)
+
+
+# Kraken Futures order types on the websocket differ from the REST 'orderType' values
+ws_order_types = {'limit': 'lmt', 'stop': 'stop', 'take_profit': 'take_profit', 'market': 'mkt'}
+
+
+class AccountState:
+    """
+    In-memory positions, open orders and recent fills kept current by futures_private_feed.
+
+    open_positions() and open_orders() return the same shape as the REST openpositions and openorders
+    responses, so the strategy can read them without a signed round trip.
+    """
+
+    def __init__(self, max_fills=500):
+        self.positions = {}  # symbol -> position
+        self.orders = {}  # order_id -> order
+        self.fills = deque(maxlen=max_fills)
+        self.synced = set()  # feeds whose snapshot has been received
+        self.connected = False
+        self.last_update = None
+
+    def ready(self):
+        """True while connected and every feed has delivered its snapshot."""
+        return self.connected and {'open_positions', 'fills', 'open_orders'} <= self.synced
+
+    def reset(self):
+        self.connected = False
+        self.synced.clear()
+
+    def handle_message(self, data):
+        feed = data.get('feed')
+
+        if feed == 'open_positions':
+            # Every message carries the full list of positions
+            self.positions = {}
+            for position in data.get('positions', []):
+                balance = float(position['balance'])
+                if balance == 0:
+                    continue
+                symbol = position['instrument'].upper()
+                self.positions[symbol] = {
+                    'side': 'long' if balance > 0 else 'short',
+                    'symbol': symbol,
+                    'price': position.get('entry_price'),
+                    'size': abs(balance)
+                }
+            self.synced.add('open_positions')
+
+        elif feed in ('fills_snapshot', 'fills'):
+            for fill in data.get('fills', []):
+                self.fills.append({
+                    'fill_id': fill.get('fill_id'),
+                    'symbol': fill['instrument'].upper(),
+                    'side': 'buy' if fill.get('buy') else 'sell',
+                    'size': fill.get('qty'),
+                    'price': fill.get('price'),
+                    'order_id': fill.get('order_id'),
+                    'cliOrdId': fill.get('cli_ord_id'),
+                    'fillTime': fill.get('time'),
+                    'fillType': fill.get('fill_type')
+                })
+            self.synced.add('fills')
+
+        elif feed == 'open_orders_snapshot':
+            self.orders = {}
+            for order in data.get('orders', []):
+                self.orders[order['order_id']] = self.convert_order(order)
+            self.synced.add('open_orders')
+
+        elif feed == 'open_orders':
+            order_id = data.get('order_id') or data.get('order', {}).get('order_id')
+            if data.get('is_cancel'):
+                self.orders.pop(order_id, None)
+            elif 'order' in data:
+                self.orders[order_id] = self.convert_order(data['order'])
+
+        else:
+            return
+
+        self.last_update = time.monotonic()
+
+    @staticmethod
+    def convert_order(order):
+        qty = float(order.get('qty', 0))
+        filled = float(order.get('filled', 0))
+        return {
+            'order_id': order['order_id'],
+            'cliOrdId': order.get('cli_ord_id'),
+            'symbol': order['instrument'].upper(),
+            'side': 'buy' if order.get('direction', 0) == 0 else 'sell',
+            'orderType': ws_order_types.get(order.get('type'), order.get('type')),
+            'limitPrice': order.get('limit_price'),
+            'stopPrice': order.get('stop_price'),
+            'filledSize': filled,
+            'unfilledSize': qty - filled,
+            'reduceOnly': order.get('reduce_only', False),
+            'receivedTime': order.get('time')
+        }
+
+    def open_positions(self):
+        return {'result': 'success', 'openPositions': list(self.positions.values())}
+
+    def open_orders(self):
+        return {'result': 'success', 'openOrders': list(self.orders.values())}
+
+    def get_position(self, symbol):
+        return self.positions.get(symbol)
+
+
+# Shared account book read by live.py
+account_state = AccountState()
+
+
+async def futures_private_feed(auth, state=None, feeds=('open_positions', 'fills', 'open_orders')):
+    """
+    Subscribe to the authenticated Kraken Futures feeds and keep an AccountState current.
+
+    The websocket hands out a challenge that is signed with the KrakenFuturesAuth key material, then every
+    private subscription carries the original and signed challenge.
+
+    Any failure (a rejected handshake during maintenance, a malformed message, a message the state can't
+    apply) resets the state, so the strategy reads positions and orders over REST, and the feed reconnects
+    with a backoff up to constants.feed_max_backoff. It never stops the bot.
+
+    :param auth: KrakenFuturesAuth holding the API key and secret.
+    :param state: AccountState to update, defaults to the module level account_state.
+    :param feeds: Private feeds to subscribe to.
+    """
+    state = state if state is not None else account_state
+    delay = 1
+
+    while True:
+        try:
+            async with websockets.connect(constants.futures_ws_url) as websocket:
+                await websocket.send(json.dumps({"event": "challenge", "api_key": auth.api_key}))
+
+                async for message in websocket:
+                    data = json.loads(message)
+
+                    if data.get('event') == 'challenge':
+                        challenge = data['message']
+                        signed_challenge = auth.sign_challenge(challenge)
+                        for feed in feeds:
+                            await websocket.send(json.dumps({
+                                "event": "subscribe",
+                                "feed": feed,
+                                "api_key": auth.api_key,
+                                "original_challenge": challenge,
+                                "signed_challenge": signed_challenge
+                            }))
+                        state.connected = True
+                        delay = 1
+
+                    elif data.get('event') in ('subscribed', 'error', 'alert'):
+                        print("Private feed:", data)
+
+                    else:
+                        state.handle_message(data)
+
+        except (websockets.ConnectionClosed, OSError) as e:
+            print(f"Private feed disconnected ({e}), reconnecting in {delay}s")
+        except Exception as e:
+            print(f"Private feed failed ({e!r}), reconnecting in {delay}s")
+
+        # Drop back to REST until the new connection has resent its snapshots
+        state.reset()
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, constants.feed_max_backoff)
+
+
+class MockPrivateFeed:
+    """
+    Builds Kraken-format private feed messages and pushes them into an AccountState, so the position
+    logic can be exercised without an exchange connection.
+    """
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else AccountState()
+        self.next_id = 1
+
+    def new_id(self, prefix):
+        value = f'{prefix}-{self.next_id}'
+        self.next_id += 1
+        return value
+
+    def send(self, data):
+        self.state.handle_message(data)
+        return data
+
+    def connect(self, positions=None, orders=None, fills=None):
+        """Deliver the snapshots a real connection sends right after subscribing."""
+        self.state.connected = True
+        self.send({'feed': 'fills_snapshot', 'fills': fills or []})
+        self.send({'feed': 'open_orders_snapshot', 'orders': orders or []})
+        self.send({'feed': 'open_positions', 'positions': positions or []})
+
+    def disconnect(self):
+        self.state.reset()
+
+    def set_positions(self, positions):
+        """
+        :param positions: List of (symbol, signed size, entry price), negative sizes are shorts.
+        """
+        return self.send({'feed': 'open_positions', 'positions': [
+            {'instrument': symbol, 'balance': balance, 'entry_price': price}
+            for symbol, balance, price in positions
+        ]})
+
+    def fill(self, symbol, side, qty, price, order_id=None, cli_ord_id=None):
+        return self.send({'feed': 'fills', 'fills': [{
+            'instrument': symbol,
+            'time': int(time.time() * 1000),
+            'price': price,
+            'buy': side == 'buy',
+            'qty': qty,
+            'order_id': order_id or self.new_id('order'),
+            'cli_ord_id': cli_ord_id,
+            'fill_id': self.new_id('fill'),
+            'fill_type': 'taker'
+        }]})
+
+    def add_order(self, symbol, side, qty, order_type='limit', limit_price=None, stop_price=None,
+                  cli_ord_id=None):
+        order_id = self.new_id('order')
+        self.send({'feed': 'open_orders', 'order': {
+            'instrument': symbol,
+            'time': int(time.time() * 1000),
+            'qty': qty,
+            'filled': 0,
+            'limit_price': limit_price,
+            'stop_price': stop_price,
+            'type': order_type,
+            'order_id': order_id,
+            'cli_ord_id': cli_ord_id,
+            'direction': 0 if side == 'buy' else 1,
+            'reduce_only': order_type in ('stop', 'take_profit')
+        }, 'is_cancel': False})
+        return order_id
+
+    def cancel_order(self, order_id):
+        return self.send({'feed': 'open_orders', 'order_id': order_id, 'is_cancel': True,
+                          'reason': 'cancelled_by_user'})
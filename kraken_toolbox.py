@@ -5,11 +5,141 @@ import constants
 import datetime
 import time
 import json
+import sqlite3
+import uuid
 import pandas as pd
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from rate_limiter import scheduler, futures_cost, PRIORITY_ORDER, PRIORITY_ACCOUNT
+from schema import create_candles_table
 
-# Define the base API URL for Kraken Futures
-api_url = 'https://futures.kraken.com/derivatives/api/v3'
+
+# Define the base API URLs for Kraken Spot (public market data) and Kraken Futures
+spot_api_url = constants.spot_api_url
+api_url = constants.futures_api_url
+
+# (connect, read) timeout applied to every call so a slow endpoint can't hang the loop
+request_timeout = (constants.rest_connect_timeout, constants.rest_read_timeout)
+
+
+def create_session(retries=constants.rest_max_retries):
+    """
+    Build a requests session with connection pooling, keep-alive and retry with backoff.
+
+    Only GET calls are retried on 429/5xx responses, an order POST is never re-sent automatically.
+
+    :param retries: Retries per GET, 0 for a session whose requests are never replayed.
+    :return: A configured requests.Session.
+    """
+    retry = Retry(
+        total=retries,
+        backoff_factor=constants.rest_backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=retry)
+
+    new_session = requests.Session()
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+
+# Shared client, every call below reuses its pooled connections
+session = create_session()
+
+# Signed GETs are never retried: a retry would resend the same signature, which Kraken rejects
+signed_session = create_session(retries=0)
+
+# Cached responses: key -> (expiry on the monotonic clock, value)
+response_cache = {}
+
+
+def cache_get(key):
+    entry = response_cache.get(key)
+    if entry is None:
+        return None
+
+    expires, value = entry
+    if time.monotonic() >= expires:
+        del response_cache[key]
+        return None
+    return value
+
+
+def cache_set(key, value, ttl):
+    response_cache[key] = (time.monotonic() + ttl, value)
+    return value
+
+
+def clear_cache():
+    response_cache.clear()
+
+
+class TopOfBookCache:
+    """
+    Latest last/bid/ask per futures symbol, fed by kraken_feeds.futures_ticker_feed.
+
+    Lookups are a single dict access. Quotes older than max_age seconds are treated as stale so callers
+    fall back to REST instead of trading on an old price.
+    """
+
+    def __init__(self, max_age=constants.ticker_max_age):
+        self.max_age = max_age
+        self.books = {}
+
+    def update(self, symbol, last_price, bid, ask, timestamp=None):
+        self.books[symbol] = {
+            'last_price': last_price,
+            'bid': bid,
+            'ask': ask,
+            'timestamp': timestamp if timestamp is not None else time.time(),
+            'received': time.monotonic()
+        }
+
+    def age(self, symbol):
+        """Seconds since the last streamed update for the symbol, None if it was never received."""
+        book = self.books.get(symbol)
+        if book is None:
+            return None
+        return time.monotonic() - book['received']
+
+    def get(self, symbol):
+        book = self.books.get(symbol)
+        if book is None:
+            return None
+
+        age = time.monotonic() - book['received']
+        if age > self.max_age:
+            return None
+
+        return {
+            'last_price': book['last_price'],
+            'bid': book['bid'],
+            'ask': book['ask'],
+            'timestamp': book['timestamp'],
+            'age': age
+        }
+
+
+# Shared top-of-book cache read by fetch_live_price
+top_of_book = TopOfBookCache()
+
+
+def ticker_quote(item):
+    """
+    Quote of an item of the REST /tickers response, in the shape TopOfBookCache.get returns. The timestamp
+    is the time of receipt and age is None, the quote didn't come from the stream.
+    """
+    return {
+        'last_price': item['last'],
+        'bid': item['bid'],
+        'ask': item['ask'],
+        'timestamp': time.time(),
+        'age': None
+    }
 
 
 class KrakenFuturesAuth:
@@ -34,44 +164,87 @@ class KrakenFuturesAuth:
         # print("Generated signature:", signature)  # Debugging
         return signature
 
+    def sign_challenge(self, challenge):
+        """Sign the challenge handed out by the futures websocket for the private feeds."""
+        sha256_hash = hashlib.sha256()
+        sha256_hash.update(challenge.encode())
+
+        secret_key = base64.b64decode(self.api_secret)
+        hmac_sha512 = hmac.new(secret_key, sha256_hash.digest(), hashlib.sha512)
+        return base64.b64encode(hmac_sha512.digest()).decode()
+
+    def auth_headers(self, postData=''):
+        return {
+            "APIKey": self.api_key,
+            "Authent": self.generate_signature(postData)
+        }
+
     def __call__(self, request):
 
         postData = request.body if request.body else ''
         # print("Request body (postData):", postData)  # Debugging
         # print("Endpoint path:", self.endpoint)  # Debugging
 
-        signature = self.generate_signature(postData)
-        request.headers.update({
-            "APIKey": self.api_key,
-            "Authent": signature
-        })
+        request.headers.update(self.auth_headers(postData))
         # print("Request headers:", request.headers)  # Debugging
         return request
 
 
-def fetch_candles_since(pair, interval=5, start_time=None):
+def request_ohlc(pair, interval, since=None):
     """
-    Fetch OHLC candles from Kraken starting from a specific timestamp.
+    Call Kraken's public OHLC endpoint and return the raw 'result' object.
 
     :param pair: The trading pair (e.g., 'XXBTZUSD' for BTC/USD).
-    :param interval: The interval in minutes (1, 5, 15, 30, 60, 240, 1440, 10080, 21600).
-    :param start_time: The starting timestamp in seconds.
-    :return: DataFrame containing the OHLC data.
+    :param interval: The interval in minutes.
+    :param since: Optional timestamp (or 'last' cursor) to return candles after.
+    :return: Dict holding the candle rows under the pair key and the 'last' cursor.
     """
-    url = 'https://api.kraken.com/0/public/OHLC'
     params = {
         'pair': pair,
-        'interval': interval,
-        'since': start_time
+        'interval': interval
     }
+    if since is not None:
+        params['since'] = since
 
-    response = requests.get(url, params=params)
+    # Identical candle requests in flight at the same time share one response
+    response = scheduler.run('spot_public',
+                             lambda: session.get(spot_api_url + '/OHLC', params=params, timeout=request_timeout),
+                             key=('OHLC', pair, interval, since))
     data = response.json()
 
     if data['error']:
         raise Exception(f"Error fetching data from Kraken API: {data['error']}")
 
-    ohlc_data = data['result'][pair]
+    return data['result']
+
+
+def request_trades(pair, since=None):
+    """
+    Call Kraken's public Trades endpoint, up to 1000 trades per call.
+
+    :param pair: The trading pair (e.g., 'XBTUSD').
+    :param since: Optional 'last' cursor of the previous page (nanoseconds), or a timestamp in seconds.
+    :return: (trade rows [price, volume, time, side, type, misc, trade_id], 'last' cursor of the next page).
+    """
+    params = {'pair': pair}
+    if since is not None:
+        params['since'] = since
+
+    response = scheduler.run('spot_public',
+                             lambda: session.get(spot_api_url + '/Trades', params=params, timeout=request_timeout))
+    data = response.json()
+
+    if data['error']:
+        raise Exception(f"Error fetching data from Kraken API: {data['error']}")
+
+    result = data['result']
+    last = result.pop('last')
+    # The result is keyed by Kraken's own pair name, e.g. XXBTZUSD for XBTUSD
+    trades = next(iter(result.values()), [])
+    return trades, last
+
+
+def ohlc_to_dataframe(ohlc_data):
     df = pd.DataFrame(ohlc_data, columns=['time', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'])
 
     # Convert timestamp to datetime
@@ -84,38 +257,166 @@ def fetch_candles_since(pair, interval=5, start_time=None):
     return df
 
 
-def fetch_last_n_candles(pair, interval=5, num_candles=60):
+def ohlc_row(candle):
+    """Convert an OHLC row of the REST response to [time, open, high, low, close, vwap, volume, count] numbers."""
+    open_, high, low, close, vwap, volume = map(float, candle[1:7])
+    return [int(candle[0]), open_, high, low, close, vwap, volume, int(candle[7])]
+
+
+def candle_gaps(rows, seconds):
     """
-    Fetch the last N OHLC candles from Kraken.
+    :return: List of (first, last) times of the candles missing between consecutive rows, oldest first.
+    """
+    return [(previous[0] + seconds, row[0] - seconds) for previous, row in zip(rows, rows[1:])
+            if row[0] - previous[0] > seconds]
+
+
+class CandleStore:
+    """
+    Closed OHLC candles from Kraken's REST endpoint, stored for good in the candles table keyed by
+    (pair, interval, time).
+
+    Closed candles never change, so a query only requests the candles after the newest stored one, paging
+    forward with the 'last' cursor, and the forming candle is reused for a few seconds. Repeated queries
+    are answered by SQLite without a request.
+
+    Kraken only serves the 720 most recent candles of an interval, so a look-back further than that is
+    complete only for the stretch the store already holds. A truncated result is reported, not hidden, and
+    so is a hole left when the store went unsynced for longer than those 720 candles: the candles in it
+    can't be fetched any more, the rows around it are returned and the missing ranges are kept in gaps.
+    """
+
+    page_size = 720  # most candles Kraken returns per call
+
+    def __init__(self, path=None):
+        self.path = path or constants.db_path
+        self.conn = None  # opened on first use, processes that never fetch candles don't connect
+        self.gaps = {}  # (pair, interval) -> missing (first, last) candle times of the last candles_since
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute(create_candles_table)
+            self.conn.commit()
+        return self.conn
+
+    def newest(self, pair, interval):
+        cursor = self.connect().cursor()
+        cursor.execute("SELECT MAX(time) FROM candles WHERE pair = ? AND interval = ?", (pair, interval))
+        return cursor.fetchone()[0]
+
+    def stored(self, pair, interval, start_time):
+        """Closed candles ending after start_time, oldest first."""
+        cursor = self.connect().cursor()
+        cursor.execute("""
+        SELECT time, open, high, low, close, vwap, volume, count
+        FROM candles
+        WHERE pair = ? AND interval = ? AND time > ?
+        ORDER BY time ASC
+        """, (pair, interval, start_time - interval * 60))
+        return [list(row) for row in cursor.fetchall()]
+
+    def store(self, pair, interval, rows):
+        conn = self.connect()
+        conn.executemany("""
+        INSERT OR REPLACE INTO candles (pair, interval, time, open, high, low, close, vwap, volume, count)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(pair, interval, *row) for row in rows])
+        conn.commit()
+
+    def sync(self, pair, interval, start_time):
+        """
+        Request the candles after the newest stored one, or from start_time if the store doesn't reach it,
+        up to the present.
+
+        :return: The forming candle row, None if the endpoint returned nothing.
+        """
+        seconds = interval * 60
+        newest = self.newest(pair, interval)
+        # From one candle before the one holding start_time, so it comes back whole whatever 'since' includes
+        since = newest if newest is not None and newest + seconds >= start_time else \
+            int(start_time // seconds * seconds) - seconds
+
+        forming = None
+        while True:
+            result = request_ohlc(pair, interval, since=since)
+            page = [ohlc_row(candle) for candle in result[pair]]
+            if not page:
+                break
+            if forming is None and since == newest and page[0][0] > since + seconds:
+                # The newest stored candle is older than the 720 Kraken keeps, the candles after it are lost
+                print(f"{pair} {interval}m candles {since + seconds} to {page[0][0] - seconds} are no longer "
+                      f"served by Kraken, the store has a hole there")
+
+            # The last row of every response is the candle still forming at the time of the call
+            self.store(pair, interval, page[:-1])
+            forming = page[-1]
+
+            # A full page that stops short of the present has more after it
+            if len(page) < self.page_size or forming[0] + seconds > time.time() or result['last'] == since:
+                break
+            since = result['last']
+        return forming
+
+    def candles_since(self, pair, interval, start_time):
+        """
+        :return: List of rows [time, open, high, low, close, vwap, volume, count] of the candles ending
+                 after start_time, the forming one last.
+        """
+        seconds = interval * 60
+        key = ('ohlc_forming', pair, interval)
+        cached = cache_get(key)
+        if cached is None or cached['from'] > start_time:
+            cached = cache_set(key, {'forming': self.sync(pair, interval, start_time), 'from': start_time},
+                               constants.forming_candle_ttl)
+
+        rows = self.stored(pair, interval, start_time)
+        forming = cached['forming']
+        if forming is not None and (not rows or forming[0] > rows[-1][0]):
+            rows.append(forming)
+
+        if rows and rows[0][0] > start_time + seconds:
+            print(f"{pair} {interval}m candles only reach back to {rows[0][0]}, {int(start_time)} was asked")
+
+        gaps = candle_gaps(rows, seconds)
+        self.gaps[(pair, interval)] = gaps
+        if gaps:
+            missing = sum((last - first) // seconds + 1 for first, last in gaps)
+            print(f"{pair} {interval}m candles since {int(start_time)} miss {missing} candles in {len(gaps)} "
+                  f"gaps: {', '.join(f'{first}-{last}' for first, last in gaps)}")
+        return rows
+
+
+# Candles of every pair and interval requested through fetch_candles_since
+candle_store = CandleStore()
+
+
+def fetch_candles_since(pair, interval=5, start_time=None):
+    """
+    Fetch OHLC candles from Kraken starting from a specific timestamp.
 
     :param pair: The trading pair (e.g., 'XXBTZUSD' for BTC/USD).
     :param interval: The interval in minutes (1, 5, 15, 30, 60, 240, 1440, 10080, 21600).
-    :param num_candles: The number of candles to fetch.
+    :param start_time: The starting timestamp in seconds, None for the latest candles Kraken returns.
     :return: DataFrame containing the OHLC data.
     """
-    url = 'https://api.kraken.com/0/public/OHLC'
-    params = {
-        'pair': pair,
-        'interval': interval
-    }
-
-    response = requests.get(url, params=params)
-    data = response.json()
+    if start_time is None:
+        return ohlc_to_dataframe(request_ohlc(pair, interval)[pair])
 
-    if data['error']:
-        raise Exception(f"Error fetching data from Kraken API: {data['error']}")
+    return ohlc_to_dataframe(candle_store.candles_since(pair, interval, start_time))
 
-    ohlc_data = data['result'][pair][-num_candles:]
-    df = pd.DataFrame(ohlc_data, columns=['time', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'count'])
 
-    # Convert timestamp to datetime
-    df['time'] = pd.to_datetime(df['time'], unit='s')
-
-    # Ensure numeric types for calculations
-    df[['open', 'high', 'low', 'close', 'vwap', 'volume']] = df[
-        ['open', 'high', 'low', 'close', 'vwap', 'volume']].apply(pd.to_numeric)
+def fetch_last_n_candles(pair, interval=5, num_candles=60):
+    """
+    Fetch the last N OHLC candles from Kraken.
 
-    return df
+    :param pair: The trading pair (e.g., 'XXBTZUSD' for BTC/USD).
+    :param interval: The interval in minutes (1, 5, 15, 30, 60, 240, 1440, 10080, 21600).
+    :param num_candles: The number of candles to fetch.
+    :return: DataFrame containing the OHLC data.
+    """
+    ohlc_data = request_ohlc(pair, interval)[pair][-num_candles:]
+    return ohlc_to_dataframe(ohlc_data)
 
 
 def place_order(auth, symbol, side, size, orderType='mkt', limitPrice=None, stopPrice=None, clientOrderId=None):
@@ -140,8 +441,10 @@ def place_order(auth, symbol, side, size, orderType='mkt', limitPrice=None, stop
     print(order)
 
     postBody = urllib.parse.urlencode(order)
-    response = requests.post(full_url, data=postBody, auth=auth,
-                             headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = scheduler.run('futures_private',
+                             lambda: session.post(full_url, data=postBody, auth=auth, timeout=request_timeout,
+                                                  headers={'Content-Type': 'application/x-www-form-urlencoded'}),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ORDER)
 
     print(response.json())
     return response.json()
@@ -157,7 +460,10 @@ def get_open_positions(auth):
         'Accept': 'application/json',
     }
 
-    response = requests.get(full_url, auth=auth, headers=headers, data=payload)
+    response = scheduler.run('futures_private',
+                             lambda: signed_session.get(full_url, auth=auth, headers=headers, data=payload,
+                                                 timeout=request_timeout),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ACCOUNT)
     return response.json()
 
 
@@ -171,7 +477,10 @@ def get_open_fills(auth):
         'Accept': 'application/json',
     }
 
-    response = requests.get(full_url, auth=auth, headers=headers, data=payload)
+    response = scheduler.run('futures_private',
+                             lambda: signed_session.get(full_url, auth=auth, headers=headers, data=payload,
+                                                 timeout=request_timeout),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ACCOUNT)
     return response.json()
 
 
@@ -179,48 +488,63 @@ def get_account_info(auth):
     endpoint = '/accounts'  # Replace with the correct endpoint for account information
     full_url = api_url + endpoint
 
-    response = requests.get(full_url, auth=auth, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = scheduler.run('futures_private',
+                             lambda: signed_session.get(full_url, auth=auth, timeout=request_timeout,
+                                                 headers={'Content-Type': 'application/x-www-form-urlencoded'}),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ACCOUNT)
     return response.json()
 
 
 def get_instruments():
-    url = "https://futures.kraken.com/derivatives/api/v3/instruments"
+    cached = cache_get('instruments')
+    if cached is not None:
+        return cached
+
+    url = api_url + '/instruments'
 
     payload = {}
     headers = {
         'Accept': 'application/json'
     }
 
-    response = requests.request("GET", url, headers=headers, data=payload)
+    response = scheduler.run('futures_public',
+                             lambda: session.get(url, headers=headers, data=payload, timeout=request_timeout),
+                             key=url)
+    data = response.json()
 
-    return response.json()
+    # Only cache successful responses so an error isn't served for an hour
+    if data.get('result') == 'success':
+        cache_set('instruments', data, constants.instruments_cache_ttl)
+    return data
 
 
 def get_future_price(pair):
 
-    url = "https://api.kraken.com/0/public/Ticker"
+    url = spot_api_url + '/Ticker'
     params = {
         'pair': pair
     }
-    response = requests.get(url, params=params)
+    response = scheduler.run('spot_public', lambda: session.get(url, params=params, timeout=request_timeout),
+                             key=('Ticker', pair))
     data = response.json()
     print(data)
     return data['result'][pair]['c'][0]
 
 
 def fetch_live_price(symbol):
-    url = f"https://futures.kraken.com/derivatives/api/v3/tickers"
-    response = requests.get(url)
+    # Served from the streaming cache while it is fresh, the full ticker download is only a fallback
+    price = top_of_book.get(symbol)
+    if price is not None:
+        return price
+
+    url = api_url + '/tickers'
+    response = scheduler.run('futures_public', lambda: session.get(url, timeout=request_timeout), key=url)
     if response.status_code == 200:
         data = response.json()
         # Search for the specific symbol in the data
         for item in data.get('tickers', []):
             if item['symbol'] == symbol:
-                return {
-                    'last_price': item['last'],
-                    'bid': item['bid'],
-                    'ask': item['ask']
-                }
+                return ticker_quote(item)
     else:
         print(f"Failed to fetch data: {response.status_code}")
         return None
@@ -236,7 +560,10 @@ def get_open_orders(auth):
         'Accept': 'application/json',
     }
 
-    response = requests.get(full_url, auth=auth, headers=headers, data=payload)
+    response = scheduler.run('futures_private',
+                             lambda: signed_session.get(full_url, auth=auth, headers=headers, data=payload,
+                                                 timeout=request_timeout),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ACCOUNT)
     return response.json()
 
 
@@ -249,8 +576,10 @@ def cancel_order(auth, order_id):
     }
 
     postBody = urllib.parse.urlencode(payload)
-    response = requests.post(full_url, data=postBody, auth=auth,
-                             headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = scheduler.run('futures_private',
+                             lambda: session.post(full_url, data=postBody, auth=auth, timeout=request_timeout,
+                                                  headers={'Content-Type': 'application/x-www-form-urlencoded'}),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ORDER)
 
     print("Request sent to:", full_url)
     print("Payload:", postBody)
@@ -282,13 +611,196 @@ def edit_order(auth, size, orderId= None, limitPrice=None, stopPrice=None, clien
 
     print(order)
     postBody = urllib.parse.urlencode(order)
-    response = requests.post(full_url, data=postBody, auth=auth,
-                             headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    response = scheduler.run('futures_private',
+                             lambda: session.post(full_url, data=postBody, auth=auth, timeout=request_timeout,
+                                                  headers={'Content-Type': 'application/x-www-form-urlencoded'}),
+                             cost=futures_cost(endpoint), priority=PRIORITY_ORDER)
 
     print(response.json())
     return response.json()
 
 
+def batch_send(symbol, side, size, orderType='mkt', limitPrice=None, stopPrice=None, clientOrderId=None,
+               reduceOnly=None):
+    """Build a 'send' instruction for batch_order, arguments match place_order."""
+    instruction = {
+        'order': 'send',
+        'orderType': orderType,
+        'symbol': symbol,
+        'side': side,
+        'size': size
+    }
+    if stopPrice is not None:
+        instruction['stopPrice'] = stopPrice
+
+    if limitPrice is not None:
+        instruction['limitPrice'] = limitPrice
+
+    if clientOrderId is not None:
+        instruction['cliOrdId'] = clientOrderId
+
+    if reduceOnly is not None:
+        instruction['reduceOnly'] = reduceOnly
+
+    return instruction
+
+
+def batch_edit(size=None, orderId=None, limitPrice=None, stopPrice=None, clientOrderId=None):
+    """Build an 'edit' instruction for batch_order, arguments match edit_order."""
+    instruction = {'order': 'edit'}
+
+    if size is not None:
+        instruction['size'] = size
+
+    if orderId is not None:
+        instruction['order_id'] = orderId
+
+    if clientOrderId is not None:
+        instruction['cliOrdId'] = clientOrderId
+
+    if stopPrice is not None:
+        instruction['stopPrice'] = stopPrice
+
+    if limitPrice is not None:
+        instruction['limitPrice'] = limitPrice
+
+    return instruction
+
+
+def batch_cancel(orderId=None, clientOrderId=None):
+    """Build a 'cancel' instruction for batch_order, by exchange order id or client order id."""
+    instruction = {'order': 'cancel'}
+
+    if orderId is not None:
+        instruction['order_id'] = orderId
+
+    if clientOrderId is not None:
+        instruction['cliOrdId'] = clientOrderId
+
+    return instruction
+
+
+def protected_entry(symbol, side, size, stop_loss=None, take_profit=None, clientOrderId=None):
+    """
+    Build the instructions for a market entry plus its reduce-only stop loss and take profit.
+
+    The client order ids share one prefix: '<prefix>-entry', '<prefix>-sl' and '<prefix>-tp'.
+
+    :return: List of batch instructions, entry first.
+    """
+    prefix = clientOrderId if clientOrderId is not None else uuid.uuid4().hex[:16]
+    exit_side = 'sell' if side == 'buy' else 'buy'
+
+    instructions = [batch_send(symbol, side, size, clientOrderId=prefix + '-entry')]
+    if stop_loss is not None:
+        instructions.append(batch_send(symbol, exit_side, size, orderType='stp', stopPrice=stop_loss,
+                                       clientOrderId=prefix + '-sl', reduceOnly=True))
+    if take_profit is not None:
+        instructions.append(batch_send(symbol, exit_side, size, orderType='take_profit', stopPrice=take_profit,
+                                       clientOrderId=prefix + '-tp', reduceOnly=True))
+    return instructions
+
+
+def batch_body(instructions):
+    """
+    Tag every 'send' instruction and encode the batch as the /batchorder form body.
+
+    :return: (tagged instructions, url encoded body)
+    """
+    batch = []
+    for i, instruction in enumerate(instructions):
+        instruction = dict(instruction)
+        # Sends only get an order id from the exchange, the tag is how their result is found again
+        if instruction['order'] == 'send' and 'order_tag' not in instruction:
+            instruction['order_tag'] = str(i)
+        batch.append(instruction)
+
+    postBody = urllib.parse.urlencode({'json': json.dumps({'batchOrder': batch})})
+    return batch, postBody
+
+
+def map_batch_results(batch, response):
+    """
+    Pair each instruction of a batch with its entry in the response's batchStatus.
+
+    :param batch: Tagged instructions returned by batch_body.
+    :param response: Decoded /batchorder response.
+    :return: Dict with the overall 'result', the raw 'response' and 'orders' keyed by client order id
+             (or order tag / order id when no client id was given). Each order holds its instruction,
+             exchange status and order id, the status is 'missing' when the exchange didn't report it.
+    """
+    statuses = response.get('batchStatus', [])
+    by_tag = {status['order_tag']: status for status in statuses if status.get('order_tag') is not None}
+    by_id = {status['order_id']: status for status in statuses if status.get('order_id')}
+    by_client_id = {status['cliOrdId']: status for status in statuses if status.get('cliOrdId')}
+
+    orders = {}
+    for instruction in batch:
+        if instruction['order'] == 'send':
+            status = by_tag.get(instruction['order_tag'])
+        else:
+            status = by_id.get(instruction.get('order_id')) or by_client_id.get(instruction.get('cliOrdId'))
+
+        key = instruction.get('cliOrdId') or instruction.get('order_tag') or instruction.get('order_id')
+        orders[key] = {
+            'instruction': instruction,
+            'status': status.get('status') if status else 'missing',
+            'order_id': status.get('order_id') if status else instruction.get('order_id'),
+            'result': status
+        }
+
+    return {'result': response.get('result'), 'orders': orders, 'response': response}
+
+
+# Statuses of a batch instruction the exchange carried out, anything else is a rejection
+accepted_statuses = frozenset(['placed', 'edited', 'cancelled'])
+
+
+def order_accepted(result, key):
+    """True if the order under key in a map_batch_results result was placed, edited or cancelled."""
+    order = result['orders'].get(key)
+    return order is not None and order['status'] in accepted_statuses
+
+
+def filled_price(result, key):
+    """
+    Average execution price of the order under key in a map_batch_results result.
+
+    :return: The price, None if the order was rejected or has no execution yet.
+    """
+    if not order_accepted(result, key):
+        return None
+    executions = [event for event in (result['orders'][key]['result'] or {}).get('orderEvents', [])
+                  if event.get('type') == 'EXECUTION']
+    size = sum(float(event['amount']) for event in executions)
+    if size == 0:
+        return None
+    return sum(float(event['amount']) * float(event['price']) for event in executions) / size
+
+
+def batch_order(auth, instructions):
+    """
+    Send several order instructions (send, edit, cancel) to /batchorder in one round trip.
+
+    :param auth: KrakenFuturesAuth for '/api/v3/batchorder'.
+    :param instructions: Instructions built with batch_send, batch_edit, batch_cancel or protected_entry.
+    :return: Per-order results, see map_batch_results.
+    """
+    endpoint = '/batchorder'
+    full_url = api_url + endpoint
+
+    batch, postBody = batch_body(instructions)
+    print(batch)
+
+    response = scheduler.run('futures_private',
+                             lambda: session.post(full_url, data=postBody, auth=auth, timeout=request_timeout,
+                                                  headers={'Content-Type': 'application/x-www-form-urlencoded'}),
+                             cost=futures_cost(endpoint, len(batch)), priority=PRIORITY_ORDER)
+
+    print(response.json())
+    return map_batch_results(batch, response.json())
+
+
 """__________________________________________________________________________________________________________________"""
 
 # Usage
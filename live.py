@@ -1,51 +1,78 @@
 import asyncio
 import json
 import sqlite3
+import time
+import uuid
 import websockets
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 import numpy as np
 import constants
 from sklearn.linear_model import LinearRegression
-import pytz
 
 from constants import dollar_threshold
-from dollar_bars import fetch_trades, create_dollar_bars
-from get_signals import get_market_signal, calculate_stochastic_rsi, check_stochastic_setup, get_rsi
-from kraken_toolbox import (get_open_positions, place_order, fetch_live_price,
-                            fetch_last_n_candles, fetch_candles_since,KrakenFuturesAuth)
+from get_signals import get_rsi
+from kraken_toolbox import (KrakenFuturesAuth, top_of_book, batch_send, batch_cancel, protected_entry,
+                            order_accepted, filled_price, ohlc_to_dataframe)
+from kraken_async import AsyncKrakenFuturesClient
+from kraken_feeds import futures_ticker_feed, futures_private_feed, account_state
+from rate_limiter import scheduler
+from position_trackers import PositionTrackers
+from candles import CandleBuilder
+from ingest import store_trades
+from order_book import OrderBook, book_subscription
+from tracing import tracer
+from profiling import CycleProfiler
+from schema import upgrade_tables
+from strategy_runner import (create_runners, create_executor, get_stops, is_us_market_opening_soon, exit_reason,
+                             entry_side)
+from snapshots import read_snapshot, write_snapshot
 
 
 # Database connection
-conn = sqlite3.connect('trading_data.db')
+conn = sqlite3.connect(constants.db_path)
 cursor = conn.cursor()
+upgrade_tables(cursor)
+
+# One strategy runner per traded symbol, trades are routed to them by spot pair
+runners = create_runners()
+pair_symbols = {runner.pair: symbol for symbol, runner in runners.items()}
+
+# Running high/low per open position, fed from the trade stream
+position_trackers = PositionTrackers(cursor, {symbol: runner.pair for symbol, runner in runners.items()})
+
+# 1m/5m/15m/1h candles per traded pair, fed from the trade stream like the trackers
+candle_builders = {runner.pair: CandleBuilder(runner.pair) for runner in runners.values()}
+
+# Local L2 books of the traded pairs, only when the book channel is enabled
+order_books = {pair: OrderBook(pair) for pair in pair_symbols} if constants.book_depth else {}
+
+# Stage timings of every analysis cycle, cProfile on request
+cycle_profiler = CycleProfiler(cursor)
 
-# Store channel ID for trades
-trade_channel_id = None
 order_auth = KrakenFuturesAuth(constants.kraken_public_key, constants.kraken_private_key, '/api/v3/sendorder')
 open_orders_auth = KrakenFuturesAuth(constants.kraken_public_key, constants.kraken_private_key, '/api/v3/openorders')
 open_pos_auth = KrakenFuturesAuth(constants.kraken_public_key, constants.kraken_private_key, '/api/v3/openpositions')
-stored_signal = None
-position_ids = {}
+batch_auth = KrakenFuturesAuth(constants.kraken_public_key, constants.kraken_private_key, '/api/v3/batchorder')
+futures_client = None  # AsyncKrakenFuturesClient, opened in main()
+executor = None  # process pool building the bars and signals, created in main()
 
 
 # Function to insert trade data
-def insert_trade(trades):
-    for trade in trades:
-        print(f"Processing trade: {trade}")  # Log each trade
-        price, volume, trade_time, side, type_order, *_ = trade
-        side = 'buy' if side == 'b' else 'sell'
-        type_order = 'market' if 'm' in trade[4:] else 'limit'
-        cursor.execute("INSERT INTO trades (timestamp, price, volume, side, type_order) VALUES (?, ?, ?, ?, ?)",
-                       (trade_time, price, volume, side, type_order))
-    conn.commit()
+def insert_trade(trades, pair='XBT/USD'):
+    # Tracker state and closed candles are committed with the trades they have seen
+    store_trades(cursor, trades, pair, position_trackers, pair_symbols.get(pair), candle_builders.get(pair))
+    with tracer.span('commit'):
+        conn.commit()
 
 
-def insert_signal(order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal):
+def insert_signal(order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal,
+                  symbol=None):
     timestamp = int(datetime.now(timezone.utc).timestamp())
     cursor.execute("""
-    INSERT INTO signals (timestamp, order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal)
-    VALUES (?, ?, ?, ?, ?, ?)
-    """, (timestamp, order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal))
+    INSERT INTO signals (timestamp, order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal, symbol)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (timestamp, order_flow_signal, order_flow_score, market_pressure, volume_profile_signal, price_action_signal,
+          symbol))
     conn.commit()
 
 
@@ -55,6 +82,7 @@ def insert_position(symbol, open_price, side, size, take_profit, stop_loss):
     INSERT INTO opened_positions (symbol, timestamp, open_price, side, size, take_profit, stop_loss)
     VALUES (?, ?, ?, ?, ?, ?, ?)
     """, (symbol, timestamp, open_price, side, size, take_profit, stop_loss))
+    position_trackers.open(cursor.lastrowid, symbol, side, size, open_price, timestamp)
     conn.commit()
 
 
@@ -65,6 +93,7 @@ def close_position(position_id, close_reason, close_price):
     SET close_reason = ?, close_price = ?, close_time = ?
     WHERE id = ?
     """, (close_reason, close_price, close_time, position_id))
+    position_trackers.close(position_id)
     conn.commit()
 
 
@@ -78,79 +107,45 @@ def fetch_open_position(symbol):
     return open_positions
 
 
-def calculate_average_move(dollar_bars, num_bars):
-    # Check if dollar_bars DataFrame is empty or if it contains fewer bars than num_bars
-    if dollar_bars.empty or len(dollar_bars) < num_bars:
-        print("Not enough dollar bars available.")
-        return None
-
-    selected_bars = dollar_bars.tail(num_bars)  # Select the last num_bars rows
-    average_move = (selected_bars['high'] - selected_bars['low']).mean()
-    return average_move * 2
-
-
-def get_stops(dollar_bars, side, current_price):
-
-    take_profit = None
-    stop_loss = None
-    average_move = calculate_average_move(dollar_bars, 7)
-
-    if side == 'buy':
-        take_profit = current_price + average_move
-        stop_loss = current_price - (average_move * 0.7)
-    if side == 'sell':
-        take_profit = current_price - average_move
-        stop_loss = current_price + (average_move * 0.7)
-
-    return take_profit, stop_loss
-
-
-def check_trailing_stop(symbol, open_timestamp, open_price, current_price, side, threshold=500, drop_percentage=0.20):
+def check_trailing_stop(tracker, current_price, threshold=500, drop_percentage=0.20):
     """
     Check if the current price triggers the trailing stop.
 
+    :param tracker: The position's ExcursionTracker, holding the running high and low since the open.
     :param current_price: current price
-    :param symbol: The trading pair (e.g., 'XXBTUSD' for BTC/USD).
-    :param open_timestamp: The timestamp when the position was opened.
-    :param open_price: The price at which the position was opened.
-    :param side: The side of the trade ('long' or 'short').
-    :param threshold: The minimum points the price should move up before trailing stop applies.
+    :param threshold: The minimum points the price should move in favor before the trailing stop applies.
     :param drop_percentage: The percentage drop from the peak to trigger the stop.
     :return: Boolean indicating whether to close the position.
     """
-    candles = fetch_candles_since(symbol, start_time=open_timestamp)
-
-    if side == 'long':
-        # Find the highest price since the position was opened
-        max_price = candles['high'].max()
-
-        # Check if the price has moved up by at least the threshold
-        if max_price >= open_price + threshold:
-            # Calculate the trailing stop price
-            max_points = max_price - open_price
-            trailing_stop_points = max_points * (1 - drop_percentage)
-            trailing_stop = open_price + trailing_stop_points
-
-            # Check if the current price is below the trailing stop price
-            if current_price < trailing_stop:
-                return True
+    return tracker.trailing_stop_hit(current_price, threshold, drop_percentage)
 
-    elif side == 'short':
-        # Find the lowest price since the position was opened
-        min_price = candles['low'].min()
 
-        # Check if the price has moved down by at least the threshold
-        if min_price <= open_price - threshold:
-            # Calculate the trailing stop price
-            max_points = open_price - min_price
-            trailing_stop_points = max_points * (1 - drop_percentage)
-            trailing_stop = open_price - trailing_stop_points
+async def close_on_trailing_stop(tracker, current_price):
+    try:
+        print(f"Trailing stop hit for position {tracker.position_id}: peak futures excursion "
+              f"{tracker.futures_favorable_excursion}, futures price now {current_price}")
+        action = 'sell' if tracker.side == 'long' else 'buy'
+        close_price = await close_protected_position(tracker.symbol, action, tracker.size, time.perf_counter())
+        if close_price is not None:
+            close_position(tracker.position_id, 'trailing_stop', close_price)
+        else:
+            # Rejected or unfilled, the position stays open in the DB and the exit is retried later
+            tracker.retry_at = time.monotonic() + constants.trailing_stop_retry
+    finally:
+        tracker.closing = False
 
-            # Check if the current price is above the trailing stop price
-            if current_price > trailing_stop:
-                return True
 
-    return False
+def check_trailing_stops(symbol, current_price):
+    """
+    Feed a futures price of the symbol to its position trackers and exit the positions whose trailing stop
+    it hits. Runs on every futures ticker update, the exit goes out as a task so the feed isn't held up.
+    """
+    for tracker in position_trackers.on_futures_price(symbol, current_price):
+        if (not tracker.closing and time.monotonic() >= tracker.retry_at
+                and check_trailing_stop(tracker, current_price)):
+            tracker.closing = True
+            tracer.start_decision('ticker')
+            asyncio.create_task(close_on_trailing_stop(tracker, current_price))
 
 
 def calculate_slope_pressure(pressure_data):
@@ -163,42 +158,139 @@ def calculate_slope_pressure(pressure_data):
     return slope
 
 
-def calculate_dollar_volume_since_open(position_open_time):
+def calculate_dollar_volume_since_open(position_open_time, pair='XBT/USD'):
 
     cursor.execute("""
     SELECT SUM(price * volume) 
     FROM trades 
-    WHERE timestamp >= ?
-    """, (position_open_time,))
+    WHERE timestamp >= ? AND pair = ?
+    """, (position_open_time, pair))
     dollar_volume = cursor.fetchone()[0]
     return dollar_volume if dollar_volume is not None else 0
 
 
-def is_us_market_opening_soon():
-    est = pytz.timezone('US/Eastern')
-    now = datetime.now(est)
-    market_open_time = now.replace(hour=9, minute=30, second=0, microsecond=0)
-    market_close_time = now.replace(hour=10, minute=30, second=0, microsecond=0)
+async def fetch_positions():
+    # In-memory book from the private feed, REST only while the feed isn't synced
+    if account_state.ready():
+        return account_state.open_positions()
+    return await futures_client.get_open_positions(open_pos_auth)
 
-    return (market_open_time - timedelta(minutes=5)) <= now < market_close_time
 
+async def open_protected_position(symbol, side, size, take_profit, stop_loss, decision_time):
+    """
+    Send the entry with its stop loss and take profit in one batch, so the position is never unprotected.
 
-def manage_positions(symbol, size, dollar_bars, num_bars):
-    # Fetch positions and current price
-    open_positions = get_open_positions(open_pos_auth)
-    current_price = fetch_live_price(symbol)['last_price']
-    db_positions = fetch_open_position(symbol)
+    :return: Average fill price of the entry, None if the exchange rejected it or it didn't fill.
+    """
+    instructions = protected_entry(symbol, side, size, stop_loss=round(stop_loss, 0),
+                                   take_profit=round(take_profit, 0))
+    result = await futures_client.batch_order(batch_auth, instructions, decision_time=decision_time)
+
+    for client_id, order in result['orders'].items():
+        print(f"{client_id}: {order['status']} ({order['order_id']})")
+
+    entry_id = instructions[0]['cliOrdId']
+    protective_ids = [instruction['cliOrdId'] for instruction in instructions[1:]]
+    placed_ids = [client_id for client_id in protective_ids if order_accepted(result, client_id)]
+
+    entry_price = filled_price(result, entry_id)
+    if entry_price is None:
+        print(f"Entry of {symbol} not filled ({result['orders'][entry_id]['status']}), no position opened")
+        if placed_ids:
+            # Protective orders of an entry that never happened would act on the next position
+            await futures_client.batch_order(batch_auth, [batch_cancel(clientOrderId=client_id)
+                                                          for client_id in placed_ids])
+        return None
+
+    if len(placed_ids) < len(protective_ids):
+        rejected = [f"{client_id}: {result['orders'][client_id]['status']}"
+                    for client_id in protective_ids if client_id not in placed_ids]
+        print(f"WARNING: {symbol} position opened without all its protective orders ({', '.join(rejected)})")
+    runners[symbol].protective_ids = placed_ids
+    return entry_price
+
+
+async def close_protected_position(symbol, side, size, decision_time):
+    """
+    Close the position and cancel its resting protective orders in the same round trip.
+
+    :return: Average fill price of the close, None if the exchange rejected it or it didn't fill.
+    """
+    close_id = uuid.uuid4().hex[:16] + '-close'
+    instructions = [batch_send(symbol, side, size, clientOrderId=close_id, reduceOnly=True)]
+
+    runner = runners[symbol]
+    protective_ids = runner.protective_ids
+    if protective_ids:
+        instructions += [batch_cancel(clientOrderId=client_id) for client_id in protective_ids]
+        runner.protective_ids = []
+    elif account_state.ready():
+        # Ids are lost on restart, any reduce-only order left for the symbol belongs to this position
+        instructions += [batch_cancel(orderId=order['order_id'])
+                         for order in account_state.open_orders()['openOrders']
+                         if order['symbol'] == symbol and order['reduceOnly']]
+
+    result = await futures_client.batch_order(batch_auth, instructions, decision_time=decision_time)
+    close_price = filled_price(result, close_id)
+    if close_price is None:
+        print(f"Close of {symbol} not filled ({result['orders'][close_id]['status']}), position left open")
+        # The orders whose cancel didn't go through still protect the position
+        runner.protective_ids = [client_id for client_id in protective_ids
+                                 if not order_accepted(result, client_id)]
+    return close_price
+
+
+async def open_position(runner, side, current_price, decision_time):
+    """Open a protected position and record it, nothing is recorded when the entry doesn't fill."""
+    size = runner.config['size']
+    take_profit, stop_loss = get_stops(runner.dollar_bars, side, current_price)
+    entry_price = await open_protected_position(runner.symbol, side, size, take_profit, stop_loss, decision_time)
+    if entry_price is not None:
+        insert_position(runner.symbol, entry_price, 'long' if side == 'buy' else 'short', size, take_profit,
+                        stop_loss)
+    return entry_price
+
+
+async def manage_positions(runner, open_positions):
+    symbol, num_bars, signal = runner.symbol, runner.config['num_bars'], runner.signal
+
+    # The 5m candles are built from the trade stream, quiet periods since the last trade are flat candles
+    candle_builder = candle_builders[runner.pair]
+    candle_builder.catch_up()
+    candle_builder.persist(cursor)
+    with tracer.span('market_data'):
+        if candle_builder.ready(5, 60):
+            live_price = await futures_client.fetch_live_price(symbol)
+            five_m_candles = candle_builder.to_frame(5, 60)
+        else:
+            # A gap is filled into the store once, the next cycles read the candles locally again.
+            # Identical reads of other runners share the response
+            candle_pair = runner.config['candle_pair']
+            live_price, ohlc = await asyncio.gather(futures_client.fetch_live_price(symbol),
+                                                    futures_client.request_ohlc(candle_pair, 5))
+            candle_builder.merge_ohlc(cursor, 5, ohlc[candle_pair])
+            conn.commit()
+            if candle_builder.ready(5, 60):
+                five_m_candles = candle_builder.to_frame(5, 60)
+            else:
+                # The stream itself is behind, REST stands in
+                five_m_candles = ohlc_to_dataframe(ohlc[candle_pair][-60:])
+    current_price = live_price['last_price']
+    with tracer.span('fetch_open_position'):
+        db_positions = fetch_open_position(symbol)
+
+    print(f"Current price: {current_price} (streamed quote age: {top_of_book.age(symbol)})")
 
     print('Open positions from DB:', db_positions)
 
-    # Get signal
-    signal = get_market_signal(dollar_bars, num_bars, 3)
-    stoch_rsi = calculate_stochastic_rsi(dollar_bars)
-    setup = check_stochastic_setup(stoch_rsi)
-    five_m_candles = fetch_last_n_candles('XXBTZUSD', 5, 60)
-    rsi = get_rsi(five_m_candles)
+    # The signal was computed with the bars in the executor
+    with tracer.span('rsi'), cycle_profiler.stage(f'{symbol} rsi'):
+        rsi = get_rsi(five_m_candles)
 
-    insert_signal(signal['signal'], signal['score'], 'N/A', 'N/A', 'N/A')
+    # Orders sent below report their latency from this point
+    decision_time = time.perf_counter()
+
+    insert_signal(signal['signal'], signal['score'], 'N/A', 'N/A', 'N/A', symbol)
 
     print(f"Market Signal: {signal}")
 
@@ -207,8 +299,12 @@ def manage_positions(symbol, size, dollar_bars, num_bars):
         (position_id, pos_symbol, open_timestamp, open_price,
          side, size, tp, sl, close_reason, close_price, close_time) = db_positions[-1]
 
-        # Calculate the dollar volume since the position was opened
-        dollar_volume_since_open = calculate_dollar_volume_since_open(open_timestamp)
+        # Dollar volume since the position was opened, accumulated from the trade stream
+        tracker = position_trackers.get(position_id)
+        if tracker is not None:
+            dollar_volume_since_open = tracker.dollar_volume
+        else:
+            dollar_volume_since_open = calculate_dollar_volume_since_open(open_timestamp, runner.pair)
 
     # Close positions 5 minutes before market open and avoid trading for 1 hour after market open
     if is_us_market_opening_soon():
@@ -216,9 +312,10 @@ def manage_positions(symbol, size, dollar_bars, num_bars):
             for position in open_positions['openPositions']:
                 if position['symbol'] == symbol:
                     action = 'buy' if position['side'] == 'short' else 'sell'
-                    place_order(order_auth, symbol, action, position['size'])
-                    close_position(position_id, 'market_open_avoidance', current_price)
-                    print(f"Closed position {position_id} to avoid US market open volatility.")
+                    close_price = await close_protected_position(symbol, action, position['size'], decision_time)
+                    if close_price is not None:
+                        close_position(position_id, 'market_open_avoidance', close_price)
+                        print(f"Closed position {position_id} to avoid US market open volatility.")
         print("Avoiding new positions due to US market open.")
         return
 
@@ -226,78 +323,46 @@ def manage_positions(symbol, size, dollar_bars, num_bars):
     if open_positions and 'openPositions' in open_positions and open_positions['openPositions']:
         print('Open positions from API:', open_positions['openPositions'])
         for position in open_positions['openPositions']:
-            if position['symbol'] == symbol and position['side'] == 'short':
-                print('Evaluating short position for symbol:', symbol)
-
-                if current_price <= tp:
-                    print('Closing short position due to take profit.')
-                    place_order(order_auth, symbol, 'buy', position['size'])
-                    close_position(position_id, 'take_profit', current_price)
-
-                elif current_price >= sl:
-                    print('Closing short position due to stop loss.')
-                    place_order(order_auth, symbol, 'buy', position['size'])
-                    close_position(position_id, 'stop_loss', current_price)
-
-                elif dollar_volume_since_open >= dollar_threshold * num_bars:
-                    place_order(order_auth, symbol, 'buy', position['size'])
-                    close_position(position_id, 'dollar_volume_exit', current_price)
-
-
-                elif signal['signal'] == 'buy':
-                    place_order(order_auth, symbol, 'buy', position['size'])
-                    close_position(position_id, 'market_switch_exit', current_price)
-
-            elif position['symbol'] == symbol and position['side'] == 'long':
-                print('Evaluating long position for symbol:', symbol)
-
-                if current_price >= tp:
-                    print('Closing long position due to take profit')
-                    place_order(order_auth, symbol, 'sell', position['size'])
-                    close_position(position_id, 'take_profit', current_price)
+            if position['symbol'] == symbol and position['side'] in ('long', 'short'):
+                print(f"Evaluating {position['side']} position for symbol:", symbol)
 
-                elif current_price <= sl:
-                    print('Closing long position due to stop loss')
-                    place_order(order_auth, symbol, 'sell', position['size'])
-                    close_position(position_id, 'stop_loss', current_price)
-
-                elif dollar_volume_since_open >= dollar_threshold * num_bars:
-                    place_order(order_auth, symbol, 'sell', position['size'])
-                    close_position(position_id, 'dollar_volume_exit', current_price)
-
-                elif signal['signal'] == 'sell':
-                    place_order(order_auth, symbol, 'sell', position['size'])
-                    close_position(position_id, 'market_switch_exit', current_price)
+                reason = exit_reason(position['side'], current_price, tp, sl, dollar_volume_since_open,
+                                     dollar_threshold * num_bars, signal['signal'])
+                if reason is not None:
+                    print(f"Closing {position['side']} position due to {reason}.")
+                    action = 'buy' if position['side'] == 'short' else 'sell'
+                    close_price = await close_protected_position(symbol, action, position['size'], decision_time)
+                    if close_price is not None:
+                        close_position(position_id, reason, close_price)
 
     # Conditions to OPEN positions
-    if not open_positions['openPositions']:
+    if not any(position['symbol'] == symbol for position in open_positions['openPositions']):
         print('No open positions found.')
 
-        if signal['signal'] == 'buy' and rsi < 35:
-            print('Placing new buy order.')
-            place_order(order_auth, symbol, 'buy', size)
-            take_profit, stop_loss = get_stops(dollar_bars, 'buy', current_price)
-            insert_position(symbol, current_price, 'long', size, take_profit, stop_loss)
+        # A position still open in the DB was closed on the exchange by its stop loss or take profit
+        if db_positions:
+            close_position(position_id, 'protective_order', current_price)
+            runner.protective_ids = []
 
-        elif signal['signal'] == 'sell' and rsi > 65:
-            print('Placing new sell order.')
-            place_order(order_auth, symbol, 'sell', size)
-            take_profit, stop_loss = get_stops(dollar_bars, 'sell', current_price)
-            insert_position(symbol, current_price, 'short', size, take_profit, stop_loss)
+        side = entry_side(signal['signal'], rsi)
+        if side is not None:
+            print(f'Placing new {side} order.')
+            await open_position(runner, side, current_price, decision_time)
 
 
 # WebSocket handler
 async def kraken_websocket():
-    global trade_channel_id
-    uri = "wss://ws.kraken.com/"
+    uri = constants.spot_ws_url
 
     async with websockets.connect(uri) as websocket:
-        # Subscribe to the BTC/USD trade feed
+        # Subscribe to the trade feed of every traded pair
         await websocket.send(json.dumps({
             "event": "subscribe",
-            "pair": ["XBT/USD"],
+            "pair": list(pair_symbols),
             "subscription": {"name": "trade"}
         }))
+        if order_books:
+            await websocket.send(json.dumps(book_subscription(order_books)))
 
         while True:
             message = await websocket.recv()
@@ -307,47 +372,145 @@ async def kraken_websocket():
             # Handle subscription status messages
             if isinstance(data, dict) and data.get("event") == "subscriptionStatus":
                 print("Subscription status:", data)
-                if data["subscription"]["name"] == "trade":
-                    trade_channel_id = data["channelID"]
                 continue
 
-            # Differentiate trade data based on channel ID
-            if isinstance(data, list) and len(data) > 1:
-                channel_id = data[0]
-                if channel_id == trade_channel_id:
+            # Book messages: [channelID, asks and/or bids, (bids,) 'book-<depth>', pair]
+            if isinstance(data, list) and isinstance(data[-2], str) and data[-2].startswith('book-'):
+                book = order_books.get(data[-1])
+                if book is not None and not book.apply(data):
+                    # A new snapshot is the only way back to a consistent book
+                    print(f"Book checksum mismatch on {book.pair}, resubscribing")
+                    await websocket.send(json.dumps(book_subscription([book.pair], event='unsubscribe')))
+                    await websocket.send(json.dumps(book_subscription([book.pair])))
+                continue
+
+            # Trade messages end with the channel name and the pair: [channelID, trades, 'trade', pair]
+            if isinstance(data, list) and len(data) == 4 and data[2] == 'trade':
+                pair = data[3]
+                if pair in pair_symbols:
                     trades = data[1]
-                    insert_trade(trades)
+                    # Each batch is a decision of its own, a trailing stop exit it triggers carries its id
+                    tracer.start_decision('trades')
+                    with tracer.span('ingest'):
+                        insert_trade(trades, pair)
                     # print(f"Inserted trade data")
 
 
-def run_analysis_and_store_signals():
-
-    # Fetch trades and create dollar bars
-    trade_data = fetch_trades(hours=72)
-    dollar_bars = create_dollar_bars(trade_data, threshold=constants.dollar_threshold)
-
-    if dollar_bars.empty:
-        print("No dollar bars available for analysis.")
+async def run_symbol(runner, open_positions):
+    # Runs as its own task, so the decision id and spans belong to this symbol
+    tracer.start_decision(f'analysis {runner.symbol}')
+
+    # Fetch trades, create dollar bars and compute the signal in a worker process
+    with tracer.span('analyze'), cycle_profiler.stage(f'{runner.symbol} analyze') as stage:
+        book = order_books.get(runner.pair)
+        # cProfile in start_cycle only sees this process, a profiled cycle profiles the workers too
+        profile_cycle = cycle_profiler.cycle_id if cycle_profiler.profile is not None else None
+        await runner.analyze(executor, book.features() if book is not None else None, profile_cycle)
+        stage.rows = runner.rows
+        stage.bars = len(runner.dollar_bars)
+        stage.cpu = runner.cpu  # the event loop's CPU time would miss the worker's
+
+    # The worker's tracer is never flushed, its spans and sub-stages are recorded here under this decision
+    for worker_stage in runner.stages:
+        tracer.record(worker_stage['stage'], worker_stage['wall'])
+        cycle_profiler.record_stage(f"{runner.symbol} {worker_stage['stage']}", worker_stage['wall'],
+                                    worker_stage['cpu'], worker_stage['rows'], worker_stage['bars'])
+    for name, seconds in runner.spans:
+        tracer.record(name, seconds)
+
+    if runner.dollar_bars.empty:
+        print(f"No dollar bars available for analysis of {runner.symbol}.")
         return
 
-    print("Dollar bars created successfully")
+    print(f"Dollar bars of {runner.symbol} created successfully")
 
     # Manage positions based on the signals
-    manage_positions('PF_XBTUSD', 0.002, dollar_bars, 7)
+    with cycle_profiler.stage(f'{runner.symbol} manage_positions'):
+        await manage_positions(runner, open_positions)
+
+
+async def run_analysis_and_store_signals():
+    cycle_profiler.start_cycle()
+    try:
+        # Positions of every symbol come back in one call, shared by all runners
+        with cycle_profiler.stage('fetch_positions'):
+            open_positions = await fetch_positions()
+
+        results = await asyncio.gather(*(run_symbol(runner, open_positions) for runner in runners.values()),
+                                       return_exceptions=True)
+        for runner, result in zip(runners.values(), results):
+            # One symbol failing must not stop the others
+            if isinstance(result, Exception):
+                print(f"Analysis of {runner.symbol} failed: {result!r}")
+
+        if cycle_profiler.cycle_id % constants.snapshot_every == 0:
+            with cycle_profiler.stage('snapshot'):
+                write_snapshot({symbol: runner.snapshot_state() for symbol, runner in runners.items()})
+    finally:
+        cycle_profiler.end_cycle()
+        conn.commit()
 
 
 # Periodically run the analysis and store signals
 async def periodic_analysis(interval):
     while True:
-        run_analysis_and_store_signals()
+        await run_analysis_and_store_signals()
+
+        latency = futures_client.latency_summary()
+        if latency:
+            print('Decision-to-ack latency:', latency)
+        print('Rate limit budgets:', scheduler.report())
+
+        if tracer.enabled:
+            print('Latency spans:', tracer.summary())
+            tracer.flush(cursor)
+            conn.commit()
+
         await asyncio.sleep(interval)
 
 
 # Main function to run WebSocket and analysis concurrently
 async def main():
-    websocket_task = asyncio.create_task(kraken_websocket())
-    analysis_task = asyncio.create_task(periodic_analysis(300))  # Run analysis every 5 minutes
-    await asyncio.gather(websocket_task, analysis_task)
+    global futures_client, executor
+
+    # Pick up the excursions of positions that were open before the restart
+    cursor.execute("SELECT * FROM opened_positions WHERE close_price IS NULL")
+    position_trackers.load(cursor.fetchall())
+    conn.commit()
+
+    # Rebuild the candles from the table and the stored trades, REST fills what the downtime left out
+    rest_pairs = {runner.pair: runner.config['candle_pair'] for runner in runners.values()}
+    for pair, candle_builder in candle_builders.items():
+        candle_builder.load(cursor)
+        if not candle_builder.ready(5, 60):
+            try:
+                candle_builder.backfill(cursor, rest_pairs[pair], 5)
+            except Exception as e:
+                print(f"Candle backfill of {pair} failed, REST candles are used meanwhile: {e!r}")
+    conn.commit()
+
+    # Resume the bar builders from the last snapshot, the first cycle then only reads the newer trades
+    state, header = read_snapshot()
+    if state is not None:
+        for symbol, runner in runners.items():
+            if not runner.restore_state(state.get(symbol)):
+                print(f"Snapshot has no usable state for {symbol}, rebuilding its bars")
+
+    # SIGUSR1 or the profile flag file turns on cProfile for the next cycles
+    cycle_profiler.install_signal_handler(asyncio.get_running_loop())
+
+    executor = create_executor()
+
+    async with AsyncKrakenFuturesClient() as futures_client:
+        websocket_task = asyncio.create_task(kraken_websocket())
+        # The trailing stop exit is measured on the futures price of the position, updated by the ticker
+        ticker_task = asyncio.create_task(futures_ticker_feed(
+            list(runners), on_update=check_trailing_stops if constants.trailing_stop_enabled else None))
+        account_task = asyncio.create_task(futures_private_feed(open_pos_auth))
+        analysis_task = asyncio.create_task(periodic_analysis(constants.analysis_interval))  # Every 5 minutes by default
+        await asyncio.gather(websocket_task, ticker_task, account_task, analysis_task)
 
 
-asyncio.run(main())
+# Executor workers import this module too, only the main process runs the bot
+if __name__ == '__main__':
+    asyncio.run(main())
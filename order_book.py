@@ -0,0 +1,196 @@
+import time
+import zlib
+
+import numpy as np
+
+import constants
+
+
+class BookSide:
+    """
+    One side of the book in sorted NumPy arrays, best level first.
+
+    Prices are kept as keys sorted ascending, the price itself for asks and its negative for bids, so one
+    searchsorted finds a level on either side. Inserts and deletes shift the arrays in place and the side
+    never holds more than the subscribed depth.
+    """
+
+    def __init__(self, depth, descending):
+        self.depth = depth
+        self.sign = -1.0 if descending else 1.0
+        self.keys = np.empty(depth + 1)  # one spare slot for an insert before the worst level is cut off
+        self.volumes = np.empty(depth + 1)
+        self.count = 0
+        self.top_changed = True  # one of the 10 best levels changed since the checksum text was built
+        self.checksum_text = ''
+
+    def clear(self):
+        self.count = 0
+        self.top_changed = True
+
+    def update(self, price, volume):
+        """Set the volume at a price, 0 removes the level."""
+        key = self.sign * price
+        count = self.count
+        index = int(self.keys[:count].searchsorted(key))
+        if index < 10:
+            self.top_changed = True
+
+        if index < count and self.keys[index] == key:
+            if volume:
+                self.volumes[index] = volume
+            else:
+                self.keys[index:count - 1] = self.keys[index + 1:count]
+                self.volumes[index:count - 1] = self.volumes[index + 1:count]
+                self.count = count - 1
+        elif volume and index < self.depth:
+            self.keys[index + 1:count + 1] = self.keys[index:count]
+            self.volumes[index + 1:count + 1] = self.volumes[index:count]
+            self.keys[index] = key
+            self.volumes[index] = volume
+            self.count = min(count + 1, self.depth)
+
+    @property
+    def prices(self):
+        return self.keys[:self.count] * self.sign
+
+    def levels(self, n):
+        """(prices, volumes) of the best n levels."""
+        n = min(n, self.count)
+        return self.keys[:n] * self.sign, self.volumes[:n]
+
+
+class OrderBook:
+    """
+    Local L2 book of one pair from Kraken's websocket book channel.
+
+    The snapshot and every update are applied to the two BookSides, then Kraken's CRC32 checksum of the top 10
+    levels is verified. A mismatch marks the book invalid until a new snapshot arrives, which the caller
+    requests by resubscribing. Applying an update takes a few microseconds per level. The checksum text of a
+    side is only rebuilt when one of its 10 best levels changed.
+    """
+
+    def __init__(self, pair, depth=None):
+        self.pair = pair
+        self.depth = depth or constants.book_depth
+        self.asks = BookSide(self.depth, descending=False)
+        self.bids = BookSide(self.depth, descending=True)
+        self.price_decimals = None  # from the snapshot, the checksum is computed over the feed's formatting
+        self.volume_decimals = None
+        self.valid = False
+        self.updated = None  # time.monotonic() of the last applied message
+        self.mismatches = 0
+
+    def apply(self, message):
+        """
+        Apply a book message [channelID, payload, (payload,) channel name, pair].
+
+        :return: False if the checksum didn't match, the book then needs a new snapshot.
+        """
+        checksum = None
+        for payload in message[1:-2]:
+            if 'as' in payload or 'bs' in payload:
+                self.load_snapshot(payload.get('as', []), payload.get('bs', []))
+                continue
+
+            if not self.valid:
+                continue  # updates before the resync snapshot don't apply
+            for price, volume, *_ in payload.get('a', ()):
+                self.asks.update(float(price), float(volume))
+            for price, volume, *_ in payload.get('b', ()):
+                self.bids.update(float(price), float(volume))
+            checksum = payload.get('c', checksum)
+
+        self.updated = time.monotonic()
+        if checksum is not None and self.valid and self.checksum() != int(checksum):
+            self.valid = False
+            self.mismatches += 1
+            return False
+        return True
+
+    def load_snapshot(self, asks, bids):
+        self.asks.clear()
+        self.bids.clear()
+        level = (asks or bids)[0] if asks or bids else None
+        if level is not None:
+            self.price_decimals = len(level[0].partition('.')[2])
+            self.volume_decimals = len(level[1].partition('.')[2])
+        for price, volume, *_ in asks:
+            self.asks.update(float(price), float(volume))
+        for price, volume, *_ in bids:
+            self.bids.update(float(price), float(volume))
+        self.valid = True
+
+    def checksum(self):
+        """
+        CRC32 of the top 10 asks then bids, each price and volume without the dot and leading zeros, which is
+        the value as an integer count of its last decimal.
+        """
+        for side in (self.asks, self.bids):
+            if side.top_changed:
+                side.checksum_text = self.side_checksum_text(side)
+                side.top_changed = False
+        return zlib.crc32((self.asks.checksum_text + self.bids.checksum_text).encode())
+
+    def side_checksum_text(self, side):
+        price_scale = 10 ** self.price_decimals
+        volume_scale = 10 ** self.volume_decimals
+        count = min(10, side.count)
+        # Ten levels are faster as Python floats than as NumPy calls
+        return ''.join(f'{round(key * side.sign * price_scale)}{round(volume * volume_scale)}'
+                       for key, volume in zip(side.keys[:count].tolist(), side.volumes[:count].tolist()))
+
+    def imbalance(self, levels=None):
+        """(bid volume - ask volume) / (bid volume + ask volume) over the top levels, between -1 and 1."""
+        levels = levels or constants.book_levels
+        bid_volume = float(self.bids.levels(levels)[1].sum())
+        ask_volume = float(self.asks.levels(levels)[1].sum())
+        total = bid_volume + ask_volume
+        return (bid_volume - ask_volume) / total if total else 0.0
+
+    def microprice(self):
+        """Mid price weighted towards the side with less volume at the top, where the next trade is likelier."""
+        if not self.asks.count or not self.bids.count:
+            return None
+        bid, bid_volume = self.bids.keys[0] * self.bids.sign, self.bids.volumes[0]
+        ask, ask_volume = self.asks.keys[0], self.asks.volumes[0]
+        return float((bid * ask_volume + ask * bid_volume) / (bid_volume + ask_volume))
+
+    def features(self, levels=None):
+        """
+        :return: Dict with book_imbalance, microprice, mid and spread, None while the book isn't valid.
+        """
+        if not self.valid or not self.asks.count or not self.bids.count:
+            return None
+        bid = float(self.bids.keys[0] * self.bids.sign)
+        ask = float(self.asks.keys[0])
+        return {
+            'book_imbalance': round(self.imbalance(levels), 4),
+            'microprice': round(self.microprice(), 2),
+            'mid': (bid + ask) / 2,
+            'spread': ask - bid,
+        }
+
+
+def book_subscription(pairs, depth=None, event='subscribe'):
+    """Websocket message subscribing (or unsubscribing) the pairs to the book channel."""
+    return {
+        'event': event,
+        'pair': list(pairs),
+        'subscription': {'name': 'book', 'depth': depth or constants.book_depth}
+    }
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+book = OrderBook('XBT/USD', depth=25)
+await websocket.send(json.dumps(book_subscription(['XBT/USD'], 25)))
+
+# For every message whose channel name starts with 'book-'
+if not book.apply(data):
+    await websocket.send(json.dumps(book_subscription(['XBT/USD'], 25, 'unsubscribe')))
+    await websocket.send(json.dumps(book_subscription(['XBT/USD'], 25)))
+
+print(book.features(levels=10))"""
@@ -1,16 +1,15 @@
 import sqlite3
+import constants
 from datetime import timedelta
 import numpy as np
 from sklearn.linear_model import LinearRegression
 
-from dollar_bars import dollar_bars
-
 # Variables
 time_frame_minutes = 5  # Adjust this variable as needed
 look_back_period = 10  # Number of candles to look back
 
 # Connect to the SQLite database
-conn = sqlite3.connect('trading_data.db')
+conn = sqlite3.connect(constants.db_path)
 cursor = conn.cursor()
 
 
@@ -33,7 +32,14 @@ def create_tables():
 create_tables()
 
 
-def calculate_order_flow_metrics(dol_bars):
+def calculate_order_flow_metrics(dol_bars, pair=None, cache=None):
+    """
+    Order flow totals and ratios of every dollar bar, from the trades inside each bar.
+
+    :param pair: Only count trades of this pair.
+    :param cache: Optional dict reused across calls, holding the trade totals of bars already seen so only
+                  new bars are queried. Keys are the bar's (start, end) in whole seconds.
+    """
 
     if dol_bars.empty:
         print("No dollar bars available.")
@@ -53,40 +59,21 @@ def calculate_order_flow_metrics(dol_bars):
     aggressive_ratios = []
     aggressive_ratio = 0
 
+    # Columns read once, a row lookup per bar costs more than the rest of the loop
+    start_times = dol_bars['start_time'].tolist()
+    end_times = dol_bars['end_time'].tolist()
+
     for i in range(len(dol_bars)):
-        bar = dol_bars.iloc[i]
-        start_time = bar['start_time']
-        end_time = bar['end_time']
+        key = (int(start_times[i].timestamp()), int(end_times[i].timestamp()))
 
-        cursor.execute("""
-            SELECT side, volume, type_order
-            FROM trades
-            WHERE timestamp BETWEEN ? AND ?
-            """, (int(start_time.timestamp()), int(end_time.timestamp())))
-
-        trades = cursor.fetchall()
-
-        buy_volume = 0
-        sell_volume = 0
-        market_buy_volume = 0
-        market_sell_volume = 0
-        delta = 0
-        min_delta = float('inf')
-        max_delta = float('-inf')
-
-        for side, volume, type_order in trades:
-            if side == 'buy':
-                buy_volume += volume
-                delta += volume
-                if type_order == 'market':
-                    market_buy_volume += volume
-            elif side == 'sell':
-                sell_volume += volume
-                delta -= volume
-                if type_order == 'market':
-                    market_sell_volume += volume
-            min_delta = min(min_delta, delta)
-            max_delta = max(max_delta, delta)
+        if cache is not None and key in cache:
+            buy_volume, sell_volume, market_buy_volume, market_sell_volume, min_delta, max_delta = cache[key]
+        else:
+            buy_volume, sell_volume, market_buy_volume, market_sell_volume, min_delta, max_delta = \
+                bar_trade_totals(key[0], key[1], pair)
+            # The newest bar's last second can still receive trades, it is queried again next time
+            if cache is not None and i < len(dol_bars) - 1:
+                cache[key] = (buy_volume, sell_volume, market_buy_volume, market_sell_volume, min_delta, max_delta)
 
         # Debug: Print calculated values for each bar
         # print(f"Bar {i} values:")
@@ -133,6 +120,53 @@ def calculate_order_flow_metrics(dol_bars):
             aggressive_sell_activities, aggressive_ratios, latest_bar)
 
 
+def bar_trade_totals(start, end, pair=None):
+    if pair is None:
+        cursor.execute("""
+            SELECT side, volume, type_order
+            FROM trades
+            WHERE timestamp BETWEEN ? AND ?
+            """, (start, end))
+    else:
+        cursor.execute("""
+            SELECT side, volume, type_order
+            FROM trades
+            WHERE timestamp BETWEEN ? AND ? AND pair = ?
+            """, (start, end, pair))
+
+    return trade_totals(cursor.fetchall())
+
+
+def trade_totals(trades):
+    """
+    :param trades: (side, volume, type_order) rows of one bar, in trade order.
+    :return: (buy volume, sell volume, market buy volume, market sell volume, min delta, max delta).
+    """
+    buy_volume = 0
+    sell_volume = 0
+    market_buy_volume = 0
+    market_sell_volume = 0
+    delta = 0
+    min_delta = float('inf')
+    max_delta = float('-inf')
+
+    for side, volume, type_order in trades:
+        if side == 'buy':
+            buy_volume += volume
+            delta += volume
+            if type_order == 'market':
+                market_buy_volume += volume
+        elif side == 'sell':
+            sell_volume += volume
+            delta -= volume
+            if type_order == 'market':
+                market_sell_volume += volume
+        min_delta = min(min_delta, delta)
+        max_delta = max(max_delta, delta)
+
+    return buy_volume, sell_volume, market_buy_volume, market_sell_volume, min_delta, max_delta
+
+
 def calculate_slope(values):
     if values :
         x = np.arange(len(values)).reshape(-1, 1)
@@ -147,39 +181,45 @@ def calculate_slope(values):
 
 """__________________________________________________________________________________________________________________"""
 
-# Calculate order flow metrics using dollar bars
-(delta_values, cumulative_delta, min_delta_values,
- max_delta_values, market_buy_ratios, market_sell_ratios,
- buy_volumes, sell_volumes, aggressive_buy_activities,
- aggressive_sell_activities, aggressive_ratios, latest_bar) = calculate_order_flow_metrics(dollar_bars)
+if __name__ == '__main__':
+    from dollar_bars import fetch_trades, create_dollar_bars
+    from constants import dollar_threshold
+
+    dollar_bars = create_dollar_bars(fetch_trades(72), threshold=dollar_threshold)
+
+    # Calculate order flow metrics using dollar bars
+    (delta_values, cumulative_delta, min_delta_values,
+     max_delta_values, market_buy_ratios, market_sell_ratios,
+     buy_volumes, sell_volumes, aggressive_buy_activities,
+     aggressive_sell_activities, aggressive_ratios, latest_bar) = calculate_order_flow_metrics(dollar_bars)
 
 
 
-# Insert the latest delta values into the database
-# insert_latest_delta(latest_bar)
+    # Insert the latest delta values into the database
+    # insert_latest_delta(latest_bar)
 
-# Output metrics
+    # Output metrics
 
-# print("Latest bar values:")
-# print(latest_bar)
-# print('\n')
+    # print("Latest bar values:")
+    # print(latest_bar)
+    # print('\n')
 
-# print(f"Delta Values: {delta_values}")
-# print(f"Cumulative Delta: {cumulative_delta}")
-# print(f"Min Delta Values: {min_delta_values}")
-# print(f"Max Delta Values: {max_delta_values}")
-# print(f"Market Buy Ratios: {market_buy_ratios}")
-# print(f"Market Sell Ratios: {market_sell_ratios}")
-# print(f"Buy Volumes: {buy_volumes}")
-# print(f"Sell Volumes: {sell_volumes}")
-# print(f"Aggressive Buy Activities: {aggressive_buy_activities}")
-# print(f"Aggressive Sell Activities: {aggressive_sell_activities}")
-# print(f"Aggressive Ratios: {aggressive_ratios}")
+    # print(f"Delta Values: {delta_values}")
+    # print(f"Cumulative Delta: {cumulative_delta}")
+    # print(f"Min Delta Values: {min_delta_values}")
+    # print(f"Max Delta Values: {max_delta_values}")
+    # print(f"Market Buy Ratios: {market_buy_ratios}")
+    # print(f"Market Sell Ratios: {market_sell_ratios}")
+    # print(f"Buy Volumes: {buy_volumes}")
+    # print(f"Sell Volumes: {sell_volumes}")
+    # print(f"Aggressive Buy Activities: {aggressive_buy_activities}")
+    # print(f"Aggressive Sell Activities: {aggressive_sell_activities}")
+    # print(f"Aggressive Ratios: {aggressive_ratios}")
 
-# Calculate slope of aggressive ratios
-slope_of_aggressive_ratios = calculate_slope(aggressive_ratios)
-print(f"Slope of Aggressive Ratios: {slope_of_aggressive_ratios}")
+    # Calculate slope of aggressive ratios
+    slope_of_aggressive_ratios = calculate_slope(aggressive_ratios)
+    print(f"Slope of Aggressive Ratios: {slope_of_aggressive_ratios}")
 
-print('\n')
-# Close the database connection
-# conn.close()
+    print('\n')
+    # Close the database connection
+    # conn.close()
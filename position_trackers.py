@@ -0,0 +1,273 @@
+import sqlite3
+
+
+class ExcursionTracker:
+    """
+    Running high, low and dollar volume of the trade stream since a position was opened.
+
+    Updated on every trade batch, so excursion figures and the dollar volume exit are O(1) and see the
+    intra-candle extremes a 5 minute candle refetch would miss. The spot trades differ from the futures
+    price by the basis, so the trailing stop runs on its own extremes of the position's futures price,
+    fed from the futures ticker.
+    """
+
+    def __init__(self, position_id, symbol, side, size, open_price, open_time,
+                 high=None, high_time=None, low=None, low_time=None, dollar_volume=0.0,
+                 futures_high=None, futures_low=None):
+        self.position_id = position_id
+        self.symbol = symbol
+        self.side = side  # 'long' or 'short'
+        self.size = size
+        self.open_price = open_price
+        self.open_time = open_time
+        self.high = high if high is not None else open_price
+        self.high_time = high_time if high_time is not None else open_time
+        self.low = low if low is not None else open_price
+        self.low_time = low_time if low_time is not None else open_time
+        self.dollar_volume = dollar_volume  # SUM(price * volume) of trades at or after open_time
+        # Extremes of the futures price since the open, open_price is the futures fill
+        self.futures_high = futures_high if futures_high is not None else open_price
+        self.futures_low = futures_low if futures_low is not None else open_price
+        self.dirty = True  # changed since it was last persisted
+        self.closing = False  # an exit order is already on its way
+        self.retry_at = 0.0  # monotonic time before which a failed trailing stop exit isn't resent
+
+    def update(self, price, timestamp):
+        if price > self.high:
+            self.high = price
+            self.high_time = timestamp
+            self.dirty = True
+        if price < self.low:
+            self.low = price
+            self.low_time = timestamp
+            self.dirty = True
+
+    def update_batch(self, trades):
+        """
+        :param trades: List of (price, timestamp, volume), trades before the open are ignored.
+        """
+        for price, timestamp, volume in trades:
+            if timestamp < self.open_time:
+                continue
+            self.update(price, timestamp)
+            self.dollar_volume += price * volume
+            self.dirty = True
+
+    def update_futures(self, price):
+        """Consume a futures price of the position's symbol, e.g. the last price of a ticker update."""
+        if price > self.futures_high:
+            self.futures_high = price
+            self.dirty = True
+        if price < self.futures_low:
+            self.futures_low = price
+            self.dirty = True
+
+    @property
+    def max_favorable_excursion(self):
+        return self.high - self.open_price if self.side == 'long' else self.open_price - self.low
+
+    @property
+    def max_adverse_excursion(self):
+        return self.open_price - self.low if self.side == 'long' else self.high - self.open_price
+
+    @property
+    def peak_time(self):
+        """Time of the most favorable price since the open."""
+        return self.high_time if self.side == 'long' else self.low_time
+
+    @property
+    def futures_favorable_excursion(self):
+        """Best move of the futures price in the position's favor, what the trailing stop is measured on."""
+        return self.futures_high - self.open_price if self.side == 'long' else self.open_price - self.futures_low
+
+    def trailing_stop_hit(self, current_price, threshold=500, drop_percentage=0.20):
+        """
+        Check if the current price gave back more than drop_percentage of the best move.
+
+        :param current_price: current futures price of the position's symbol, after update_futures
+        :param threshold: The minimum points the price should move in favor before the trailing stop applies.
+        :param drop_percentage: The share of the peak move given back that triggers the stop.
+        :return: Boolean indicating whether to close the position.
+        """
+        max_points = self.futures_favorable_excursion
+        if max_points < threshold:
+            return False
+
+        trailing_stop_points = max_points * (1 - drop_percentage)
+        if self.side == 'long':
+            return current_price < self.open_price + trailing_stop_points
+        return current_price > self.open_price - trailing_stop_points
+
+    def to_row(self):
+        return (self.position_id, self.symbol, self.side, self.size, self.open_price, self.open_time,
+                self.high, self.high_time, self.low, self.low_time, self.dollar_volume, self.futures_high,
+                self.futures_low)
+
+
+class PositionTrackers:
+    """
+    Trackers for every open position, fed from the trade ingest path and persisted to SQLite.
+
+    Writes go through the caller's cursor and are committed with the trade inserts, so a restart picks
+    up exactly the extremes and dollar volume of the trades committed so far.
+    """
+
+    def __init__(self, cursor, pairs=None):
+        """
+        :param cursor: Cursor of the connection the trades are inserted with.
+        :param pairs: Dict of futures symbol -> spot pair whose trades feed its positions.
+        """
+        self.cursor = cursor
+        self.pairs = pairs or {}
+        self.trackers = {}  # position_id -> ExcursionTracker
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS position_trackers (
+            position_id INTEGER PRIMARY KEY,
+            symbol TEXT,
+            side TEXT,
+            size REAL,
+            open_price REAL,
+            open_time INTEGER,
+            high REAL,
+            high_time REAL,
+            low REAL,
+            low_time REAL,
+            dollar_volume REAL,
+            futures_high REAL,
+            futures_low REAL
+        )
+        """)
+        for column in ('dollar_volume', 'futures_high', 'futures_low'):
+            try:
+                self.cursor.execute(f"ALTER TABLE position_trackers ADD COLUMN {column} REAL")
+            except sqlite3.OperationalError:
+                pass  # Column already exists
+        # Seeding and verification filter trades by time
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_timestamp ON trades (timestamp)")
+
+    def load(self, open_positions):
+        """
+        Restore trackers for the open positions, seeding any that were never persisted from the trades table.
+
+        :param open_positions: Rows from opened_positions that have no close price.
+        """
+        for position_id, symbol, open_time, open_price, side, size, *_ in open_positions:
+            self.cursor.execute("""
+            SELECT position_id, symbol, side, size, open_price, open_time, high, high_time, low, low_time,
+                   dollar_volume, futures_high, futures_low
+            FROM position_trackers
+            WHERE position_id = ?
+            """, (position_id,))
+            row = self.cursor.fetchone()
+
+            if row is not None:
+                tracker = ExcursionTracker(*row)
+                tracker.dirty = False
+                if tracker.dollar_volume is None:
+                    # Persisted before dollar volume was tracked
+                    tracker.dollar_volume = self.dollar_volume_from_trades(open_time, self.pairs.get(symbol))
+                    tracker.dirty = True
+            else:
+                tracker = ExcursionTracker(position_id, symbol, side, size, open_price, open_time)
+                self.seed_from_trades(tracker)
+            self.trackers[position_id] = tracker
+
+        self.persist()
+
+    def seed_from_trades(self, tracker):
+        # One-off scan when a position is opened or was opened before its tracker existed
+        pair = self.pairs.get(tracker.symbol)
+        self.cursor.execute("""
+        SELECT price, timestamp FROM trades WHERE timestamp >= ? AND (? IS NULL OR pair = ?)
+        ORDER BY price DESC LIMIT 1
+        """, (tracker.open_time, pair, pair))
+        highest = self.cursor.fetchone()
+        self.cursor.execute("""
+        SELECT price, timestamp FROM trades WHERE timestamp >= ? AND (? IS NULL OR pair = ?)
+        ORDER BY price ASC LIMIT 1
+        """, (tracker.open_time, pair, pair))
+        lowest = self.cursor.fetchone()
+
+        if highest is not None:
+            tracker.update(highest[0], highest[1])
+        if lowest is not None:
+            tracker.update(lowest[0], lowest[1])
+
+        tracker.dollar_volume = self.dollar_volume_from_trades(tracker.open_time, pair)
+
+    def dollar_volume_from_trades(self, open_time, pair=None):
+        self.cursor.execute("""
+        SELECT SUM(price * volume)
+        FROM trades
+        WHERE timestamp >= ? AND (? IS NULL OR pair = ?)
+        """, (open_time, pair, pair))
+        dollar_volume = self.cursor.fetchone()[0]
+        return dollar_volume if dollar_volume is not None else 0
+
+    def verify_dollar_volume(self, position_id, tolerance=1e-6):
+        """
+        Compare a tracker's accumulated dollar volume with the SQL sum over the trades table.
+
+        :return: (accumulated, from SQL, True if they agree within the relative tolerance)
+        """
+        tracker = self.trackers[position_id]
+        accumulated = tracker.dollar_volume
+        expected = self.dollar_volume_from_trades(tracker.open_time, self.pairs.get(tracker.symbol))
+        return accumulated, expected, abs(accumulated - expected) <= tolerance * max(1.0, abs(expected))
+
+    def open(self, position_id, symbol, side, size, open_price, open_time):
+        tracker = ExcursionTracker(position_id, symbol, side, size, open_price, open_time)
+        # Trades already stored within the opening second count, like in the SQL sum
+        self.seed_from_trades(tracker)
+        self.trackers[position_id] = tracker
+        self.persist()
+        return tracker
+
+    def close(self, position_id):
+        self.trackers.pop(position_id, None)
+        self.cursor.execute("DELETE FROM position_trackers WHERE position_id = ?", (position_id,))
+
+    def get(self, position_id):
+        return self.trackers.get(position_id)
+
+    def on_trades(self, trades, symbol=None):
+        """
+        Update the trackers with a batch of (price, timestamp, volume) trades and persist the changed ones.
+
+        Doesn't commit, the caller commits together with the trade inserts.
+
+        :param symbol: Only update the trackers of this futures symbol, all of them when None.
+        """
+        if not self.trackers or not trades:
+            return
+
+        for tracker in self.trackers.values():
+            if symbol is None or tracker.symbol == symbol:
+                tracker.update_batch(trades)
+
+        self.persist()
+
+    def on_futures_price(self, symbol, price):
+        """
+        Update the futures extremes of the symbol's trackers, persisted with the next trade batch.
+
+        :return: The trackers of the symbol.
+        """
+        trackers = [tracker for tracker in self.trackers.values() if tracker.symbol == symbol]
+        for tracker in trackers:
+            tracker.update_futures(price)
+        return trackers
+
+    def persist(self):
+        rows = [tracker.to_row() for tracker in self.trackers.values() if tracker.dirty]
+        if not rows:
+            return
+
+        self.cursor.executemany("""
+        INSERT OR REPLACE INTO position_trackers
+        (position_id, symbol, side, size, open_price, open_time, high, high_time, low, low_time, dollar_volume,
+         futures_high, futures_low)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        for tracker in self.trackers.values():
+            tracker.dirty = False
@@ -0,0 +1,245 @@
+import cProfile
+import io
+import os
+import pstats
+import signal
+import time
+import tracemalloc
+
+import constants
+
+
+class StageRecord:
+    """Measurements of one stage, rows and bars are filled in by the code inside the stage."""
+
+    __slots__ = ('stage', 'wall', 'cpu', 'rows', 'bars', 'peak', 'overlapped')
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.wall = None
+        self.cpu = None  # set inside the stage when the work runs elsewhere, e.g. in an executor worker
+        self.rows = None
+        self.bars = None
+        self.peak = None
+        self.overlapped = False  # another stage ran during this one
+
+
+class Stage:
+    """
+    Measures one stage. Stages of the symbols run concurrently on the event loop and can nest, so the CPU
+    time and peak memory are only attributed to a stage that had the loop to itself. An overlapped stage
+    gets its wall time and the CPU time set inside it, if any; the cycle row keeps the totals.
+    """
+
+    def __init__(self, profiler, record):
+        self.profiler = profiler
+        self.record = record
+
+    def __enter__(self):
+        open_stages = self.profiler.open_stages
+        if open_stages:
+            self.record.overlapped = True
+            for record in open_stages:
+                record.overlapped = True
+        elif tracemalloc.is_tracing():
+            # Only when no other stage is running, resetting the peak would wipe theirs. The cycle's peak
+            # so far is kept first
+            self.profiler.memory_peak = max(self.profiler.memory_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+        open_stages.append(self.record)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self.record
+
+    def __exit__(self, exc_type, exc, tb):
+        self.record.wall = time.perf_counter() - self.wall_start
+        self.profiler.open_stages.remove(self.record)
+        if self.record.cpu is not None:
+            self.profiler.worker_cpu += self.record.cpu
+        elif not self.record.overlapped:
+            self.record.cpu = time.thread_time() - self.cpu_start
+        if not self.record.overlapped and tracemalloc.is_tracing():
+            self.record.peak = max(0, tracemalloc.get_traced_memory()[1] - self.memory_start)
+        self.profiler.stages.append(self.record)
+        return False
+
+
+class CycleProfiler:
+    """
+    Per-stage timings of every analysis cycle, plus cProfile on demand.
+
+    Each cycle writes one row per stage to the cycle_stages table with its wall time, CPU time, rows read,
+    bars built and peak memory allocated, so slow cycles and regressions show up with a query, plus a
+    'cycle' row with the totals. CPU time and peak memory of stages overlapping other stages are left
+    NULL (see Stage), the analyze stages report the CPU time of their executor worker. The sub-stages
+    timed inside the worker are added with record_stage.
+
+    Memory is measured with tracemalloc when constants.stage_memory_tracking is on. It then traces
+    everything the event loop runs during the cycle, the trade ingest between awaits included, so it is off
+    by default and meant for investigations.
+
+    Profiling of the next N cycles is requested by creating the flag file (constants.profile_flag_path,
+    optionally containing N), by SIGUSR1 where the platform has it, or by calling request_profile.
+    The stats of each profiled cycle are dumped to constants.profile_dir. cProfile only sees this process,
+    the bar building and signals of a profiled cycle are profiled inside the executor workers and dumped
+    next to it, one file per symbol (see strategy_runner.analyze_symbol).
+    """
+
+    def __init__(self, cursor, track_memory=constants.stage_memory_tracking):
+        self.cursor = cursor
+        self.track_memory = track_memory
+        self.profile_cycles = 0  # cycles left to profile
+        self.profile = None
+        self.cycle_id = None
+        self.cycle_start = None
+        self.stages = []
+        self.open_stages = []  # records of the stages running now
+        self.worker_cpu = 0.0  # CPU seconds the cycle's stages spent outside this process
+        self.memory_peak = 0  # traced memory peak of the cycle before the last per-stage reset
+        self.cursor.execute("""
+        CREATE TABLE IF NOT EXISTS cycle_stages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cycle_id INTEGER,
+            timestamp INTEGER,
+            stage TEXT,
+            wall_ms REAL,
+            cpu_ms REAL,
+            rows_read INTEGER,
+            bars_built INTEGER,
+            peak_memory_kb REAL,
+            profiled INTEGER
+        )
+        """)
+        self.cursor.execute("SELECT MAX(cycle_id) FROM cycle_stages")
+        last_cycle = self.cursor.fetchone()[0]
+        self.next_cycle_id = (last_cycle or 0) + 1
+
+    def request_profile(self, cycles=constants.profile_cycles):
+        self.profile_cycles = max(self.profile_cycles, cycles)
+        print(f"Profiling the next {self.profile_cycles} analysis cycles")
+
+    def install_signal_handler(self, loop):
+        # SIGUSR1 doesn't exist on Windows, the flag file works everywhere
+        if hasattr(signal, 'SIGUSR1'):
+            loop.add_signal_handler(signal.SIGUSR1, self.request_profile)
+
+    def check_flag_file(self):
+        if not os.path.exists(constants.profile_flag_path):
+            return
+
+        with open(constants.profile_flag_path) as flag:
+            content = flag.read().strip()
+        os.remove(constants.profile_flag_path)
+        self.request_profile(int(content) if content.isdigit() else constants.profile_cycles)
+
+    def start_cycle(self):
+        self.check_flag_file()
+        self.cycle_id = self.next_cycle_id
+        self.next_cycle_id += 1
+        self.cycle_start = (time.perf_counter(), time.thread_time(), int(time.time()))
+        self.stages = []
+        self.open_stages = []
+        self.worker_cpu = 0.0
+        self.memory_peak = 0
+
+        if self.track_memory:
+            tracemalloc.start()
+
+        if self.profile_cycles > 0:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+    def stage(self, name):
+        """
+        Context manager measuring a stage of the current cycle.
+
+        :return: The StageRecord, set its rows and bars attributes inside the block.
+        """
+        return Stage(self, StageRecord(name))
+
+    def record_stage(self, name, wall, cpu=None, rows=None, bars=None):
+        """
+        Add a stage measured elsewhere, e.g. a sub-stage timed inside an executor worker. Its CPU time is
+        already part of the stage that waited for the worker, so it isn't added to the cycle's total again.
+        """
+        record = StageRecord(name)
+        record.wall, record.cpu, record.rows, record.bars = wall, cpu, rows, bars
+        self.stages.append(record)
+
+    def end_cycle(self):
+        """Write the cycle's stages, dump the profile if one was running. Doesn't commit."""
+        profiled = self.profile is not None
+        if profiled:
+            self.profile.disable()
+            self.dump_profile()
+            self.profile = None
+            self.profile_cycles -= 1
+
+        total = StageRecord('cycle')
+        total.wall = time.perf_counter() - self.cycle_start[0]
+        total.cpu = time.thread_time() - self.cycle_start[1] + self.worker_cpu
+        if tracemalloc.is_tracing():
+            total.peak = max(self.memory_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.stages.append(total)
+
+        self.cursor.executemany("""
+        INSERT INTO cycle_stages
+        (cycle_id, timestamp, stage, wall_ms, cpu_ms, rows_read, bars_built, peak_memory_kb, profiled)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(self.cycle_id, self.cycle_start[2], record.stage, record.wall * 1000,
+               record.cpu * 1000 if record.cpu is not None else None,
+               record.rows, record.bars, record.peak / 1024 if record.peak is not None else None, int(profiled))
+              for record in self.stages])
+
+        print(f"Cycle {self.cycle_id}: " + ', '.join(f"{record.stage} {record.wall * 1000:.1f} ms"
+                                                     for record in self.stages))
+
+    def dump_profile(self):
+        path = os.path.join(constants.profile_dir, f'cycle_{self.cycle_id}_{self.cycle_start[2]}.prof')
+        dump_stats(self.profile, path)
+        print(f"Profile of cycle {self.cycle_id} written to {path}")
+
+
+def dump_stats(profile, path):
+    """Write the raw stats of a cProfile.Profile to path, and its top functions next to it as text."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    profile.dump_stats(path)
+
+    # Top functions by cumulative time next to the raw stats, readable without pstats
+    report = io.StringIO()
+    pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(30)
+    with open(path[:-len('.prof')] + '.txt', 'w') as text:
+        text.write(report.getvalue())
+
+
+def stage_history(cursor, stage, cycles=100):
+    """
+    :return: (cycle_id, timestamp, wall_ms, cpu_ms, rows_read, bars_built, peak_memory_kb) of a stage
+             over the last cycles, newest first.
+    """
+    cursor.execute("""
+    SELECT cycle_id, timestamp, wall_ms, cpu_ms, rows_read, bars_built, peak_memory_kb
+    FROM cycle_stages
+    WHERE stage = ?
+    ORDER BY cycle_id DESC
+    LIMIT ?
+    """, (stage, cycles))
+    return cursor.fetchall()
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+# Profile the next 3 cycles of the running bot
+echo 3 > profile.flag        # or: kill -USR1 <pid>
+
+# Then open the dumps, the event loop's and the workers' of each symbol
+python -m pstats profiles/cycle_42_1718000000.prof
+python -m pstats profiles/cycle_42_XBTUSD.prof
+
+# Wall time of the dollar bar building of PF_XBTUSD over the last 100 cycles, stages are '<symbol> <stage>'
+for row in stage_history(cursor, 'PF_XBTUSD create_dollar_bars'):
+    print(row)"""
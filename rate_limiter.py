@@ -0,0 +1,255 @@
+import asyncio
+import concurrent.futures
+import itertools
+import threading
+import time
+
+import constants
+
+
+# Lower values are served first when several requests wait on the same budget
+PRIORITY_ORDER = 0  # sendorder, editorder, cancelorder, batchorder
+PRIORITY_ACCOUNT = 1  # positions, open orders, fills
+PRIORITY_MARKET_DATA = 2  # candles, tickers, instruments
+
+# Cost of each Kraken Futures private endpoint against the 500 per 10 seconds budget
+futures_costs = {
+    '/sendorder': 10,
+    '/editorder': 10,
+    '/cancelorder': 10,
+    '/batchorder': 9,  # plus one per instruction
+    '/openpositions': 2,
+    '/openorders': 2,
+    '/fills': 2,
+    '/accounts': 2,
+}
+
+
+def futures_cost(endpoint, batch_size=0):
+    return futures_costs.get(endpoint, 1) + batch_size
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_rate):
+        self.capacity = capacity
+        self.refill_rate = refill_rate  # tokens per second
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+
+class RateLimitScheduler:
+    """
+    Client-side token buckets for the Kraken APIs with priority queuing and single-flight reads.
+
+    A request only takes tokens once the budget also covers every queued request of higher priority, so
+    order and cancel traffic overtakes waiting market-data reads. Reads also leave a reserved slice of
+    each bucket untouched, so a burst of candle and ticker fetches can't spend the budget needed to
+    close a position. Identical reads that are already in flight share one response instead of each
+    going to the exchange.
+    """
+
+    def __init__(self, budgets, reserve=constants.order_budget_reserve, poll_interval=0.005):
+        """
+        :param budgets: Dict of bucket name -> (capacity, refill per second).
+        :param reserve: Fraction of each bucket that only order priority requests may use.
+        :param poll_interval: Shortest sleep while waiting for a turn, in seconds.
+        """
+        self.buckets = {name: TokenBucket(capacity, rate) for name, (capacity, rate) in budgets.items()}
+        self.reserve = reserve
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.waiting = {name: {} for name in budgets}  # ticket -> (priority, cost)
+        self.sequence = itertools.count()
+        self.in_flight = {}  # single-flight key -> concurrent.futures.Future
+        self.in_flight_async = {}  # single-flight key -> asyncio.Future
+        self.stats = {name: {'requests': 0, 'coalesced': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+                      for name in budgets}
+
+    def enqueue(self, name, priority, cost):
+        ticket = next(self.sequence)
+        with self.lock:
+            self.waiting[name][ticket] = (priority, min(cost, self.buckets[name].capacity))
+        return ticket
+
+    def try_take(self, name, ticket):
+        """
+        Take the tokens for the ticket once the budget covers it, the reserve and higher priority waiters.
+
+        :return: 0 when the tokens were taken, otherwise the seconds to sleep before trying again.
+        """
+        with self.lock:
+            bucket = self.buckets[name]
+            waiting = self.waiting[name]
+            priority, cost = waiting[ticket]
+
+            bucket.refill()
+            floor = 0 if priority == PRIORITY_ORDER else bucket.capacity * self.reserve
+            ahead = sum(other_cost for other_priority, other_cost in waiting.values()
+                        if other_priority < priority)
+            needed = min(bucket.capacity, floor + ahead + cost)
+
+            if bucket.tokens >= needed:
+                bucket.tokens -= cost
+                del waiting[ticket]
+                return 0
+
+            return max((needed - bucket.tokens) / bucket.refill_rate, self.poll_interval)
+
+    def record_wait(self, name, waited):
+        with self.lock:
+            stats = self.stats[name]
+            stats['requests'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+
+    def acquire(self, name, cost=1, priority=PRIORITY_MARKET_DATA):
+        start = time.monotonic()
+        ticket = self.enqueue(name, priority, cost)
+
+        try:
+            wait = self.try_take(name, ticket)
+            while wait:
+                time.sleep(wait)
+                wait = self.try_take(name, ticket)
+        except BaseException:
+            # An interrupted waiter must not keep holding back lower priority requests
+            self.leave(name, ticket)
+            raise
+
+        self.record_wait(name, time.monotonic() - start)
+
+    async def acquire_async(self, name, cost=1, priority=PRIORITY_MARKET_DATA):
+        start = time.monotonic()
+        ticket = self.enqueue(name, priority, cost)
+
+        try:
+            wait = self.try_take(name, ticket)
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.try_take(name, ticket)
+        except BaseException:
+            # A cancelled waiter must not keep holding back lower priority requests
+            self.leave(name, ticket)
+            raise
+
+        self.record_wait(name, time.monotonic() - start)
+
+    def leave(self, name, ticket):
+        with self.lock:
+            self.waiting[name].pop(ticket, None)
+
+    def run(self, name, request, cost=1, priority=PRIORITY_MARKET_DATA, key=None):
+        """
+        Call request() once the budget allows it.
+
+        :param name: Bucket to charge.
+        :param request: Zero-argument callable performing the HTTP call.
+        :param cost: Tokens the call costs.
+        :param priority: One of the PRIORITY_* values.
+        :param key: Optional single-flight key. Callers passing the same key while a call is in flight
+                    wait for that call and get its result. Only use it for unsigned reads, a signed
+                    request's response belongs to its own signature.
+        :return: Whatever request() returns.
+        """
+        if key is None:
+            self.acquire(name, cost, priority)
+            return request()
+
+        with self.lock:
+            future = self.in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.in_flight[key] = future
+            else:
+                self.stats[name]['coalesced'] += 1
+
+        if not owner:
+            return future.result()
+
+        # The key is released however the call ends, a stuck key would block every later identical call
+        try:
+            self.acquire(name, cost, priority)
+            result = request()
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        except BaseException:
+            # Interrupted (KeyboardInterrupt, SystemExit), the waiters get a CancelledError
+            future.cancel()
+            raise
+        finally:
+            self.finish(self.in_flight, key)
+
+        future.set_result(result)
+        return result
+
+    async def run_async(self, name, request, cost=1, priority=PRIORITY_MARKET_DATA, key=None):
+        """Asyncio version of run, request is a zero-argument coroutine function."""
+        if key is None:
+            await self.acquire_async(name, cost, priority)
+            return await request()
+
+        future = self.in_flight_async.get(key)
+        if future is not None:
+            with self.lock:
+                self.stats[name]['coalesced'] += 1
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self.in_flight_async[key] = future
+        try:
+            await self.acquire_async(name, cost, priority)
+            result = await request()
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting on the shared future, don't let asyncio warn about it
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            self.finish(self.in_flight_async, key)
+
+        future.set_result(result)
+        return result
+
+    def finish(self, in_flight, key):
+        with self.lock:
+            in_flight.pop(key, None)
+
+    def report(self):
+        """
+        :return: Dict per bucket with the budget left, queued requests, request and coalesced counts and
+                 the average and worst queue wait in milliseconds.
+        """
+        report = {}
+        with self.lock:
+            for name, bucket in self.buckets.items():
+                bucket.refill()
+                stats = self.stats[name]
+                report[name] = {
+                    'budget_left': round(bucket.tokens, 1),
+                    'capacity': bucket.capacity,
+                    'queued': len(self.waiting[name]),
+                    'requests': stats['requests'],
+                    'coalesced': stats['coalesced'],
+                    'avg_wait_ms': round(stats['wait_total'] / stats['requests'] * 1000, 2)
+                    if stats['requests'] else 0,
+                    'max_wait_ms': round(stats['wait_max'] * 1000, 2)
+                }
+        return report
+
+
+# Shared scheduler used by kraken_toolbox and kraken_async
+scheduler = RateLimitScheduler({
+    'spot_public': constants.spot_public_budget,
+    'futures_public': constants.futures_public_budget,
+    'futures_private': constants.futures_private_budget,
+})
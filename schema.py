@@ -1,8 +1,5 @@
 import sqlite3
-
-# Connect to SQLite database (it will create the database file if it doesn't exist)
-conn = sqlite3.connect('trading_data.db')
-cursor = conn.cursor()
+import constants
 
 create_trades_table = """
 CREATE TABLE IF NOT EXISTS trades (
@@ -11,62 +8,100 @@ CREATE TABLE IF NOT EXISTS trades (
     price REAL,
     volume REAL,
     side TEXT,
-    type_order TEXT
+    type_order TEXT,
+    pair TEXT DEFAULT 'XBT/USD'
 );
 """
 
-# Create volume profile table if not exists
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS volume_profile (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
+# Closed OHLC candles, built from the trades (candles.py) or fetched from Kraken (kraken_toolbox.CandleStore)
+create_candles_table = """
+CREATE TABLE IF NOT EXISTS candles (
+    pair TEXT,
     interval INTEGER,
-    price_level REAL,
-    volume REAL)
-""")
+    time INTEGER,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    vwap REAL,
+    volume REAL,
+    count INTEGER,
+    PRIMARY KEY (pair, interval, time)
+);
+"""
 
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS signals (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp INTEGER,
-    order_flow_signal TEXT,
-    order_flow_score INTEGER,
-    market_pressure REAL,
-    volume_profile_signal TEXT,
-    price_action_signal TEXT
-)
-""")
+def upgrade_tables(cursor):
+    """Add the columns newer code relies on to tables of an older database."""
+    for statement in (
+        # Older databases were created before close_reason existed
+        "ALTER TABLE opened_positions ADD COLUMN close_reason TEXT",
+        # Trades and signals were single-symbol, existing trades are XBT/USD
+        "ALTER TABLE trades ADD COLUMN pair TEXT DEFAULT 'XBT/USD'",
+        "ALTER TABLE signals ADD COLUMN symbol TEXT",
+    ):
+        try:
+            cursor.execute(statement)
+        except sqlite3.OperationalError:
+            pass  # Column already exists
 
 
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS opened_positions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    symbol TEXT,
-    timestamp INTEGER,
-    open_price REAL,
-    side TEXT,
-    size REAL,
-    take_profit REAL,
-    stop_loss REAL,
-    close_reason TEXT,
-    close_price REAL,
-    close_time INTEGER
-)
+if __name__ == '__main__':
+    # Connect to SQLite database (it will create the database file if it doesn't exist)
+    conn = sqlite3.connect(constants.db_path)
+    cursor = conn.cursor()
+
+    # Create volume profile table if not exists
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS volume_profile (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        interval INTEGER,
+        price_level REAL,
+        volume REAL)
+    """)
+
+
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS signals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp INTEGER,
+        order_flow_signal TEXT,
+        order_flow_score INTEGER,
+        market_pressure REAL,
+        volume_profile_signal TEXT,
+        price_action_signal TEXT,
+        symbol TEXT
+    )
+    """)
+
 
-""")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS opened_positions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT,
+        timestamp INTEGER,
+        open_price REAL,
+        side TEXT,
+        size REAL,
+        take_profit REAL,
+        stop_loss REAL,
+        close_reason TEXT,
+        close_price REAL,
+        close_time INTEGER
+    )
 
+    """)
 
-cursor.execute("""
-ALTER TABLE opened_positions ADD COLUMN close_reason TEXT
-""")
 
+    # Execute SQL commands to create tables
+    cursor.execute(create_trades_table)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_timestamp ON trades (timestamp)")
 
-# Execute SQL commands to create tables
-cursor.execute(create_trades_table)
+    upgrade_tables(cursor)
 
 
-# Commit changes and close the connection
-conn.commit()
-conn.close()
+    # Commit changes and close the connection
+    conn.commit()
+    conn.close()
 
-print("Tables created successfully.")
+    print("Tables created successfully.")
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import constants
+
+# Bump whenever a pickled class (e.g. DollarBarBuilder) changes shape, older snapshots are then ignored
+SNAPSHOT_VERSION = 3
+MAGIC = b'VPOF-SNAPSHOT\n'
+
+
+def write_snapshot(state, path=constants.snapshot_path):
+    """
+    Write the state atomically: a temporary file is fully written and synced, then renamed over the old
+    snapshot, so a crash mid-write leaves the previous snapshot intact.
+
+    The file is the magic line, a JSON header line with the version, creation time, payload size and
+    SHA-256 of the payload, then the pickled state.
+
+    :param state: Picklable object, live.py passes a dict of symbol -> runner state.
+    :return: Size of the snapshot in bytes.
+    """
+    payload = pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'created': time.time(),
+        'size': len(payload),
+        'sha256': hashlib.sha256(payload).hexdigest()
+    }).encode() + b'\n'
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as snapshot:
+        snapshot.write(MAGIC)
+        snapshot.write(header)
+        snapshot.write(payload)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary_path, path)
+
+    return len(MAGIC) + len(header) + len(payload)
+
+
+def read_snapshot(path=constants.snapshot_path):
+    """
+    :return: (state, header dict), or (None, None) when there is no usable snapshot. A missing file,
+             another version or a checksum mismatch are reported and treated as no snapshot.
+    """
+    if not os.path.exists(path):
+        print(f"No snapshot at {path}, starting cold")
+        return None, None
+
+    with open(path, 'rb') as snapshot:
+        if snapshot.readline() != MAGIC:
+            print(f"{path} is not a snapshot, starting cold")
+            return None, None
+        try:
+            header = json.loads(snapshot.readline())
+        except ValueError:
+            print(f"Snapshot header of {path} is unreadable, starting cold")
+            return None, None
+        payload = snapshot.read()
+
+    if header.get('version') != SNAPSHOT_VERSION:
+        print(f"Snapshot version {header.get('version')} != {SNAPSHOT_VERSION}, starting cold")
+        return None, None
+
+    if len(payload) != header.get('size') or hashlib.sha256(payload).hexdigest() != header.get('sha256'):
+        print(f"Snapshot checksum mismatch in {path}, starting cold")
+        return None, None
+
+    print(f"Loaded snapshot from {time.ctime(header['created'])} ({len(payload)} bytes)")
+    return pickle.loads(payload), header
+
+
+def invalidate_snapshot(path=constants.snapshot_path, reason=None):
+    """
+    Remove the snapshot so the next start rebuilds the bars from the trades table, e.g. after trades were
+    imported into the window the snapshot's bars were built without.
+
+    :return: True if a snapshot was removed.
+    """
+    if not os.path.exists(path):
+        return False
+    os.remove(path)
+    print(f"Removed snapshot {path}" + (f" ({reason})" if reason else "") + ", the next start is cold")
+    return True
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+write_snapshot({'PF_XBTUSD': runner.snapshot_state()})
+
+state, header = read_snapshot()
+if state is not None:
+    runner.restore_state(state.get('PF_XBTUSD'))"""
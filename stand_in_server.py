@@ -0,0 +1,637 @@
+"""
+Local stand-in for the Kraken spot and futures endpoints the bot uses, so the whole trading loop can run
+and be measured on one machine without network access.
+
+Serves the spot OHLC, Trades and Ticker endpoints, the futures tickers, instruments, sendorder, batchorder,
+editorder, cancelorder, openpositions, openorders and fills endpoints, the spot trade websocket and the
+futures ticker and private websocket feeds. Trades come from a seeded random walk or are replayed from a
+CSV file or a trades table. Latency and errors can be injected on every HTTP call, and --max-position makes
+the exchange reject orders like an account short of margin.
+
+Start the server, then point the bot at it through the environment:
+
+    python stand_in_server.py --port 8765 --rate 50
+    KRAKEN_SPOT_WS_URL=ws://127.0.0.1:8765/ws \\
+    KRAKEN_SPOT_API_URL=http://127.0.0.1:8765/0/public \\
+    KRAKEN_FUTURES_API_URL=http://127.0.0.1:8765/derivatives/api/v3 \\
+    KRAKEN_FUTURES_WS_URL=ws://127.0.0.1:8765/ws/v1 \\
+    TRADING_DB=stand_in.db ANALYSIS_INTERVAL=10 python live.py
+
+On exit the server prints (and optionally writes) the trades streamed per second and the tick-to-order
+latency: the time between the last trade pushed to the bot and each order it sends back.
+"""
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import math
+import random
+import sqlite3
+import statistics
+import time
+import uuid
+from collections import deque
+
+from aiohttp import web, WSMsgType
+
+
+# Variables
+pair = 'XXBTZUSD'  # Spot REST pair name
+ws_pair = 'XBT/USD'  # Spot websocket pair name
+symbol = 'PF_XBTUSD'  # Futures symbol
+trade_channel_id = 42
+half_spread = 0.5
+
+
+def synthetic_trades(start_price, seed=None):
+    """Endless random walk of (price, volume, side, order type) with short buy/sell runs."""
+    rng = random.Random(seed)
+    price = start_price
+    side = 'b'
+    while True:
+        price = max(1.0, price * math.exp(rng.gauss(0, 0.0002)))
+        if rng.random() < 0.3:
+            side = 's' if side == 'b' else 'b'
+        volume = round(rng.lognormvariate(-4, 1.5), 8)
+        order_type = 'm' if rng.random() < 0.7 else 'l'
+        yield round(price, 1), volume, side, order_type
+
+
+def recorded_trades(path):
+    """
+    Trades from a CSV file (timestamp, price, volume[, side, type] like Kraken's trade dumps) or a SQLite
+    database with a trades table. Yields (timestamp, price, volume, side, order type).
+    """
+    if path.endswith('.db'):
+        conn = sqlite3.connect(path)
+        for timestamp, price, volume, side, type_order in conn.execute(
+                "SELECT timestamp, price, volume, side, type_order FROM trades ORDER BY timestamp"):
+            yield (float(timestamp), price, volume, 'b' if side == 'buy' else 's',
+                   'm' if type_order == 'market' else 'l')
+        conn.close()
+        return
+
+    with open(path, newline='') as f:
+        for row in csv.reader(f):
+            if not row or not row[0][0].isdigit():
+                continue
+            side = row[3] if len(row) > 3 else 'b'
+            order_type = row[4] if len(row) > 4 else 'm'
+            yield float(row[0]), float(row[1]), float(row[2]), side[0], order_type[0]
+
+
+class StandInExchange:
+    """Trade tape, candles, order matching and account state behind the stand-in endpoints."""
+
+    def __init__(self, start_price=60000.0, history_hours=12, seed=None, max_trades=500000, max_position=None):
+        self.trades = deque(maxlen=max_trades)  # (timestamp, price, volume, side, order type)
+        self.synthetic = synthetic_trades(start_price, seed)
+        self.max_position = max_position  # orders growing the position past it are rejected, None for no limit
+        self.position = 0.0  # signed futures position in PF_XBTUSD
+        self.entry_price = 0.0
+        self.position_time = None
+        self.orders = {}  # order_id -> resting stop / take profit / limit order
+        self.fills = deque(maxlen=1000)
+        self.private_sockets = set()
+        self.ticker_sockets = set()
+        self.last_tick = None  # monotonic time the last trade was pushed to the bot
+        self.tick_to_order = []
+        self.trades_streamed = 0
+        self.stream_started = None
+        self.requests = {}
+        self.seed_history(history_hours)
+
+    @property
+    def last_price(self):
+        return self.trades[-1][1]
+
+    def seed_history(self, hours):
+        # One synthetic trade every 10 seconds so OHLC and the first analysis have something to work on
+        now = time.time()
+        for t in range(int(hours * 360), 0, -1):
+            price, volume, side, order_type = next(self.synthetic)
+            self.trades.append((now - t * 10, price, volume, side, order_type))
+
+    def next_synthetic(self):
+        price, volume, side, order_type = next(self.synthetic)
+        trade = (time.time(), price, volume, side, order_type)
+        self.trades.append(trade)
+        return trade
+
+    def candles(self, interval, since=None):
+        width = interval * 60
+        start = self.trades[0][0] if since is None else float(since)
+        buckets = {}
+        for timestamp, price, volume, side, order_type in self.trades:
+            if timestamp < start:
+                continue
+            bucket = int(timestamp // width * width)
+            candle = buckets.get(bucket)
+            if candle is None:
+                buckets[bucket] = [price, price, price, price, price * volume, volume, 1]
+            else:
+                candle[1] = max(candle[1], price)
+                candle[2] = min(candle[2], price)
+                candle[3] = price
+                candle[4] += price * volume
+                candle[5] += volume
+                candle[6] += 1
+
+        rows = []
+        for bucket in sorted(buckets)[-720:]:
+            o, h, l, c, notional, volume, count = buckets[bucket]
+            rows.append([bucket, f'{o:.1f}', f'{h:.1f}', f'{l:.1f}', f'{c:.1f}',
+                         f'{notional / volume if volume else c:.1f}', f'{volume:.8f}', count])
+        return rows
+
+    def record_order(self):
+        if self.last_tick is not None:
+            self.tick_to_order.append((time.monotonic() - self.last_tick) * 1000)
+
+    def fill(self, side, size, price, order_id, cli_ord_id=None, fill_type='taker'):
+        signed = size if side == 'buy' else -size
+        new_position = self.position + signed
+
+        if self.position == 0 or (self.position > 0) == (signed > 0):
+            # Opening or adding, average the entry
+            total = abs(self.position) + size
+            self.entry_price = (self.entry_price * abs(self.position) + price * size) / total
+            if self.position == 0:
+                self.position_time = time.time()
+        elif abs(signed) > abs(self.position):
+            # Flipped through zero
+            self.entry_price = price
+            self.position_time = time.time()
+
+        self.position = round(new_position, 8)
+        if self.position == 0:
+            self.entry_price = 0.0
+            self.position_time = None
+
+        fill = {
+            'fill_id': str(uuid.uuid4()),
+            'symbol': symbol,
+            'side': side,
+            'order_id': order_id,
+            'cliOrdId': cli_ord_id,
+            'size': size,
+            'price': price,
+            'fillTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+            'fillType': fill_type
+        }
+        self.fills.append(fill)
+        return fill
+
+    def capped_size(self, side, size, reduce_only):
+        if not reduce_only:
+            return size
+        # Reduce-only orders can only shrink the position
+        if (side == 'sell' and self.position > 0) or (side == 'buy' and self.position < 0):
+            return min(size, abs(self.position))
+        return 0
+
+    def send_order(self, order):
+        order_id = str(uuid.uuid4())
+        side = order['side']
+        size = float(order['size'])
+        order_type = order.get('orderType', 'mkt')
+        reduce_only = str(order.get('reduceOnly', 'false')).lower() == 'true'
+        cli_ord_id = order.get('cliOrdId')
+        events = []
+
+        signed = size if side == 'buy' else -size
+        if not reduce_only and self.max_position is not None and abs(self.position + signed) > self.max_position:
+            return order_id, 'insufficientAvailableFunds', events
+
+        if order_type == 'mkt':
+            size = self.capped_size(side, size, reduce_only)
+            if size == 0:
+                return order_id, 'wouldNotReducePosition', events
+            price = self.last_price + (half_spread if side == 'buy' else -half_spread)
+            fill = self.fill(side, size, price, order_id, cli_ord_id)
+            events.append({'type': 'EXECUTION', 'amount': size, 'price': price, 'executionId': fill['fill_id']})
+            return order_id, 'placed', events
+
+        self.orders[order_id] = {
+            'order_id': order_id,
+            'cliOrdId': cli_ord_id,
+            'symbol': order.get('symbol', symbol),
+            'side': side,
+            'orderType': 'stop' if order_type == 'stp' else order_type,
+            'limitPrice': float(order['limitPrice']) if order.get('limitPrice') else None,
+            'stopPrice': float(order['stopPrice']) if order.get('stopPrice') else None,
+            'unfilledSize': size,
+            'filledSize': 0,
+            'reduceOnly': reduce_only,
+            'status': 'untouched',
+            'receivedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+        }
+        events.append({'type': 'PLACE', 'order': self.orders[order_id]})
+        return order_id, 'placed', events
+
+    def find_order(self, order_id=None, cli_ord_id=None):
+        if order_id in self.orders:
+            return order_id
+        for resting_id, order in self.orders.items():
+            if cli_ord_id is not None and order['cliOrdId'] == cli_ord_id:
+                return resting_id
+        return None
+
+    def cancel_order(self, order_id=None, cli_ord_id=None):
+        resting_id = self.find_order(order_id, cli_ord_id)
+        if resting_id is None:
+            return None, 'notFound'
+        del self.orders[resting_id]
+        return resting_id, 'cancelled'
+
+    def edit_order(self, order):
+        resting_id = self.find_order(order.get('orderId') or order.get('order_id'), order.get('cliOrdId'))
+        if resting_id is None:
+            return None, 'orderForEditNotFound'
+        resting = self.orders[resting_id]
+        for field in ('limitPrice', 'stopPrice'):
+            if order.get(field):
+                resting[field] = float(order[field])
+        if order.get('size'):
+            resting['unfilledSize'] = float(order['size'])
+        return resting_id, 'edited'
+
+    def trigger_orders(self, price):
+        """Fill resting orders crossed by the latest trade price."""
+        triggered = []
+        for order_id, order in list(self.orders.items()):
+            side = order['side']
+            trigger = order['stopPrice'] if order['orderType'] in ('stop', 'take_profit') else order['limitPrice']
+            if trigger is None:
+                continue
+
+            if order['orderType'] == 'stop':
+                hit = price >= trigger if side == 'buy' else price <= trigger
+            else:
+                hit = price <= trigger if side == 'buy' else price >= trigger
+
+            if hit:
+                del self.orders[order_id]
+                size = self.capped_size(side, order['unfilledSize'], order['reduceOnly'])
+                if size > 0:
+                    triggered.append(self.fill(side, size, price, order_id, order['cliOrdId']))
+        return triggered
+
+    def open_positions(self):
+        if self.position == 0:
+            return []
+        return [{
+            'side': 'long' if self.position > 0 else 'short',
+            'symbol': symbol,
+            'price': self.entry_price,
+            'fillTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(self.position_time)),
+            'size': abs(self.position),
+            'unrealizedFunding': 0
+        }]
+
+    def ticker(self):
+        last = self.last_price
+        return {'symbol': symbol, 'last': last, 'bid': last - half_spread, 'ask': last + half_spread,
+                'markPrice': last, 'tag': 'perpetual', 'pair': 'XBT:USD'}
+
+    def metrics(self):
+        elapsed = time.monotonic() - self.stream_started if self.stream_started else 0
+        latencies = sorted(self.tick_to_order)
+        summary = {
+            'trades_streamed': self.trades_streamed,
+            'trades_per_second': round(self.trades_streamed / elapsed, 1) if elapsed else 0,
+            'orders': len(latencies),
+            'requests': self.requests
+        }
+        if latencies:
+            summary['tick_to_order_ms'] = {
+                'median': round(statistics.median(latencies), 2),
+                'p95': round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+                'max': round(latencies[-1], 2)
+            }
+        return summary
+
+
+def futures_ok(**fields):
+    body = {'result': 'success', 'serverTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())}
+    body.update(fields)
+    return web.json_response(body)
+
+
+def create_app(exchange, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+    rng = random.Random(seed)
+
+    @web.middleware
+    async def inject_faults(request, handler):
+        if request.path.startswith('/ws'):
+            return await handler(request)
+
+        exchange.requests[request.path] = exchange.requests.get(request.path, 0) + 1
+        delay = latency_ms + (rng.uniform(-jitter_ms, jitter_ms) if jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        if error_rate and rng.random() < error_rate:
+            if request.path.startswith('/0/'):
+                return web.json_response({'error': ['EService:Unavailable'], 'result': {}})
+            return web.json_response({'result': 'error', 'error': 'Service Unavailable'}, status=503)
+
+        return await handler(request)
+
+    async def ohlc(request):
+        interval = int(request.query.get('interval', 1))
+        rows = exchange.candles(interval, request.query.get('since'))
+        last = rows[-2][0] if len(rows) > 1 else (rows[-1][0] if rows else 0)
+        return web.json_response({'error': [], 'result': {request.query.get('pair', pair): rows, 'last': last}})
+
+    async def spot_trades(request):
+        # 'since' is the nanosecond 'last' cursor of the previous page, or seconds
+        since = float(request.query.get('since', 0))
+        since = since / 1e9 if since > 1e12 else since
+        rows = [[f'{price:.1f}', f'{volume:.8f}', timestamp, side[0], order_type[0], '', index]
+                for index, (timestamp, price, volume, side, order_type) in enumerate(exchange.trades)
+                if timestamp > since][:1000]
+        last = str(int(rows[-1][2] * 1e9)) if rows else str(int(since * 1e9))
+        return web.json_response({'error': [], 'result': {request.query.get('pair', pair): rows, 'last': last}})
+
+    async def spot_ticker(request):
+        last = exchange.last_price
+        return web.json_response({'error': [], 'result': {request.query.get('pair', pair): {
+            'a': [f'{last + half_spread:.1f}', '1', '1.000'],
+            'b': [f'{last - half_spread:.1f}', '1', '1.000'],
+            'c': [f'{last:.1f}', f'{exchange.trades[-1][2]:.8f}']
+        }}})
+
+    async def tickers(request):
+        return futures_ok(tickers=[exchange.ticker()])
+
+    async def instruments(request):
+        return futures_ok(instruments=[{'symbol': symbol, 'type': 'flexible_futures', 'tickSize': 1,
+                                        'contractSize': 1, 'tradeable': True,
+                                        'contractValueTradePrecision': 4}])
+
+    async def sendorder(request):
+        exchange.record_order()
+        order = dict(await request.post())
+        order_id, status, events = exchange.send_order(order)
+        await push_account_updates(exchange)
+        return futures_ok(sendStatus={'order_id': order_id, 'status': status, 'cliOrdId': order.get('cliOrdId'),
+                                      'receivedTime': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                                      'orderEvents': events})
+
+    async def batchorder(request):
+        exchange.record_order()
+        form = await request.post()
+        batch = json.loads(form['json'])['batchOrder']
+        statuses = []
+        for instruction in batch:
+            if instruction['order'] == 'send':
+                order_id, status, events = exchange.send_order(instruction)
+                statuses.append({'order_tag': instruction.get('order_tag'), 'order_id': order_id,
+                                 'status': status, 'cliOrdId': instruction.get('cliOrdId'),
+                                 'orderEvents': events})
+            elif instruction['order'] == 'cancel':
+                order_id, status = exchange.cancel_order(instruction.get('order_id'), instruction.get('cliOrdId'))
+                statuses.append({'order_id': order_id or instruction.get('order_id'), 'status': status,
+                                 'cliOrdId': instruction.get('cliOrdId')})
+            elif instruction['order'] == 'edit':
+                order_id, status = exchange.edit_order(instruction)
+                statuses.append({'order_id': order_id or instruction.get('order_id'), 'status': status,
+                                 'cliOrdId': instruction.get('cliOrdId')})
+        await push_account_updates(exchange)
+        return futures_ok(batchStatus=statuses)
+
+    async def cancelorder(request):
+        form = await request.post()
+        order_id, status = exchange.cancel_order(form.get('order_id'), form.get('cliOrdId'))
+        await push_account_updates(exchange)
+        return futures_ok(cancelStatus={'order_id': order_id, 'status': status})
+
+    async def editorder(request):
+        exchange.record_order()
+        order_id, status = exchange.edit_order(dict(await request.post()))
+        await push_account_updates(exchange)
+        return futures_ok(editStatus={'orderId': order_id, 'status': status})
+
+    async def openpositions(request):
+        return futures_ok(openPositions=exchange.open_positions())
+
+    async def openorders(request):
+        return futures_ok(openOrders=list(exchange.orders.values()))
+
+    async def fills(request):
+        return futures_ok(fills=list(exchange.fills))
+
+    async def accounts(request):
+        return futures_ok(accounts={'flex': {'type': 'multiCollateralMarginAccount', 'balanceValue': 100000}})
+
+    async def spot_websocket(request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        stream = None
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                data = json.loads(message.data)
+                if data.get('event') == 'subscribe' and data.get('subscription', {}).get('name') == 'trade':
+                    await websocket.send_json({'channelID': trade_channel_id, 'channelName': 'trade',
+                                               'event': 'subscriptionStatus', 'pair': ws_pair,
+                                               'status': 'subscribed', 'subscription': {'name': 'trade'}})
+                    if stream is None:
+                        stream = asyncio.create_task(stream_trades(websocket, request.app))
+        finally:
+            if stream is not None:
+                stream.cancel()
+        return websocket
+
+    async def futures_websocket(request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        try:
+            async for message in websocket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                data = json.loads(message.data)
+                if data.get('event') == 'challenge':
+                    await websocket.send_json({'event': 'challenge', 'message': str(uuid.uuid4())})
+                elif data.get('event') == 'subscribe':
+                    feed = data.get('feed')
+                    await websocket.send_json({'event': 'subscribed', 'feed': feed,
+                                               'product_ids': data.get('product_ids')})
+                    if feed == 'ticker':
+                        exchange.ticker_sockets.add(websocket)
+                    else:
+                        exchange.private_sockets.add(websocket)
+                        await websocket.send_json(private_snapshot(exchange, feed))
+        finally:
+            exchange.ticker_sockets.discard(websocket)
+            exchange.private_sockets.discard(websocket)
+        return websocket
+
+    app = web.Application(middlewares=[inject_faults])
+    app.add_routes([
+        web.get('/0/public/OHLC', ohlc),
+        web.get('/0/public/Trades', spot_trades),
+        web.get('/0/public/Ticker', spot_ticker),
+        web.get('/derivatives/api/v3/tickers', tickers),
+        web.get('/derivatives/api/v3/instruments', instruments),
+        web.post('/derivatives/api/v3/sendorder', sendorder),
+        web.post('/derivatives/api/v3/batchorder', batchorder),
+        web.post('/derivatives/api/v3/cancelorder', cancelorder),
+        web.post('/derivatives/api/v3/editorder', editorder),
+        web.get('/derivatives/api/v3/openpositions', openpositions),
+        web.get('/derivatives/api/v3/openorders', openorders),
+        web.get('/derivatives/api/v3/fills', fills),
+        web.get('/derivatives/api/v3/accounts', accounts),
+        web.get('/ws', spot_websocket),
+        web.get('/ws/v1', futures_websocket),
+    ])
+    app['exchange'] = exchange
+    return app
+
+
+def private_snapshot(exchange, feed):
+    if feed == 'open_positions':
+        return {'feed': 'open_positions', 'positions': [
+            {'instrument': symbol, 'balance': exchange.position, 'entry_price': exchange.entry_price}
+        ] if exchange.position else []}
+    if feed == 'fills':
+        return {'feed': 'fills_snapshot', 'fills': [ws_fill(fill) for fill in exchange.fills]}
+    if feed == 'open_orders':
+        return {'feed': 'open_orders_snapshot', 'orders': [ws_order(order) for order in exchange.orders.values()]}
+    return {'feed': feed}
+
+
+def ws_fill(fill):
+    return {'instrument': fill['symbol'], 'time': int(time.time() * 1000), 'price': fill['price'],
+            'buy': fill['side'] == 'buy', 'qty': fill['size'], 'order_id': fill['order_id'],
+            'cli_ord_id': fill['cliOrdId'], 'fill_id': fill['fill_id'], 'fill_type': fill['fillType']}
+
+
+def ws_order(order):
+    order_type = {'lmt': 'limit'}.get(order['orderType'], order['orderType'])
+    return {'instrument': order['symbol'], 'time': int(time.time() * 1000), 'qty': order['unfilledSize'],
+            'filled': order['filledSize'], 'limit_price': order['limitPrice'], 'stop_price': order['stopPrice'],
+            'type': order_type, 'order_id': order['order_id'], 'cli_ord_id': order['cliOrdId'],
+            'direction': 0 if order['side'] == 'buy' else 1, 'reduce_only': order['reduceOnly']}
+
+
+async def push_account_updates(exchange):
+    """Resend positions and open orders to every private feed subscriber after the account changed."""
+    if not exchange.private_sockets:
+        return
+    messages = [private_snapshot(exchange, 'open_positions'), private_snapshot(exchange, 'open_orders')]
+    if exchange.fills:
+        messages.append({'feed': 'fills', 'fills': [ws_fill(exchange.fills[-1])]})
+    for websocket in list(exchange.private_sockets):
+        for message in messages:
+            await websocket.send_json(message)
+
+
+async def stream_trades(websocket, app):
+    """Push trades to one spot websocket client in Kraken's trade message format."""
+    exchange = app['exchange']
+    settings = app['settings']
+    replay = app.get('replay')
+    interval = settings['batch_ms'] / 1000
+    per_batch = max(1, round(settings['rate'] * interval))
+    exchange.stream_started = exchange.stream_started or time.monotonic()
+    replay_offset = None
+
+    while not websocket.closed:
+        batch = []
+        for _ in range(per_batch):
+            if replay is not None:
+                try:
+                    timestamp, price, volume, side, order_type = next(replay)
+                except StopIteration:
+                    replay = None
+                    continue
+                # Recorded trades are re-stamped to the wall clock so the bot's look-back windows apply
+                if replay_offset is None:
+                    replay_offset = time.time() - timestamp
+                trade = (timestamp + replay_offset, price, volume, side, order_type)
+                exchange.trades.append(trade)
+            else:
+                trade = exchange.next_synthetic()
+            batch.append(trade)
+
+        if batch:
+            await websocket.send_json([trade_channel_id,
+                                       [[f'{price:.1f}', f'{volume:.8f}', f'{timestamp:.6f}', side, order_type, '']
+                                        for timestamp, price, volume, side, order_type in batch],
+                                       'trade', ws_pair])
+            exchange.last_tick = time.monotonic()
+            exchange.trades_streamed += len(batch)
+
+            triggered = exchange.trigger_orders(batch[-1][1])
+            if triggered:
+                await push_account_updates(exchange)
+            for ticker_socket in list(exchange.ticker_sockets):
+                ticker = exchange.ticker()
+                await ticker_socket.send_json({'feed': 'ticker', 'product_id': symbol, 'time': int(time.time() * 1000),
+                                               'last': ticker['last'], 'bid': ticker['bid'], 'ask': ticker['ask']})
+
+        await asyncio.sleep(interval)
+
+
+async def report_metrics(exchange, every):
+    while True:
+        await asyncio.sleep(every)
+        print('Stand-in metrics:', json.dumps(exchange.metrics()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Kraken stand-in server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--rate', type=float, default=20, help='trades per second pushed on the trade stream')
+    parser.add_argument('--batch-ms', type=float, default=100, help='milliseconds between trade messages')
+    parser.add_argument('--replay', help='CSV file or SQLite .db with a trades table to replay instead of synthetic')
+    parser.add_argument('--start-price', type=float, default=60000.0)
+    parser.add_argument('--history-hours', type=float, default=12, help='synthetic history served by OHLC')
+    parser.add_argument('--latency-ms', type=float, default=0, help='added to every HTTP response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='uniform +/- jitter on the added latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of HTTP calls answered with an error')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--max-position', type=float, default=None,
+                        help='largest position in BTC, bigger orders are rejected like an account without margin')
+    parser.add_argument('--report-every', type=float, default=30, help='seconds between metric printouts')
+    parser.add_argument('--metrics-out', help='write the final metrics as JSON to this file')
+    args = parser.parse_args()
+
+    start_price = args.start_price
+    replay = None
+    if args.replay:
+        # Seed the synthetic history at the recorded price so candles don't jump when the replay starts
+        replay = recorded_trades(args.replay)
+        first_trade = next(replay)
+        start_price = first_trade[1]
+        replay = itertools.chain([first_trade], replay)
+
+    exchange = StandInExchange(start_price, args.history_hours, args.seed, max_position=args.max_position)
+    app = create_app(exchange, args.latency_ms, args.jitter_ms, args.error_rate, args.seed)
+    app['settings'] = {'rate': args.rate, 'batch_ms': args.batch_ms}
+    if replay is not None:
+        app['replay'] = replay
+
+    async def start_reporting(app):
+        app['reporter'] = asyncio.create_task(report_metrics(exchange, args.report_every))
+
+    async def stop_reporting(app):
+        app['reporter'].cancel()
+        metrics = exchange.metrics()
+        print('Final stand-in metrics:', json.dumps(metrics, indent=2))
+        if args.metrics_out:
+            with open(args.metrics_out, 'w') as f:
+                json.dump(metrics, f, indent=2)
+
+    app.on_startup.append(start_reporting)
+    app.on_cleanup.append(stop_reporting)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
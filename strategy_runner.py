@@ -0,0 +1,276 @@
+import asyncio
+import cProfile
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytz
+
+import constants
+from dollar_bars import DollarBarBuilder, conn
+from footprint import bar_footprints
+from get_signals import get_market_signal, stochastic_setup
+from indicators import StochRSI
+from profiling import dump_stats
+from tracing import tracer
+
+
+@contextmanager
+def worker_stage(stages, name):
+    """
+    Time a stage of analyze_symbol in the worker, the parent adds it to its tracer and cycle profiler.
+
+    :param stages: List the stage dict is appended to.
+    :return: The stage dict, set its rows and bars inside the block.
+    """
+    stage = {'stage': name, 'rows': None, 'bars': None}
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield stage
+    finally:
+        stage['wall'] = time.perf_counter() - wall_start
+        stage['cpu'] = time.process_time() - cpu_start
+        stages.append(stage)
+
+
+def analyze_symbol(pair, threshold, num_bars, builder=None, hours=72, stoch_rsi=None, book_features=None,
+                   trace=False, profile_cycle=None, footprints=False):
+    """
+    Bring the dollar bars of one pair up to date and compute its order flow signal and stochastic RSI setup.
+
+    Runs in an executor worker process, so it only takes and returns picklable values and reads the
+    trades through the worker's own database connection. The builder goes back and forth with each call,
+    so after the first cycle only the trades inserted since the previous one are read. The stochastic RSI
+    travels the same way and only consumes the bars completed since the previous call.
+
+    :param builder: DollarBarBuilder of the previous call, None builds the whole window.
+    :param stoch_rsi: indicators.StochRSI of the previous call, None starts from the bars in the window.
+    :param book_features: OrderBook.features() of the pair when the book is streamed, added to the signal.
+    :param trace: Record the spans of the worker's tracer, the parent's tracer.enabled.
+    :param profile_cycle: Id of the cycle being profiled, the call then runs under cProfile and dumps its
+                          stats to constants.profile_dir as cycle_<id>_<pair>.prof. None doesn't profile.
+    :param footprints: Add the footprint features of the newest completed bar to the signal, prefixed with
+                       footprint_ (see footprint.Footprints.features), constants.footprint_features.
+    :return: Dict with the builder, the stochastic RSI, the dollar bars, the signal dict, the setup, the
+             number of trades read, the CPU seconds the call took in the worker, the timed stages (dicts
+             with stage, wall, cpu, rows and bars) and the spans recorded in the worker, (stage, seconds).
+    """
+    cpu_start = time.process_time()
+    profile = cProfile.Profile() if profile_cycle is not None else None
+    if profile is not None:
+        profile.enable()
+    try:
+        tracer.enabled = trace
+        tracer.start_decision('worker')
+        stages = []
+        builder = builder if builder is not None else DollarBarBuilder(threshold, pair, hours)
+        stoch_rsi = stoch_rsi if stoch_rsi is not None else StochRSI()
+
+        with worker_stage(stages, 'fetch_trades') as stage:
+            trades = builder.read_trades()
+            stage['rows'] = rows = len(trades)
+        with worker_stage(stages, 'create_dollar_bars') as stage:
+            builder.consume(trades)
+            dollar_bars = builder.to_frame()
+            stage['bars'] = len(dollar_bars)
+
+        with worker_stage(stages, 'stochastic_rsi') as stage:
+            new_bars = min(builder.completed - stoch_rsi.count, len(builder.bars))
+            for bar in builder.bars[len(builder.bars) - new_bars:]:
+                stoch_rsi.update(bar[3], bar[6])
+            stage['bars'] = new_bars
+
+        result = {'builder': builder, 'stoch_rsi': stoch_rsi, 'dollar_bars': dollar_bars, 'signal': None,
+                  'setup': None, 'rows': rows, 'stages': stages}
+        if not dollar_bars.empty:
+            with worker_stage(stages, 'get_market_signal'):
+                result['signal'] = get_market_signal(dollar_bars, num_bars, 3, pair, builder.metrics,
+                                                     book_features=book_features)
+                result['setup'] = stochastic_setup(*stoch_rsi.value)
+
+        if footprints and result['signal'] is not None and builder.bars:
+            with worker_stage(stages, 'footprints'):
+                # Reported next to the signal like the book features, the entry and exit rules don't use them.
+                # With the bar before it, the trades of the boundary second go to the bar they closed
+                features = bar_footprints(conn, builder.bars[-2:], pair).features().iloc[-1].to_dict()
+                footprint = {f'footprint_{name}': value for name, value in features.items()}
+                print('Footprint : ', footprint)
+                result['signal'].update(footprint)
+    finally:
+        # Left enabled, the worker's next profiled call couldn't start its own
+        if profile is not None:
+            profile.disable()
+            dump_stats(profile, os.path.join(constants.profile_dir,
+                                             f"cycle_{profile_cycle}_{pair.replace('/', '')}.prof"))
+
+    result['spans'] = tracer.take_spans()
+    result['cpu'] = time.process_time() - cpu_start
+    return result
+
+
+def calculate_average_move(dollar_bars, num_bars):
+    # Check if dollar_bars DataFrame is empty or if it contains fewer bars than num_bars
+    if dollar_bars.empty or len(dollar_bars) < num_bars:
+        print("Not enough dollar bars available.")
+        return None
+
+    selected_bars = dollar_bars.tail(num_bars)  # Select the last num_bars rows
+    average_move = (selected_bars['high'] - selected_bars['low']).mean()
+    return average_move * 2
+
+
+def get_stops(dollar_bars, side, current_price, stop_multiplier=0.7):
+
+    take_profit = None
+    stop_loss = None
+    average_move = calculate_average_move(dollar_bars, 7)
+
+    if side == 'buy':
+        take_profit = current_price + average_move
+        stop_loss = current_price - (average_move * stop_multiplier)
+    if side == 'sell':
+        take_profit = current_price - average_move
+        stop_loss = current_price + (average_move * stop_multiplier)
+
+    return take_profit, stop_loss
+
+
+def is_us_market_opening_soon(now=None):
+    """
+    :param now: Aware datetime to check, the current time by default. Backtests pass the replay time.
+    """
+    est = pytz.timezone('US/Eastern')
+    now = datetime.now(est) if now is None else now.astimezone(est)
+    market_open_time = now.replace(hour=9, minute=30, second=0, microsecond=0)
+    market_close_time = now.replace(hour=10, minute=30, second=0, microsecond=0)
+
+    return (market_open_time - timedelta(minutes=5)) <= now < market_close_time
+
+
+def exit_reason(side, current_price, take_profit, stop_loss, dollar_volume_since_open, dollar_volume_limit, signal):
+    """
+    Exit rules of an open position, checked once per analysis cycle, in order of priority.
+
+    :param side: 'long' or 'short'.
+    :param dollar_volume_limit: Dollar volume traded since the open after which the position is closed.
+    :param signal: The cycle's order flow signal, an opposite signal closes the position.
+    :return: 'take_profit', 'stop_loss', 'dollar_volume_exit', 'market_switch_exit' or None to hold.
+    """
+    if side == 'short':
+        if current_price <= take_profit:
+            return 'take_profit'
+        if current_price >= stop_loss:
+            return 'stop_loss'
+        if dollar_volume_since_open >= dollar_volume_limit:
+            return 'dollar_volume_exit'
+        if signal == 'buy':
+            return 'market_switch_exit'
+
+    elif side == 'long':
+        if current_price >= take_profit:
+            return 'take_profit'
+        if current_price <= stop_loss:
+            return 'stop_loss'
+        if dollar_volume_since_open >= dollar_volume_limit:
+            return 'dollar_volume_exit'
+        if signal == 'sell':
+            return 'market_switch_exit'
+
+    return None
+
+
+def entry_side(signal, rsi, rsi_buy=35, rsi_sell=65):
+    """
+    Entry rule when flat: the order flow signal, confirmed by an oversold or overbought 5 minute RSI.
+
+    :return: 'buy', 'sell' or None.
+    """
+    if signal == 'buy' and rsi < rsi_buy:
+        return 'buy'
+    if signal == 'sell' and rsi > rsi_sell:
+        return 'sell'
+    return None
+
+
+class SymbolRunner:
+    """
+    Strategy state of one instrument: its config, bar builder, latest dollar bars and signal, and the client
+    order ids of the stop loss and take profit resting for its position.
+    """
+
+    def __init__(self, symbol, config):
+        self.symbol = symbol
+        self.config = config
+        self.pair = config['pair']
+        self.builder = None  # DollarBarBuilder, created by the first analysis or restored from a snapshot
+        self.stoch_rsi = None  # indicators.StochRSI fed with the builder's bars, same lifecycle
+        self.dollar_bars = None
+        self.signal = None
+        self.setup = None
+        self.rows = 0
+        self.cpu = None  # CPU seconds of the last analysis, spent in the worker process
+        self.stages = []  # sub-stages of the last analysis timed in the worker, see worker_stage
+        self.spans = []  # (stage, seconds) recorded by the worker's tracer during the last analysis
+        self.protective_ids = []
+
+    async def analyze(self, executor, book_features=None, profile_cycle=None):
+        """
+        Rebuild the bars and signal in the executor, the event loop keeps serving trades and orders.
+
+        :param profile_cycle: Id of the cycle being profiled, the worker then profiles the analysis.
+        """
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(executor, analyze_symbol, self.pair, self.config['dollar_threshold'],
+                                            self.config['num_bars'], self.builder, 72, self.stoch_rsi,
+                                            book_features, tracer.enabled, profile_cycle,
+                                            constants.footprint_features)
+        self.builder = result['builder']
+        self.stoch_rsi = result['stoch_rsi']
+        self.dollar_bars = result['dollar_bars']
+        self.signal = result['signal']
+        self.setup = result['setup']
+        self.rows = result['rows']
+        self.cpu = result['cpu']
+        self.stages = result['stages']
+        self.spans = result['spans']
+        return result
+
+    def snapshot_state(self):
+        return {'builder': self.builder, 'signal': self.signal, 'setup': self.setup,
+                'stoch_rsi': self.stoch_rsi.snapshot() if self.stoch_rsi is not None else None,
+                'protective_ids': self.protective_ids}
+
+    def restore_state(self, state):
+        """
+        Resume from a snapshot, the next analysis only catches up on the trades inserted after it.
+
+        :return: False if the snapshot doesn't match the runner's config and was ignored.
+        """
+        builder = state.get('builder') if state else None
+        if builder is None or builder.threshold != self.config['dollar_threshold'] or builder.pair != self.pair:
+            return False
+
+        self.builder = builder
+        self.stoch_rsi = StochRSI.from_snapshot(state['stoch_rsi']) if state['stoch_rsi'] is not None else None
+        self.dollar_bars = builder.to_frame()
+        self.signal = state['signal']
+        self.setup = state['setup']
+        self.protective_ids = state['protective_ids']
+        return True
+
+
+def create_runners(symbols=None):
+    """
+    :param symbols: Symbols from constants.symbols to run, defaults to constants.active_symbols.
+    :return: Dict of symbol -> SymbolRunner.
+    """
+    symbols = symbols if symbols is not None else constants.active_symbols
+    return {symbol: SymbolRunner(symbol, constants.symbols[symbol]) for symbol in symbols}
+
+
+def create_executor(workers=constants.analysis_workers):
+    # Fresh interpreters rather than forks, forked workers would share the parent's open SQLite connections
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
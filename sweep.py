@@ -0,0 +1,260 @@
+"""
+Parallel parameter sweep of the strategy over historical trades.
+
+    python sweep.py --days 30 --grid dollar_threshold=2500000,3500000,5000000 --grid rsi_buy=30,35,40 \\
+        --grid stop_multiplier=0.5,0.7,1.0
+
+The trades are exported once to memory-mapped .npy columns that every worker process maps read-only, so
+the OS shares one copy of the pages between them. Configurations with the same dollar threshold share
+one replay: a worker builds the bars, order flow totals and candles once and runs all its configurations
+as separate accounts of one Backtest. Each threshold group is split into as many tasks as its share of
+the pool, so the work spreads over every core.
+
+Every configuration's PnL, win rate, drawdown and trade count go to the sweep_results table.
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import as_completed
+
+import numpy as np
+
+import constants
+from backtest import Backtest, FillModel, default_params
+from strategy_runner import create_executor
+
+
+array_columns = ('timestamp', 'price', 'volume', 'side', 'market')
+
+
+def export_arrays(conn, directory, pair, start=None, end=None, batch_size=1000000):
+    """
+    Write the trades of a pair to .npy columns: timestamp, price and volume as float64, side (1 buy, 0 sell)
+    and market (1 market order, 0 otherwise) as int8. An export of the same range is reused.
+
+    :return: Number of trades in the arrays.
+    """
+    meta_path = os.path.join(directory, 'meta.json')
+    meta = {'pair': pair, 'start': start, 'end': end}
+    if os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            existing = json.load(meta_file)
+        if {key: existing.get(key) for key in meta} == meta:
+            return existing['rows']
+
+    os.makedirs(directory, exist_ok=True)
+    params = (start, start, end, end, pair)
+    cursor = conn.cursor()
+    cursor.execute("""
+    SELECT COUNT(*) FROM trades
+    WHERE (? IS NULL OR timestamp >= ?) AND (? IS NULL OR timestamp < ?) AND pair = ?
+    """, params)
+    rows = cursor.fetchone()[0]
+
+    arrays = {name: np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode='w+',
+                                              dtype=np.int8 if name in ('side', 'market') else np.float64,
+                                              shape=(rows,))
+              for name in array_columns}
+
+    cursor.execute("""
+    SELECT timestamp, price, volume, side = 'buy', type_order = 'market' FROM trades
+    WHERE (? IS NULL OR timestamp >= ?) AND (? IS NULL OR timestamp < ?) AND pair = ?
+    ORDER BY timestamp ASC
+    """, params)
+    position = 0
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        columns = list(zip(*batch))
+        for name, column in zip(array_columns, columns):
+            arrays[name][position:position + len(batch)] = column
+        position += len(batch)
+
+    for array in arrays.values():
+        array.flush()
+    with open(meta_path, 'w') as meta_file:
+        json.dump(dict(meta, rows=position), meta_file)
+    return position
+
+
+def load_arrays(directory):
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in array_columns}
+
+
+def array_trades(arrays, start=None, end=None, chunk_size=1000000):
+    """Yield (timestamp, price, volume, side, type_order) tuples from the arrays, like backtest.stream_trades."""
+    timestamps = arrays['timestamp']
+    first = int(np.searchsorted(timestamps, start)) if start is not None else 0
+    last = int(np.searchsorted(timestamps, end)) if end is not None else len(timestamps)
+    sides = np.array(['sell', 'buy'], dtype=object)
+    order_types = np.array(['limit', 'market'], dtype=object)
+
+    for chunk_start in range(first, last, chunk_size):
+        chunk = slice(chunk_start, min(chunk_start + chunk_size, last))
+        yield from zip(timestamps[chunk].tolist(), arrays['price'][chunk].tolist(), arrays['volume'][chunk].tolist(),
+                       sides[arrays['side'][chunk]].tolist(), order_types[arrays['market'][chunk]].tolist())
+
+
+def run_group(directory, symbol, params_list, start, end, hours, interval, fill_model):
+    """
+    Executor task: one replay over the mapped arrays for configurations sharing a dollar threshold.
+
+    :return: List of (params, summary), one per configuration.
+    """
+    arrays = load_arrays(directory)
+    backtest = Backtest(symbol, params_list, fill_model, interval, hours)
+    warm_up = start - hours * 3600 if start is not None else None
+    results = backtest.run(array_trades(arrays, warm_up, end), start, end)
+    return [(result['params'], result['summary']) for result in results]
+
+
+def expand_grid(grid):
+    """
+    :param grid: Dict of parameter name -> list of values.
+    :return: List of params dicts, one per combination.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def plan_tasks(configs, workers):
+    """
+    Group the configurations by dollar threshold and split each group into a share of the workers.
+
+    Within a group the configurations are ordered by their signal windows, so a task mostly holds
+    configurations whose signal is computed once per cycle for all of them.
+
+    :return: List of params lists, one per task.
+    """
+    groups = defaultdict(list)
+    for config in configs:
+        groups[dict(default_params, **config)['dollar_threshold']].append(config)
+
+    tasks = []
+    for group in groups.values():
+        group.sort(key=lambda config: tuple(dict(default_params, **config)[name]
+                                            for name in ('num_bars', 'num_ratings', 'long_term_bars')))
+        chunks = min(len(group), max(1, round(workers * len(group) / len(configs))))
+        size = -(-len(group) // chunks)
+        tasks += [group[index:index + size] for index in range(0, len(group), size)]
+    return tasks
+
+
+def create_sweep_table(cursor):
+    param_columns = ''.join(f"\n        {name} REAL," for name in default_params)
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS sweep_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sweep_id INTEGER,
+        created INTEGER,
+        symbol TEXT,
+        start REAL,
+        end REAL,{param_columns}
+        trades INTEGER,
+        win_rate REAL,
+        pnl REAL,
+        fees REAL,
+        profit_factor REAL,
+        max_drawdown REAL,
+        seconds REAL
+    )
+    """)
+
+
+def store_results(cursor, sweep_id, symbol, start, end, results):
+    """Write (params, summary) pairs to sweep_results. Doesn't commit."""
+    create_sweep_table(cursor)
+    names = list(default_params)
+    cursor.executemany(f"""
+    INSERT INTO sweep_results (sweep_id, created, symbol, start, end, {', '.join(names)}, trades, win_rate, pnl,
+                               fees, profit_factor, max_drawdown, seconds)
+    VALUES ({', '.join('?' * (len(names) + 12))})
+    """, [(sweep_id, int(time.time()), symbol, start, end) + tuple(params[name] for name in names) +
+          (summary['trades'], summary['win_rate'], summary['pnl'], summary['fees'], summary['profit_factor'],
+           summary['max_drawdown'], summary['seconds'])
+          for params, summary in results])
+
+
+def run_sweep(conn, grid, symbol='PF_XBTUSD', start=None, end=None, workers=None, directory='sweep_arrays',
+              hours=72, interval=constants.analysis_interval, fill_model=None):
+    """
+    Evaluate every combination of the grid over the trades from start to end.
+
+    :return: List of (params, summary), in the order the tasks finished.
+    """
+    workers = workers or os.cpu_count()
+    pair = constants.symbols[symbol]['pair']
+    warm_up = start - hours * 3600 if start is not None else None
+    rows = export_arrays(conn, directory, pair, warm_up, end)
+    configs = expand_grid(grid)
+    tasks = plan_tasks(configs, workers)
+    print(f"{len(configs)} configurations in {len(tasks)} tasks over {rows} trades, {workers} workers")
+
+    results = []
+    started = time.perf_counter()
+    with create_executor(workers) as executor:
+        futures = [executor.submit(run_group, directory, symbol, params_list, start, end, hours, interval,
+                                   fill_model or FillModel())
+                   for params_list in tasks]
+        for future in as_completed(futures):
+            results += future.result()
+            print(f"{len(results)}/{len(configs)} configurations done after {time.perf_counter() - started:.0f}s")
+    return results
+
+
+def parse_grid(entries):
+    """Turn ['rsi_buy=30,35', 'stop_multiplier=0.5,0.7'] into a grid, values typed like default_params."""
+    grid = {}
+    for entry in entries:
+        name, values = entry.split('=', 1)
+        if name not in default_params:
+            raise ValueError(f"Unknown parameter {name}, expected one of {', '.join(default_params)}")
+        grid[name] = [type(default_params[name])(float(value)) for value in values.split(',')]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep strategy parameters over stored trades.")
+    parser.add_argument('--symbol', default='PF_XBTUSD')
+    parser.add_argument('--start', type=float, default=None, help="first cycle, Unix seconds")
+    parser.add_argument('--end', type=float, default=None, help="end, Unix seconds")
+    parser.add_argument('--days', type=float, default=None, help="last N days of the table, instead of --start")
+    parser.add_argument('--grid', action='append', default=[], help="name=value,value,... for each swept parameter")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, one per core by default")
+    parser.add_argument('--arrays', default='sweep_arrays', help="directory of the memory-mapped trade columns")
+    parser.add_argument('--top', type=int, default=10, help="best configurations to print")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(constants.db_path)
+    cursor = conn.cursor()
+
+    start, end = args.start, args.end
+    if args.days is not None:
+        cursor.execute("SELECT MAX(timestamp) FROM trades WHERE pair = ?", (constants.symbols[args.symbol]['pair'],))
+        end = end if end is not None else cursor.fetchone()[0]
+        start = end - args.days * 86400
+
+    results = run_sweep(conn, parse_grid(args.grid), args.symbol, start, end, args.workers, args.arrays)
+
+    create_sweep_table(cursor)
+    cursor.execute("SELECT MAX(sweep_id) FROM sweep_results")
+    sweep_id = (cursor.fetchone()[0] or 0) + 1
+    store_results(cursor, sweep_id, args.symbol, start, end, results)
+    conn.commit()
+    conn.close()
+
+    print(f"\nSweep {sweep_id}, best {args.top} by PnL:")
+    swept = parse_grid(args.grid)
+    for params, summary in sorted(results, key=lambda result: result[1]['pnl'], reverse=True)[:args.top]:
+        print(', '.join(f"{name}={params[name]}" for name in swept) +
+              f"  PnL {summary['pnl']:.2f}  win rate {summary['win_rate'] * 100:.1f}%  "
+              f"trades {summary['trades']}  max drawdown {summary['max_drawdown']:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the repository root, next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules like dollar_bars connect to the database on import, keep them off the real one
+os.environ.setdefault('TRADING_DB', ':memory:')
@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from candles import CandleBuilder
+from schema import create_candles_table, create_trades_table
+
+
+pair = 'XBT/USD'
+rest_pair = 'XXBTZUSD'
+start = 1720000200  # on a 5 minute boundary
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute(create_trades_table)
+    cursor.execute(create_candles_table)
+    yield cursor
+    conn.close()
+
+
+def builder(**kwargs):
+    return CandleBuilder(pair, intervals=(5,), **kwargs)
+
+
+def times(candle_builder):
+    return [row[0] for row in candle_builder.candles(5)]
+
+
+def test_quiet_periods_are_flat_candles():
+    candle_builder = builder()
+    candle_builder.add_trades([(start + 10, 60000.0, 0.1), (start + 20, 60010.0, 0.1),
+                               (start + 3 * 300 + 5, 60020.0, 0.2)])
+
+    rows = candle_builder.candles(5)
+    assert times(candle_builder) == [start, start + 300, start + 600, start + 900]
+    # Flat at the last close, no volume
+    assert [row[1:] for row in rows[1:3]] == [[60010.0, 60010.0, 60010.0, 60010.0, 60010.0, 0.0, 0]] * 2
+    assert rows[3][1] == 60020.0 and rows[3][7] == 1
+
+
+def test_catch_up_keeps_a_quiet_market_ready():
+    candle_builder = builder()
+    candle_builder.add_trades([(start + index * 300, 60000.0 + index, 0.1) for index in range(60)])
+    now = start + 60 * 300 + 3 * 300 + 10
+    assert not candle_builder.ready(5, 60, now)
+
+    candle_builder.catch_up(now)
+    assert candle_builder.ready(5, 60, now)
+    assert candle_builder.candles(5)[-1] == [now // 300 * 300, 60059.0, 60059.0, 60059.0, 60059.0, 60059.0, 0.0, 0]
+
+    # The first trade of the current period opens its candle instead of extending the flat one
+    candle_builder.add_trade(now + 5, 60100.0, 0.3)
+    assert candle_builder.candles(5)[-1] == [now // 300 * 300, 60100.0, 60100.0, 60100.0, 60100.0, 60100.0, 0.3, 1]
+    assert candle_builder.ready(5, 60, now)
+
+
+def test_long_silence_is_a_gap_merged_from_rest(cursor):
+    candle_builder = builder(quiet_limit=600)
+    candle_builder.add_trades([(start, 60000.0, 0.1), (start + 5 * 300, 60050.0, 0.1)])
+    assert times(candle_builder) == [start, start + 1500]
+
+    # Nothing to catch up on past the limit either
+    candle_builder.catch_up(start + 20 * 300)
+    assert times(candle_builder) == [start, start + 1500]
+
+    ohlc = [[start + index * 300, '60000.0', '60100.0', '59900.0', '60050.0', '60010.0', '1.5', 12]
+            for index in range(7)]
+    assert candle_builder.merge_ohlc(cursor, 5, ohlc) == 4
+    assert times(candle_builder) == [start + index * 300 for index in range(6)]
+    # Stored with the candle the stream had closed
+    assert cursor.execute("SELECT COUNT(*) FROM candles").fetchone()[0] == 5
+
+
+def test_load_leaves_downtime_as_a_gap(cursor):
+    # Trades before and after a restart 20 minutes later, well within the quiet limit
+    cursor.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) "
+                       "VALUES (?, ?, 0.1, 'buy', 'market', ?)",
+                       [(start, 60000.0, pair), (start + 4 * 300, 60010.0, pair)])
+    candle_builder = builder()
+    candle_builder.load(cursor, now=start + 4 * 300 + 10)
+    assert times(candle_builder) == [start, start + 1200]
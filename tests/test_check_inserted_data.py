@@ -0,0 +1,36 @@
+import sqlite3
+
+import pytest
+
+from check_inserted_data import find_duplicates
+from schema import create_trades_table
+
+
+trades = [(1720000000, 60000.0, 0.01, 'buy', 'market', 'XBT/USD'),
+          (1720000000, 60000.0, 0.01, 'buy', 'market', 'XBT/USD'),
+          (1720000000, 60000.0, 0.01, 'buy', 'market', 'ETH/USD'),
+          (1720000001, 60001.0, 0.02, 'sell', 'market', 'XBT/USD')]
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    yield conn.cursor()
+    conn.close()
+
+
+def test_duplicates_are_counted_per_pair(cursor):
+    cursor.execute(create_trades_table)
+    cursor.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) "
+                       "VALUES (?, ?, ?, ?, ?, ?)", trades)
+    assert find_duplicates(cursor) == (1, [(1720000000, 60000.0, 0.01, 'buy', 2)])
+    assert find_duplicates(cursor, pair='ETH/USD') == (0, [])
+
+
+def test_duplicates_of_a_table_without_pairs(cursor):
+    # Created before the pair column and never upgraded
+    cursor.execute("CREATE TABLE trades (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp INTEGER, price REAL, "
+                   "volume REAL, side TEXT, type_order TEXT)")
+    cursor.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order) VALUES (?, ?, ?, ?, ?)",
+                       [trade[:5] for trade in trades])
+    assert find_duplicates(cursor) == (2, [(1720000000, 60000.0, 0.01, 'buy', 3)])
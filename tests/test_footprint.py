@@ -0,0 +1,132 @@
+import math
+import sqlite3
+
+import numpy as np
+import pytest
+
+from footprint import array_footprints, bar_footprints, compute_footprints
+from schema import create_trades_table
+
+
+bin_size = 5.0
+ratio = 1.5
+min_stack = 2
+levels = 2
+
+
+@pytest.fixture
+def trades():
+    """(timestamp, price, volume, buy) trades, buyers and sellers take turns pushing the price."""
+    rng = np.random.default_rng(5)
+    timestamps = 1720000000 + np.sort(rng.integers(0, 3600, 3000)).astype(np.float64)
+    prices = 60000.0 + np.cumsum(rng.normal(0.0, 2.0, 3000))
+    buys = np.sin(np.arange(3000) / 40) + rng.normal(0.0, 0.5, 3000) > 0
+    volumes = rng.exponential(0.05, 3000)
+    return timestamps, prices, volumes, buys
+
+
+@pytest.fixture
+def bars(trades):
+    # (open, high, low, close, volume, start, end, ...) like DollarBarBuilder.bars, only start and end matter.
+    # The first bar starts after the first trades, the trade seconds leave the third bar empty
+    edges = [1720000100, 1720000400, 1720000900, 1720000900.5, 1720001500, 1720002400, 1720003000]
+    return [(0, 0, 0, 0, 0, start, end, 0, 0) for start, end in zip(edges, edges[1:])]
+
+
+def reference_cells(trades, bars):
+    """Per bar dict of price bin -> [bid, ask], a trade in the first bar ending at or after it."""
+    cells = [{} for _ in bars]
+    for timestamp, price, volume, buy in zip(*trades):
+        if timestamp < bars[0][5]:
+            continue
+        for index, bar in enumerate(bars):
+            if timestamp <= bar[6]:
+                cell = cells[index].setdefault(math.floor(price / bin_size), [0.0, 0.0])
+                cell[1 if buy else 0] += volume
+                break
+    return cells
+
+
+def dense(cell):
+    """[price bin, bid, ask] of every bin from the lowest to the highest, the empty ones included."""
+    if not cell:
+        return []
+    return [[price_bin, *cell.get(price_bin, [0.0, 0.0])] for price_bin in range(min(cell), max(cell) + 1)]
+
+
+def runs(flags):
+    count = length = 0
+    for flag in flags + [False]:
+        if flag:
+            length += 1
+        else:
+            count += length >= min_stack
+            length = 0
+    return count
+
+
+def reference_features(cell):
+    rows = dense(cell)
+    if not rows:
+        return math.nan, 0, 0, 0.0, 0.0
+    poc = min(rows, key=lambda row: (-(row[1] + row[2]), row[0]))
+    buy = [index > 0 and row[2] > 0 and rows[index - 1][1] > 0 and row[2] >= ratio * rows[index - 1][1]
+           for index, row in enumerate(rows)]
+    sell = [index < len(rows) - 1 and row[1] > 0 and rows[index + 1][2] > 0
+            and row[1] >= ratio * rows[index + 1][2] for index, row in enumerate(rows)]
+    delta_low = sum(row[2] - row[1] for row in rows[:levels])
+    delta_high = sum(row[2] - row[1] for row in rows[-levels:])
+    return poc[0] * bin_size, runs(buy), runs(sell), delta_low, delta_high
+
+
+def check(footprints, trades, bars):
+    cells = reference_cells(trades, bars)
+    assert len(footprints) == len(bars)
+
+    for index, cell in enumerate(cells):
+        prices, bid, ask = footprints.bar(index)
+        rows = dense(cell)
+        assert list(prices) == [row[0] * bin_size for row in rows]
+        np.testing.assert_allclose(bid, [row[1] for row in rows], rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(ask, [row[2] for row in rows], rtol=1e-5, atol=1e-6)
+
+    features = footprints.features(ratio, min_stack, levels)
+    expected = [reference_features(cell) for cell in cells]
+    np.testing.assert_array_equal(features['poc'], [row[0] for row in expected])
+    assert list(features['buy_stacks']) == [row[1] for row in expected]
+    assert list(features['sell_stacks']) == [row[2] for row in expected]
+    np.testing.assert_allclose(features['delta_at_low'], [row[3] for row in expected], atol=1e-5)
+    np.testing.assert_allclose(features['delta_at_high'], [row[4] for row in expected], atol=1e-5)
+    np.testing.assert_allclose(features['bid_volume'], [sum(value[0] for value in cell.values()) for cell in cells])
+    np.testing.assert_allclose(features['ask_volume'], [sum(value[1] for value in cell.values()) for cell in cells])
+    # The comparison covers stacks of both sides and an empty bar
+    assert features['buy_stacks'].sum() and features['sell_stacks'].sum()
+    assert math.isnan(features['poc'][2]) and not dense(cells[2])
+
+
+def test_matches_the_per_bar_reference(trades, bars):
+    bar_starts = np.array([bar[5] for bar in bars], dtype=np.float64)
+    bar_ends = np.array([bar[6] for bar in bars], dtype=np.float64)
+    check(compute_footprints(*trades, bar_starts, bar_ends, bin_size), trades, bars)
+
+
+def test_bar_footprints_reads_the_trades_table(trades, bars):
+    conn = sqlite3.connect(':memory:')
+    conn.execute(create_trades_table)
+    timestamps, prices, volumes, buys = trades
+    rows = [(timestamp, price, volume, 'buy' if buy else 'sell', 'XBT/USD')
+            for timestamp, price, volume, buy in zip(*trades)]
+    # Another pair's trades in the same window are left out
+    rows += [(timestamp, 3000.0, 1.0, 'buy', 'ETH/USD') for timestamp in timestamps[::10]]
+    conn.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) "
+                     "VALUES (?, ?, ?, ?, 'market', ?)", rows)
+
+    check(bar_footprints(conn, bars, 'XBT/USD', bin_size), trades, bars)
+    assert len(bar_footprints(conn, [], 'XBT/USD', bin_size)) == 0
+    conn.close()
+
+
+def test_array_footprints_reads_the_exported_columns(trades, bars):
+    timestamps, prices, volumes, buys = trades
+    arrays = {'timestamp': timestamps, 'price': prices, 'volume': volumes, 'side': np.where(buys, 1, 0)}
+    check(array_footprints(arrays, bars, bin_size), trades, bars)
@@ -0,0 +1,85 @@
+import math
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from indicators import StochRSI, WilderRSI, compare_with_pandas_ta
+
+
+@pytest.fixture
+def closes():
+    """Random walk of 600 closes on the 0.1 tick with a flat stretch, where the RSI range collapses."""
+    rng = np.random.default_rng(11)
+    steps = np.round(rng.normal(0.0, 25.0, 600), 1)
+    steps[250:290] = 0.0
+    return pd.Series(60000.0 + np.cumsum(steps))
+
+
+def same(first, second):
+    return all((a != a and b != b) or a == b for a, b in zip(first, second))
+
+
+def test_matches_pandas_ta(closes):
+    pytest.importorskip('pandas_ta')
+    differences = compare_with_pandas_ta(closes)
+    assert set(differences) == {'rsi', 'STOCHRSIk_14_14_3_3', 'STOCHRSId_14_14_3_3'}
+    for name, difference in differences.items():
+        assert difference < 1e-9, (name, difference)
+
+
+def test_matches_pandas_ta_short_series(closes):
+    # Shorter than the lengths, pandas_ta returns None and every value must be NaN
+    pytest.importorskip('pandas_ta')
+    differences = compare_with_pandas_ta(closes[:10])
+    assert all(difference < 1e-9 for difference in differences.values()), differences
+
+
+@pytest.mark.parametrize('split', [5, 20, 270, 400])
+def test_stochrsi_snapshot_round_trip(closes, split):
+    values = closes.tolist()
+    uninterrupted = StochRSI()
+    expected = [uninterrupted.update(value) for value in values]
+
+    first = StochRSI()
+    streamed = [first.update(value, index) for index, value in enumerate(values[:split])]
+    # Same path as the live snapshot: pickled state, a fresh indicator rebuilt from it
+    restored = StochRSI.from_snapshot(pickle.loads(pickle.dumps(first.snapshot())))
+    assert restored.count == split
+    assert restored.last_time == split - 1
+    streamed += [restored.update(value) for value in values[split:]]
+
+    assert len(streamed) == len(expected)
+    for ours, theirs in zip(streamed, expected):
+        assert same(ours, theirs), (ours, theirs)
+
+
+@pytest.mark.parametrize('split', [5, 20, 270, 400])
+def test_rsi_snapshot_round_trip(closes, split):
+    values = closes.tolist()
+    uninterrupted = WilderRSI()
+    expected = [uninterrupted.update(value) for value in values]
+
+    first = WilderRSI()
+    streamed = [first.update(value) for value in values[:split]]
+    restored = WilderRSI.from_snapshot(pickle.loads(pickle.dumps(first.snapshot())))
+    streamed += [restored.update(value) for value in values[split:]]
+
+    assert same(streamed, expected)
+
+
+def test_preview_changes_nothing(closes):
+    values = closes.tolist()
+    indicator = StochRSI()
+    for value in values[:300]:
+        indicator.update(value)
+    before = indicator.snapshot()
+
+    preview = indicator.preview(values[300] + 50.0)
+    assert same(indicator.value, before['value'])
+    assert not math.isnan(preview[0])
+
+    # The next real update is unaffected by the preview
+    reference = StochRSI.from_snapshot(pickle.loads(pickle.dumps(before)))
+    assert same(indicator.update(values[300]), reference.update(values[300]))
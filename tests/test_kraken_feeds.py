@@ -0,0 +1,191 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import kraken_feeds
+from kraken_feeds import AccountState, MockPrivateFeed
+from kraken_toolbox import KrakenFuturesAuth
+
+
+@pytest.fixture
+def feed():
+    return MockPrivateFeed()
+
+
+def test_snapshots_make_the_state_ready(feed):
+    state = feed.state
+    assert not state.ready()
+
+    feed.connect(positions=[{'instrument': 'pf_xbtusd', 'balance': 0.002, 'entry_price': 60000.0}],
+                 orders=[{'instrument': 'pf_xbtusd', 'order_id': 'stop-1', 'qty': 0.002, 'filled': 0,
+                          'type': 'stop', 'stop_price': 59500.0, 'direction': 1, 'reduce_only': True}],
+                 fills=[{'instrument': 'pf_xbtusd', 'fill_id': 'fill-0', 'buy': True, 'qty': 0.002,
+                         'price': 60000.0, 'order_id': 'entry-1'}])
+
+    assert state.ready()
+    assert state.get_position('PF_XBTUSD') == {'side': 'long', 'symbol': 'PF_XBTUSD', 'price': 60000.0,
+                                               'size': 0.002}
+    orders = state.open_orders()['openOrders']
+    assert len(orders) == 1
+    assert orders[0]['orderType'] == 'stop' and orders[0]['side'] == 'sell' and orders[0]['reduceOnly']
+    assert orders[0]['unfilledSize'] == 0.002
+    assert [fill['fill_id'] for fill in state.fills] == ['fill-0']
+
+
+def test_order_deltas(feed):
+    feed.connect()
+    stop_id = feed.add_order('PF_XBTUSD', 'sell', 0.002, 'stop', stop_price=59500.0)
+    take_profit_id = feed.add_order('PF_XBTUSD', 'sell', 0.002, 'take_profit', stop_price=61000.0)
+    limit_id = feed.add_order('PF_XBTUSD', 'buy', 0.001, 'limit', limit_price=59000.0, cli_ord_id='entry')
+
+    orders = {order['order_id']: order for order in feed.state.open_orders()['openOrders']}
+    assert set(orders) == {stop_id, take_profit_id, limit_id}
+    assert orders[limit_id]['orderType'] == 'lmt' and orders[limit_id]['side'] == 'buy'
+    assert orders[limit_id]['cliOrdId'] == 'entry' and not orders[limit_id]['reduceOnly']
+    assert orders[stop_id]['stopPrice'] == 59500.0
+
+    feed.cancel_order(stop_id)
+    assert {order['order_id'] for order in feed.state.open_orders()['openOrders']} == {take_profit_id, limit_id}
+    # A cancel of an order the state never saw is ignored
+    feed.cancel_order('unknown')
+    assert len(feed.state.orders) == 2
+
+
+def test_fill_and_position_close(feed):
+    feed.connect()
+    order_id = feed.add_order('PF_XBTUSD', 'sell', 0.003, 'limit', limit_price=60100.0)
+    feed.fill('PF_XBTUSD', 'sell', 0.003, 60100.0, order_id=order_id)
+    feed.cancel_order(order_id)
+    feed.set_positions([('PF_XBTUSD', -0.003, 60100.0)])
+
+    assert feed.state.get_position('PF_XBTUSD')['side'] == 'short'
+    assert feed.state.get_position('PF_XBTUSD')['size'] == 0.003
+    fill = feed.state.fills[-1]
+    assert (fill['symbol'], fill['side'], fill['size'], fill['price'], fill['order_id']) == \
+           ('PF_XBTUSD', 'sell', 0.003, 60100.0, order_id)
+
+    # The closing fill comes with a positions message where the balance is 0
+    feed.fill('PF_XBTUSD', 'buy', 0.003, 59900.0)
+    feed.set_positions([('PF_XBTUSD', 0.0, 60100.0)])
+    assert feed.state.get_position('PF_XBTUSD') is None
+    assert feed.state.open_positions() == {'result': 'success', 'openPositions': []}
+    assert len(feed.state.fills) == 2
+
+
+def test_fills_are_capped():
+    feed = MockPrivateFeed(AccountState(max_fills=3))
+    feed.connect()
+    for index in range(5):
+        feed.fill('PF_XBTUSD', 'buy', 0.001, 60000.0 + index)
+    assert [fill['price'] for fill in feed.state.fills] == [60002.0, 60003.0, 60004.0]
+
+
+def test_disconnect_resets_until_new_snapshots(feed):
+    feed.connect(positions=[{'instrument': 'PF_XBTUSD', 'balance': 0.002, 'entry_price': 60000.0}])
+    assert feed.state.ready()
+    feed.disconnect()
+    assert not feed.state.ready()
+    feed.connect()
+    assert feed.state.ready()
+
+
+class FakeWebsocket:
+    """Serves queued messages, then drops the connection."""
+
+    def __init__(self, messages, on_drop=None):
+        self.messages = messages
+        self.on_drop = on_drop
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.messages:
+            if self.on_drop is not None:
+                self.on_drop()
+            raise OSError('connection dropped')
+        return json.dumps(self.messages.pop(0))
+
+
+def test_private_feed_signs_the_challenge_and_reconnects(monkeypatch):
+    secret = base64.b64encode(b'secret key material').decode()
+    auth = KrakenFuturesAuth('public-key', secret, '/api/v3/openpositions')
+    state = AccountState()
+    connections = []
+    ready = []
+    delays = []
+
+    def connect(url):
+        websocket = FakeWebsocket([
+            {'event': 'challenge', 'message': 'challenge-text'},
+            {'feed': 'open_positions', 'positions': [{'instrument': 'PF_XBTUSD', 'balance': -0.001,
+                                                      'entry_price': 60000.0}]},
+            {'feed': 'fills_snapshot', 'fills': []},
+            {'feed': 'open_orders_snapshot', 'orders': []},
+            {'event': 'alert', 'message': 'done'},
+        ], on_drop=lambda: ready.append(state.ready()))
+        connections.append(websocket)
+        return websocket
+
+    async def sleep(delay):
+        # The state is dropped back to REST before every reconnect
+        assert not state.ready() and not state.synced
+        delays.append(delay)
+        if len(delays) == 3:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(kraken_feeds.websockets, 'connect', connect)
+    monkeypatch.setattr(kraken_feeds.asyncio, 'sleep', sleep)
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(kraken_feeds.futures_private_feed(auth, state, feeds=('open_positions', 'fills')))
+
+    assert len(connections) == 3
+    assert ready == [True, True, True]
+    # The delay is reset once a connection signs its challenge
+    assert delays == [1, 1, 1]
+
+    expected = base64.b64encode(hmac.new(base64.b64decode(secret), hashlib.sha256(b'challenge-text').digest(),
+                                         hashlib.sha512).digest()).decode()
+    sent = connections[0].sent
+    assert sent[0] == {'event': 'challenge', 'api_key': 'public-key'}
+    assert [message['feed'] for message in sent[1:]] == ['open_positions', 'fills']
+    for message in sent[1:]:
+        assert message['event'] == 'subscribe'
+        assert message['original_challenge'] == 'challenge-text'
+        assert message['signed_challenge'] == expected
+
+
+def test_private_feed_backs_off_without_a_challenge(monkeypatch):
+    delays = []
+
+    def connect(url):
+        return FakeWebsocket([])
+
+    async def sleep(delay):
+        delays.append(delay)
+        if len(delays) == 7:
+            raise asyncio.CancelledError
+
+    monkeypatch.setattr(kraken_feeds.websockets, 'connect', connect)
+    monkeypatch.setattr(kraken_feeds.asyncio, 'sleep', sleep)
+    monkeypatch.setattr(kraken_feeds.constants, 'feed_max_backoff', 30)
+
+    auth = KrakenFuturesAuth('public-key', base64.b64encode(b'secret').decode(), '/api/v3/openpositions')
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(kraken_feeds.futures_private_feed(auth, AccountState()))
+    assert delays == [1, 2, 4, 8, 16, 30, 30]
@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+import kraken_toolbox
+from kraken_toolbox import TopOfBookCache
+
+
+symbol = 'PF_XBTUSD'
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = TopOfBookCache(max_age=5)
+    monkeypatch.setattr(kraken_toolbox, 'top_of_book', cache)
+    return cache
+
+
+@pytest.fixture
+def rest_calls(monkeypatch):
+    calls = []
+    tickers = {'tickers': [{'symbol': 'PF_ETHUSD', 'last': 3000.0, 'bid': 2999.5, 'ask': 3000.5},
+                           {'symbol': symbol, 'last': 60010.0, 'bid': 60009.5, 'ask': 60010.5}]}
+
+    def get(url, **kwargs):
+        calls.append(url)
+        return FakeResponse(tickers)
+
+    monkeypatch.setattr(kraken_toolbox.session, 'get', get)
+    return calls
+
+
+def test_fresh_quote_is_served_from_the_stream(cache, rest_calls):
+    cache.update(symbol, 60000.0, 59999.5, 60000.5, timestamp=1720000000.0)
+    price = kraken_toolbox.fetch_live_price(symbol)
+
+    assert rest_calls == []
+    assert price['last_price'] == 60000.0
+    assert price['timestamp'] == 1720000000.0
+    assert 0 <= price['age'] < 5
+
+
+def test_stale_quote_falls_back_to_rest(cache, rest_calls):
+    cache.update(symbol, 60000.0, 59999.5, 60000.5, timestamp=1720000000.0)
+    cache.books[symbol]['received'] -= 10
+    streamed_keys = set(cache.books[symbol]) - {'received'} | {'age'}
+
+    before = time.time()
+    price = kraken_toolbox.fetch_live_price(symbol)
+
+    assert len(rest_calls) == 1
+    # Same keys whichever path answered, age None marks a REST quote
+    assert set(price) == streamed_keys
+    assert (price['last_price'], price['bid'], price['ask']) == (60010.0, 60009.5, 60010.5)
+    assert price['age'] is None
+    assert price['timestamp'] >= before
+
+
+def test_missing_quote_falls_back_to_rest(cache, rest_calls):
+    price = kraken_toolbox.fetch_live_price(symbol)
+    assert len(rest_calls) == 1
+    assert price['last_price'] == 60010.0 and price['age'] is None
@@ -0,0 +1,78 @@
+import zlib
+
+import pytest
+
+from order_book import OrderBook
+
+
+# Book of Kraken's websocket checksum guide, its documented checksum is 974947235
+asks = [['0.05005', '0.00000500', '1582905487.684110'], ['0.05010', '0.00000500', '1582905486.187983'],
+        ['0.05015', '0.00000500', '1582905484.480241'], ['0.05020', '0.00000500', '1582905486.645658'],
+        ['0.05025', '0.00000500', '1582905486.859009'], ['0.05030', '0.00000500', '1582905488.601486'],
+        ['0.05035', '0.00000500', '1582905488.357312'], ['0.05040', '0.00000500', '1582905488.785484'],
+        ['0.05045', '0.00000500', '1582905485.302661'], ['0.05050', '0.00000500', '1582905486.157467']]
+bids = [['0.05000', '0.00000500', '1582905487.439814'], ['0.04995', '0.00000500', '1582905485.119396'],
+        ['0.04990', '0.00000500', '1582905486.432052'], ['0.04980', '0.00000500', '1582905480.609351'],
+        ['0.04975', '0.00000500', '1582905476.793880'], ['0.04970', '0.00000500', '1582905486.767461'],
+        ['0.04965', '0.00000500', '1582905481.767528'], ['0.04960', '0.00000500', '1582905487.378907'],
+        ['0.04955', '0.00000500', '1582905483.626664'], ['0.04950', '0.00000500', '1582905488.509872']]
+sample_checksum = 974947235
+
+
+def snapshot():
+    return [336, {'as': asks, 'bs': bids}, 'book-10', 'XBT/USD']
+
+
+def update(side, levels, checksum):
+    return [336, {side: levels, 'c': str(checksum)}, 'book-10', 'XBT/USD']
+
+
+def reference_checksum(ask_levels, bid_levels):
+    """The guide's algorithm on the feed's strings: dots and leading zeros removed, top 10 asks then bids."""
+    text = ''.join(value.replace('.', '').lstrip('0') for level in ask_levels[:10] + bid_levels[:10]
+                   for value in level[:2])
+    return zlib.crc32(text.encode())
+
+
+@pytest.fixture
+def book():
+    book = OrderBook('XBT/USD', depth=10)
+    assert book.apply(snapshot())
+    return book
+
+
+def test_snapshot_matches_the_documented_checksum(book):
+    assert reference_checksum(asks, bids) == sample_checksum
+    assert book.valid
+    assert book.checksum() == sample_checksum
+    assert book.asks.prices[0] == 0.05005 and book.bids.prices[0] == 0.05 and book.bids.prices[-1] == 0.0495
+
+
+def test_updates_keep_the_checksum(book):
+    # A volume change at the best ask, then the best bid replaced by a better one
+    changed_asks = [['0.05005', '0.00000700']] + asks[1:]
+    assert book.apply(update('a', [['0.05005', '0.00000700', '1582905489.000000']],
+                             reference_checksum(changed_asks, bids)))
+
+    # Two payloads in one message, the checksum of the last one covers both
+    changed_bids = [['0.05001', '0.00001000']] + bids[1:]
+    checksum = reference_checksum(changed_asks, changed_bids)
+    message = [336, {'b': [['0.05000', '0.00000000', '1582905489.100000']]},
+               {'b': [['0.05001', '0.00001000', '1582905489.100000']], 'c': str(checksum)}, 'book-10', 'XBT/USD']
+    assert book.apply(message)
+    assert book.valid and book.mismatches == 0
+    assert book.bids.prices[0] == 0.05001 and book.bids.count == 10
+
+
+def test_mismatch_waits_for_a_new_snapshot(book):
+    assert not book.apply(update('a', [['0.05005', '0.00000700', '1582905489.000000']], sample_checksum))
+    assert not book.valid and book.mismatches == 1
+    assert book.features() is None
+
+    # Updates before the resync snapshot are ignored, whatever their checksum
+    assert book.apply(update('a', [['0.05005', '0.00000900', '1582905489.500000']], 1))
+    assert not book.valid
+
+    assert book.apply(snapshot())
+    assert book.valid and book.checksum() == sample_checksum
+    assert book.features()['spread'] == pytest.approx(0.00005)
@@ -0,0 +1,226 @@
+import asyncio
+import base64
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import pandas as pd
+import pytest
+
+import constants
+import kraken_toolbox
+from kraken_toolbox import (batch_body, batch_cancel, batch_send, filled_price, map_batch_results, order_accepted,
+                            protected_entry)
+
+
+def test_batch_body_tags_sends_and_encodes():
+    instructions = protected_entry('PF_XBTUSD', 'buy', 0.002, stop_loss=59000, take_profit=61000,
+                                   clientOrderId='abc')
+    instructions.append(batch_cancel(orderId='resting-1'))
+    batch, body = batch_body(instructions)
+
+    assert [instruction.get('order_tag') for instruction in batch] == ['0', '1', '2', None]
+    assert [instruction.get('cliOrdId') for instruction in batch] == ['abc-entry', 'abc-sl', 'abc-tp', None]
+    assert batch[1]['reduceOnly'] and batch[1]['side'] == 'sell' and batch[1]['orderType'] == 'stp'
+    # The caller's instructions are left untagged
+    assert 'order_tag' not in instructions[0]
+    assert json.loads(urllib.parse.parse_qs(body)['json'][0]) == {'batchOrder': batch}
+
+
+def test_map_batch_results_pairs_statuses():
+    batch, _ = batch_body([batch_send('PF_XBTUSD', 'buy', 0.002, clientOrderId='abc-entry'),
+                           batch_send('PF_XBTUSD', 'sell', 0.002, orderType='stp', stopPrice=59000,
+                                      clientOrderId='abc-sl', reduceOnly=True),
+                           batch_send('PF_XBTUSD', 'sell', 0.002, orderType='take_profit', stopPrice=61000,
+                                      reduceOnly=True),
+                           batch_cancel(clientOrderId='old-sl'),
+                           batch_cancel(orderId='old-tp')])
+    response = {'result': 'success', 'batchStatus': [
+        # Statuses come back in any order, sends are found by tag
+        {'order_tag': '1', 'order_id': 'id-1', 'status': 'placed', 'cliOrdId': 'abc-sl', 'orderEvents': []},
+        {'order_tag': '0', 'order_id': 'id-0', 'status': 'placed', 'cliOrdId': 'abc-entry', 'orderEvents': [
+            {'type': 'EXECUTION', 'amount': 0.0015, 'price': 60000.0},
+            {'type': 'EXECUTION', 'amount': 0.0005, 'price': 60004.0}]},
+        {'order_id': 'old-sl-id', 'status': 'cancelled', 'cliOrdId': 'old-sl'},
+        {'order_id': 'old-tp', 'status': 'notFound'},
+    ]}
+    result = map_batch_results(batch, response)
+    orders = result['orders']
+
+    assert result['result'] == 'success' and result['response'] is response
+    assert set(orders) == {'abc-entry', 'abc-sl', '2', 'old-sl', 'old-tp'}
+    assert orders['abc-entry']['order_id'] == 'id-0'
+    assert orders['2']['status'] == 'missing'
+    assert orders['old-sl']['order_id'] == 'old-sl-id'
+
+    assert [key for key in orders if order_accepted(result, key)] == ['abc-entry', 'abc-sl', 'old-sl']
+    assert filled_price(result, 'abc-entry') == pytest.approx(60001.0)
+    # Placed but resting, rejected, or never reported: no fill
+    assert filled_price(result, 'abc-sl') is None
+    assert filled_price(result, 'old-tp') is None
+    assert filled_price(result, '2') is None
+
+
+def test_failed_batch_accepts_nothing():
+    batch, _ = batch_body(protected_entry('PF_XBTUSD', 'buy', 0.002, stop_loss=59000, clientOrderId='abc'))
+    result = map_batch_results(batch, {'result': 'error', 'error': 'Service Unavailable'})
+    assert not any(order_accepted(result, key) for key in result['orders'])
+    assert filled_price(result, 'abc-entry') is None
+
+
+@pytest.fixture(scope='module')
+def live(tmp_path_factory):
+    # live connects to TRADING_DB on import, point it at a scratch database with every table
+    path = str(tmp_path_factory.mktemp('live') / 'live.db')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, 'schema.py'], cwd=root, env=dict(os.environ, TRADING_DB=path), check=True,
+                   capture_output=True)
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(constants, 'db_path', path)
+        module = importlib.import_module('live')
+    assert module.conn.execute("PRAGMA database_list").fetchone()[2] == path
+    return module
+
+
+@pytest.fixture
+def stand_in(live, monkeypatch):
+    """Run a scenario against the stand-in exchange, with live's futures client pointed at it."""
+    from aiohttp.test_utils import TestServer
+    from kraken_async import AsyncKrakenFuturesClient
+    from stand_in_server import StandInExchange, create_app
+
+    monkeypatch.setattr(live, 'batch_auth', kraken_toolbox.KrakenFuturesAuth(
+        'public-key', base64.b64encode(b'secret').decode(), '/api/v3/batchorder'))
+    runner = live.runners['PF_XBTUSD']
+    runner.dollar_bars = pd.DataFrame({'high': [60050.0 + index for index in range(10)],
+                                       'low': [59950.0 + index for index in range(10)]})
+    monkeypatch.setattr(runner, 'protective_ids', [])
+
+    def run(exchange, scenario):
+        async def main():
+            server = TestServer(create_app(exchange))
+            await server.start_server()
+            monkeypatch.setattr(kraken_toolbox, 'api_url', str(server.make_url('/derivatives/api/v3')))
+            try:
+                async with AsyncKrakenFuturesClient() as client:
+                    monkeypatch.setattr(live, 'futures_client', client)
+                    return await scenario(runner)
+            finally:
+                await server.close()
+        return asyncio.run(main())
+
+    yield StandInExchange, run
+    live.cursor.execute("DELETE FROM opened_positions")
+    live.position_trackers.trackers.clear()
+    live.conn.commit()
+
+
+def open_rows(live):
+    return live.cursor.execute("SELECT symbol, side, open_price FROM opened_positions "
+                               "WHERE close_price IS NULL").fetchall()
+
+
+def test_rejected_entry_records_nothing(live, stand_in):
+    StandInExchange, run = stand_in
+    exchange = StandInExchange(history_hours=0.1, seed=3, max_position=0.001)
+
+    entry_price = run(exchange, lambda runner: live.open_position(runner, 'buy', 60000.0, time.perf_counter()))
+
+    assert entry_price is None
+    assert open_rows(live) == []
+    assert live.runners['PF_XBTUSD'].protective_ids == []
+    # The stop loss and take profit the exchange placed for the rejected entry were cancelled again
+    assert exchange.position == 0 and exchange.orders == {}
+
+
+def test_filled_entry_and_close(live, stand_in):
+    StandInExchange, run = stand_in
+    exchange = StandInExchange(history_hours=0.1, seed=3)
+
+    async def scenario(runner):
+        entry_price = await live.open_position(runner, 'buy', 60000.0, time.perf_counter())
+        protective_ids = list(runner.protective_ids)
+        close_price = await live.close_protected_position(runner.symbol, 'sell', runner.config['size'],
+                                                          time.perf_counter())
+        return entry_price, protective_ids, close_price
+
+    entry_price, protective_ids, close_price = run(exchange, scenario)
+
+    # Recorded at the fill price the exchange reported, not the quote the decision saw
+    assert entry_price == exchange.fills[0]['price']
+    assert open_rows(live) == [('PF_XBTUSD', 'long', entry_price)]
+    assert [client_id.rsplit('-', 1)[1] for client_id in protective_ids] == ['sl', 'tp']
+    assert close_price == exchange.fills[1]['price']
+    assert exchange.position == 0 and exchange.orders == {}
+
+
+def test_rejected_close_is_reported(live, stand_in):
+    StandInExchange, run = stand_in
+    exchange = StandInExchange(history_hours=0.1, seed=3)
+
+    async def scenario(runner):
+        await live.open_position(runner, 'buy', 60000.0, time.perf_counter())
+        # The position was closed behind the bot's back, the reduce-only close has nothing to reduce
+        exchange.fill('sell', exchange.position, exchange.last_price, 'manual')
+        return await live.close_protected_position(runner.symbol, 'sell', runner.config['size'],
+                                                   time.perf_counter())
+
+    assert run(exchange, scenario) is None
+    # Nothing marks the row closed, the next cycle finds the position gone from the exchange and closes it
+    assert len(open_rows(live)) == 1
+    # The cancels that went through are forgotten, no protective id is left
+    assert live.runners['PF_XBTUSD'].protective_ids == [] and exchange.orders == {}
+
+
+def test_trailing_stop_closes_only_on_a_fill(live, stand_in, monkeypatch):
+    StandInExchange, run = stand_in
+    exchange = StandInExchange(history_hours=0.1, seed=3)
+
+    # check_trailing_stops sends its exits as tasks, keep them to wait for
+    exits = []
+    close_on_trailing_stop = live.close_on_trailing_stop
+
+    async def close_and_keep(*args):
+        exits.append(asyncio.current_task())
+        await close_on_trailing_stop(*args)
+
+    monkeypatch.setattr(live, 'close_on_trailing_stop', close_and_keep)
+
+    async def exits_sent():
+        await asyncio.sleep(0)  # the exit tasks start on the next loop iteration
+        await asyncio.gather(*exits)
+
+    async def scenario(runner):
+        await live.open_position(runner, 'buy', 60000.0, time.perf_counter())
+        tracker = next(iter(live.position_trackers.trackers.values()))
+        peak = tracker.open_price + 1000
+        live.check_trailing_stops(runner.symbol, peak)
+
+        # Closed behind the bot's back: the exit is rejected and the row stays open
+        exchange.fill('sell', exchange.position, exchange.last_price, 'manual')
+        live.check_trailing_stops(runner.symbol, peak - 300)
+        await exits_sent()
+        rejected = (len(open_rows(live)), tracker.closing, tracker.retry_at > time.monotonic())
+
+        # Reopened on the exchange, the retry waits for the cooldown and then closes on the fill
+        exchange.fill('buy', runner.config['size'], exchange.last_price, 'manual')
+        live.check_trailing_stops(runner.symbol, peak - 300)
+        await exits_sent()
+        waited = len(open_rows(live))
+        tracker.retry_at = 0.0
+        live.check_trailing_stops(runner.symbol, peak - 300)
+        await exits_sent()
+        return rejected, waited
+
+    rejected, waited = run(exchange, scenario)
+    assert rejected == (1, False, True)
+    # The exit during the cooldown was never sent
+    assert waited == 1 and len(exits) == 2
+    assert open_rows(live) == []
+    reason, close_price = live.cursor.execute("SELECT close_reason, close_price FROM opened_positions").fetchone()
+    assert reason == 'trailing_stop' and close_price == exchange.fills[-1]['price']
+    assert exchange.position == 0
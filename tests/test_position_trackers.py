@@ -0,0 +1,127 @@
+import sqlite3
+
+import pytest
+
+from position_trackers import PositionTrackers
+from schema import create_trades_table
+
+
+symbol = 'PF_XBTUSD'
+pair = 'XBT/USD'
+pairs = {symbol: pair, 'PF_ETHUSD': 'ETH/USD'}
+symbols = {trade_pair: trade_symbol for trade_symbol, trade_pair in pairs.items()}
+open_time = 1720000000
+
+
+@pytest.fixture
+def cursor():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute(create_trades_table)
+    yield cursor
+    conn.close()
+
+
+def make_trades(start, count, price=60000.0):
+    """(price, timestamp, volume) trades, one every half second."""
+    return [(price + (index % 7) * 2.5 - 5, start + index * 0.5, 0.01 + (index % 5) * 0.003) for index in range(count)]
+
+
+def ingest(cursor, trackers, trades, trade_pair=pair):
+    # Same order as live.insert_trade: store the trades, then feed the trackers of the pair's symbol
+    cursor.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) "
+                       "VALUES (?, ?, ?, 'buy', 'market', ?)",
+                       [(timestamp, price, volume, trade_pair) for price, timestamp, volume in trades])
+    trackers.on_trades(trades, symbols[trade_pair])
+
+
+def assert_consistent(trackers, position_id):
+    accumulated, expected, agree = trackers.verify_dollar_volume(position_id)
+    assert agree, (accumulated, expected)
+    assert accumulated == pytest.approx(trackers.dollar_volume_from_trades(open_time, pair), rel=1e-9)
+    assert expected > 0
+
+
+def test_accumulator_matches_sql_after_open(cursor):
+    trackers = PositionTrackers(cursor, pairs)
+    trackers.load([])
+    ingest(cursor, trackers, make_trades(open_time - 60, 125))  # before, in and after the opening second
+
+    trackers.open(1, symbol, 'long', 0.002, 60000.0, open_time)
+    assert_consistent(trackers, 1)
+
+    for batch in range(5):
+        ingest(cursor, trackers, make_trades(open_time + 60 + batch * 10, 20))
+    # A late batch timed before the open is stored but isn't the position's, nor are another pair's trades
+    ingest(cursor, trackers, make_trades(open_time - 5, 4))
+    ingest(cursor, trackers, make_trades(open_time + 200, 20, price=3000.0), trade_pair='ETH/USD')
+    assert_consistent(trackers, 1)
+
+
+def test_accumulator_matches_sql_after_restart(cursor):
+    trackers = PositionTrackers(cursor, pairs)
+    trackers.load([])
+    trackers.open(1, symbol, 'short', 0.002, 60000.0, open_time)
+    ingest(cursor, trackers, make_trades(open_time, 100))
+
+    # Restart: the persisted tracker is restored, a position without one is seeded from the trades
+    open_positions = [(1, symbol, open_time, 60000.0, 'short', 0.002), (2, symbol, open_time, 60010.0, 'long', 0.002)]
+    restarted = PositionTrackers(cursor, pairs)
+    restarted.load(open_positions)
+    assert_consistent(restarted, 1)
+    assert_consistent(restarted, 2)
+
+    ingest(cursor, restarted, make_trades(open_time + 100, 60))
+    assert_consistent(restarted, 1)
+    assert_consistent(restarted, 2)
+
+
+def test_tracker_persisted_without_dollar_volume_is_seeded(cursor):
+    trackers = PositionTrackers(cursor, pairs)
+    trackers.load([])
+    trackers.open(1, symbol, 'long', 0.002, 60000.0, open_time)
+    ingest(cursor, trackers, make_trades(open_time, 50))
+    cursor.execute("UPDATE position_trackers SET dollar_volume = NULL WHERE position_id = 1")
+
+    restarted = PositionTrackers(cursor, pairs)
+    restarted.load([(1, symbol, open_time, 60000.0, 'long', 0.002)])
+    assert_consistent(restarted, 1)
+
+
+def test_trailing_stop_follows_the_futures_price(cursor):
+    trackers = PositionTrackers(cursor, pairs)
+    trackers.load([])
+    tracker = trackers.open(1, symbol, 'long', 0.002, 60000.0, open_time)
+
+    # Spot trades 600 above the futures fill: a large spot excursion, but the position hasn't moved
+    ingest(cursor, trackers, make_trades(open_time, 20, price=60600.0))
+    for price in (60100.0, 60400.0, 60200.0):
+        trackers.on_futures_price(symbol, price)
+    assert tracker.max_favorable_excursion > 500
+    assert tracker.futures_favorable_excursion == 400
+    assert not tracker.trailing_stop_hit(60000.0)
+
+    # Another symbol's ticker doesn't move this position
+    assert trackers.on_futures_price('PF_ETHUSD', 70000.0) == []
+    assert tracker.futures_high == 60400.0
+
+    # 1000 in favor, the stop sits 20% of it below the peak
+    trackers.on_futures_price(symbol, 61000.0)
+    assert not tracker.trailing_stop_hit(60850.0)
+    assert tracker.trailing_stop_hit(60790.0)
+
+
+def test_futures_extremes_survive_a_restart(cursor):
+    trackers = PositionTrackers(cursor, pairs)
+    trackers.load([])
+    tracker = trackers.open(1, symbol, 'short', 0.002, 60000.0, open_time)
+    for price in (59800.0, 59300.0, 59500.0):
+        trackers.on_futures_price(symbol, price)
+    # Persisted with the next trade batch
+    ingest(cursor, trackers, make_trades(open_time + 10, 5))
+
+    restarted = PositionTrackers(cursor, pairs)
+    restarted.load([(1, symbol, open_time, 60000.0, 'short', 0.002)])
+    restored = restarted.get(1)
+    assert (restored.futures_low, restored.futures_high) == (59300.0, 60000.0)
+    assert restored.futures_favorable_excursion == tracker.futures_favorable_excursion == 700
@@ -0,0 +1,171 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import kraken_toolbox
+import rate_limiter
+from rate_limiter import PRIORITY_ACCOUNT, PRIORITY_MARKET_DATA, PRIORITY_ORDER, RateLimitScheduler
+
+
+def drained(capacity=10, rate=100.0, reserve=0.2, tokens=0.0):
+    scheduler = RateLimitScheduler({'test': (capacity, rate)}, reserve=reserve, poll_interval=0.001)
+    scheduler.buckets['test'].tokens = tokens
+    return scheduler
+
+
+def test_orders_overtake_queued_reads():
+    scheduler = drained()
+    served = []
+
+    async def request(name, priority, delay=0.0):
+        await asyncio.sleep(delay)
+        await scheduler.acquire_async('test', 5, priority)
+        served.append(name)
+
+    async def main():
+        await asyncio.gather(request('candles', PRIORITY_MARKET_DATA), request('positions', PRIORITY_ACCOUNT),
+                             request('close', PRIORITY_ORDER, delay=0.005))
+
+    asyncio.run(main())
+    # The order queued last is served first, then the account read ahead of market data
+    assert served == ['close', 'positions', 'candles']
+    assert scheduler.report()['test']['queued'] == 0
+
+
+def test_reads_leave_the_order_reserve():
+    # 1.5 tokens left of 10, 2 of them reserved for orders; the bucket barely refills
+    scheduler = drained(rate=0.001, tokens=1.5)
+    read = scheduler.enqueue('test', PRIORITY_MARKET_DATA, 1)
+    order = scheduler.enqueue('test', PRIORITY_ORDER, 1)
+
+    assert scheduler.try_take('test', read) > 0
+    assert scheduler.try_take('test', order) == 0
+    assert scheduler.buckets['test'].tokens == pytest.approx(0.5, abs=0.01)
+    scheduler.leave('test', read)
+
+
+def test_identical_reads_share_one_call():
+    scheduler = drained(tokens=10)
+    release = threading.Event()
+    calls = []
+
+    def request():
+        calls.append(1)
+        release.wait(5)
+        return {'result': len(calls)}
+
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        first = pool.submit(scheduler.run, 'test', request, key='tickers')
+        while not scheduler.in_flight:
+            time.sleep(0.001)
+        others = [pool.submit(scheduler.run, 'test', request, key='tickers') for _ in range(3)]
+        while scheduler.stats['test']['coalesced'] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [first.result(5)] + [future.result(5) for future in others]
+
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert scheduler.in_flight == {}
+    # The key is free again, the next call goes to the exchange
+    assert scheduler.run('test', request, key='tickers') == {'result': 2}
+
+
+def test_identical_async_reads_share_one_call():
+    scheduler = drained(tokens=10)
+    calls = []
+
+    async def request():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def main():
+        return await asyncio.gather(*(scheduler.run_async('test', request, key='OHLC') for _ in range(4)))
+
+    assert asyncio.run(main()) == [1, 1, 1, 1]
+    assert scheduler.stats['test']['coalesced'] == 3
+    assert scheduler.in_flight_async == {}
+
+
+def test_interrupted_call_releases_its_key():
+    scheduler = drained(tokens=10)
+    started = threading.Event()
+    release = threading.Event()
+
+    def interrupted():
+        started.set()
+        release.wait(5)
+        raise KeyboardInterrupt
+
+    def run_interrupted():
+        with pytest.raises(KeyboardInterrupt):
+            scheduler.run('test', interrupted, key='tickers')
+
+    owner = threading.Thread(target=run_interrupted)
+    owner.start()
+    started.wait(5)
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        waiter = pool.submit(scheduler.run, 'test', lambda: 'unused', key='tickers')
+        while scheduler.stats['test']['coalesced'] < 1:
+            time.sleep(0.001)
+        release.set()
+        owner.join(5)
+        with pytest.raises(concurrent.futures.CancelledError):
+            waiter.result(5)
+
+    assert scheduler.in_flight == {}
+    assert scheduler.run('test', lambda: 'fresh', key='tickers') == 'fresh'
+
+
+def test_cancelled_async_call_releases_its_key():
+    scheduler = drained(tokens=10)
+
+    async def main():
+        task = asyncio.create_task(scheduler.run_async('test', lambda: asyncio.sleep(10), key='OHLC'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert scheduler.in_flight_async == {}
+
+        async def fresh():
+            return 'fresh'
+        return await scheduler.run_async('test', fresh, key='OHLC')
+
+    assert asyncio.run(main()) == 'fresh'
+
+
+def test_interrupted_wait_leaves_the_queue(monkeypatch):
+    scheduler = drained(rate=0.001)
+
+    def sleep(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(rate_limiter.time, 'sleep', sleep)
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.acquire('test', 5, PRIORITY_ORDER)
+    # A ticket left behind would hold back every lower priority request
+    assert scheduler.waiting['test'] == {}
+
+
+def test_signed_reads_are_neither_coalesced_nor_retried(monkeypatch):
+    calls = []
+
+    def run(name, request, cost=1, priority=PRIORITY_MARKET_DATA, key=None):
+        calls.append((name, key))
+        return type('Response', (), {'json': lambda self: {}})()
+
+    monkeypatch.setattr(kraken_toolbox.scheduler, 'run', run)
+    auth = kraken_toolbox.KrakenFuturesAuth('key', 'c2VjcmV0', '/api/v3/openpositions')
+    kraken_toolbox.get_open_positions(auth)
+    kraken_toolbox.get_open_orders(auth)
+    kraken_toolbox.get_open_fills(auth)
+    kraken_toolbox.get_account_info(auth)
+
+    assert calls == [('futures_private', None)] * 4
+    assert kraken_toolbox.signed_session.get_adapter('https://').max_retries.total == 0
+    assert kraken_toolbox.session.get_adapter('https://').max_retries.total > 0
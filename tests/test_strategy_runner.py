@@ -0,0 +1,89 @@
+import sqlite3
+import time
+
+import pytest
+
+import constants
+import dollar_bars
+import order_flow_tools
+import strategy_runner
+from profiling import CycleProfiler
+from schema import create_trades_table
+from strategy_runner import analyze_symbol
+from tracing import tracer
+
+
+pair = 'XBT/USD'
+
+
+@pytest.fixture
+def cursor(monkeypatch):
+    # analyze_symbol reads the trades through the worker's module connections
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    cursor.execute(create_trades_table)
+    start = int(time.time()) - 3600
+    cursor.executemany("INSERT INTO trades (timestamp, price, volume, side, type_order, pair) "
+                       "VALUES (?, ?, ?, ?, 'market', ?)",
+                       [(start + index, 60000.0 + (index % 11) * 5, 0.05 + (index % 3) * 0.01,
+                         'buy' if index % 3 else 'sell', pair) for index in range(600)])
+    monkeypatch.setattr(dollar_bars, 'cursor', cursor)
+    monkeypatch.setattr(order_flow_tools, 'cursor', cursor)
+    monkeypatch.setattr(strategy_runner, 'conn', conn)
+    monkeypatch.setattr(tracer, 'enabled', tracer.enabled)
+    yield cursor
+    conn.close()
+
+
+def test_analysis_reports_its_stages_and_spans(cursor):
+    result = analyze_symbol(pair, 30000, 3, trace=True)
+
+    stages = {stage['stage']: stage for stage in result['stages']}
+    assert list(stages) == ['fetch_trades', 'create_dollar_bars', 'stochastic_rsi', 'get_market_signal']
+    assert stages['fetch_trades']['rows'] == result['rows'] == 600
+    assert stages['create_dollar_bars']['bars'] == len(result['dollar_bars']) > 0
+    assert all(stage['wall'] >= 0 and stage['cpu'] >= 0 for stage in stages.values())
+    # The span recorded inside get_market_signal comes back instead of staying in the worker
+    assert [name for name, _ in result['spans']] == ['calculate_order_flow_metrics']
+    assert not tracer.spans
+
+    # The next call only reads the new trades, and records no spans when tracing is off
+    result = analyze_symbol(pair, 30000, 3, result['builder'], stoch_rsi=result['stoch_rsi'])
+    assert result['rows'] == 0 and result['spans'] == []
+
+
+def test_worker_stages_are_stored_without_counting_their_cpu_twice(cursor):
+    profiler = CycleProfiler(cursor)
+    profiler.start_cycle()
+    with profiler.stage('PF_XBTUSD analyze') as stage:
+        stage.cpu = 0.5
+    profiler.record_stage('PF_XBTUSD fetch_trades', 0.2, 0.1, rows=600)
+    profiler.end_cycle()
+
+    rows = cursor.execute("SELECT stage, cpu_ms, rows_read FROM cycle_stages WHERE cycle_id = ?",
+                          (profiler.cycle_id,)).fetchall()
+    assert rows[:2] == [('PF_XBTUSD analyze', 500.0, None), ('PF_XBTUSD fetch_trades', 100.0, 600)]
+    # The cycle total has the worker's CPU once, from the analyze stage
+    assert rows[2][0] == 'cycle' and 500.0 <= rows[2][1] < 600.0
+
+
+def test_profiled_cycle_profiles_the_worker(cursor, tmp_path, monkeypatch):
+    monkeypatch.setattr(constants, 'profile_dir', str(tmp_path))
+    analyze_symbol(pair, 30000, 3, profile_cycle=42)
+
+    report = (tmp_path / 'cycle_42_XBTUSD.txt').read_text()
+    assert (tmp_path / 'cycle_42_XBTUSD.prof').exists()
+    assert 'get_market_signal' in report and 'consume' in report
+
+
+def test_footprint_of_the_newest_bar_is_reported_with_the_signal(cursor):
+    assert not any(key.startswith('footprint_') for key in analyze_symbol(pair, 30000, 3)['signal'])
+
+    result = analyze_symbol(pair, 30000, 3, footprints=True)
+    bar = result['builder'].bars[-1]
+    traded = cursor.execute("SELECT SUM(volume) FROM trades WHERE timestamp > ? AND timestamp <= ?",
+                            (result['builder'].bars[-2][6], bar[6])).fetchone()[0]
+    signal = result['signal']
+    assert signal['footprint_bid_volume'] + signal['footprint_ask_volume'] == pytest.approx(traded)
+    assert bar[2] <= signal['footprint_poc'] <= bar[1]
+    assert [stage['stage'] for stage in result['stages']][-1] == 'footprints'
@@ -0,0 +1,308 @@
+import contextvars
+import itertools
+import json
+import math
+import time
+from collections import deque
+
+import constants
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of latencies in microseconds.
+
+    Values fall into log-linear buckets: each power of two is split into 2 ** (precision_bits - 1)
+    equal sub-buckets, so every recorded value is kept with a relative error below 2 ** -(precision_bits - 1)
+    no matter how wide the range. Recording is a dict increment, and histograms of the same precision can
+    be merged, so per-interval histograms from the metrics table add up to longer windows.
+    """
+
+    def __init__(self, precision_bits=6):
+        self.precision_bits = precision_bits
+        self.linear_limit = 1 << precision_bits  # values below this get a bucket each
+        self.sub_buckets = 1 << (precision_bits - 1)
+        self.counts = {}  # bucket index -> count
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def bucket_index(self, value):
+        if value < self.linear_limit:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return (shift + 1) * self.sub_buckets + (value >> shift)
+
+    def bucket_upper(self, index):
+        """Highest value that falls into the bucket."""
+        if index < self.linear_limit:
+            return index
+        shift = index // self.sub_buckets - 2
+        mantissa = index - (shift + 1) * self.sub_buckets
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, microseconds):
+        value = max(0, int(microseconds))
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        if other.total:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def percentile(self, percentile):
+        if not self.total:
+            return None
+
+        rank = max(1, math.ceil(percentile / 100 * self.total))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_upper(index), self.max)
+        return self.max
+
+    def summary(self):
+        """
+        :return: Dict with the count and the p50, p90, p99 and max latencies in milliseconds.
+        """
+        return {
+            'count': self.total,
+            'p50_ms': round(self.percentile(50) / 1000, 3),
+            'p90_ms': round(self.percentile(90) / 1000, 3),
+            'p99_ms': round(self.percentile(99) / 1000, 3),
+            'max_ms': round(self.max / 1000, 3)
+        }
+
+    def to_json(self):
+        return json.dumps({'precision_bits': self.precision_bits, 'counts': self.counts})
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        histogram = cls(data['precision_bits'])
+        for index, count in data['counts'].items():
+            index = int(index)
+            histogram.counts[index] = count
+            histogram.total += count
+            upper = histogram.bucket_upper(index)
+            histogram.min = upper if histogram.min is None else min(histogram.min, upper)
+            histogram.max = upper if histogram.max is None else max(histogram.max, upper)
+        return histogram
+
+
+class Span:
+    __slots__ = ('tracer', 'stage', 'start')
+
+    def __init__(self, tracer, stage):
+        self.tracer = tracer
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+noop_span = NoopSpan()
+
+# (decision id, perf_counter at its start) of the trade batch or analysis cycle being handled. Tasks
+# created while a decision is current inherit it, so spans recorded in them carry the same id.
+current_decision = contextvars.ContextVar('current_decision', default=None)
+
+
+class Tracer:
+    """
+    Span timings of the trade-to-order path, grouped under decision ids.
+
+    Every stage gets its own latency histogram. Spans of decisions that went on to send an order are kept
+    in full, so a slow order can be followed from the trade batch or analysis cycle that caused it. When
+    disabled, span() hands back one shared no-op context manager and nothing is recorded.
+    """
+
+    def __init__(self, enabled=constants.tracing_enabled, max_spans=10000, span_retention=120):
+        """
+        :param enabled: Record anything at all.
+        :param max_spans: Spans buffered between flushes.
+        :param span_retention: Seconds the spans of a decision wait for it to send an order before they
+                               are dropped at a flush.
+        """
+        self.enabled = enabled
+        self.span_retention = span_retention
+        self.histograms = {}  # stage -> LatencyHistogram for the current interval
+        self.spans = deque(maxlen=max_spans)  # (decision id, stage, epoch started, seconds) not flushed yet
+        self.kept = set()  # decision ids whose spans are written to trace_spans
+        self.sequence = itertools.count(1)
+        self.interval_start = time.time()
+
+    def start_decision(self, origin):
+        """
+        Start a new decision in the current context.
+
+        :param origin: What triggered it, e.g. 'trades' or 'analysis'.
+        :return: The decision id, or None while disabled.
+        """
+        if not self.enabled:
+            return None
+        decision_id = f'{origin}-{int(time.time())}-{next(self.sequence)}'
+        current_decision.set((decision_id, time.perf_counter()))
+        return decision_id
+
+    def span(self, stage):
+        """Context manager timing a stage of the current decision."""
+        if not self.enabled:
+            return noop_span
+        return Span(self, stage)
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = LatencyHistogram()
+        histogram.record(seconds * 1000000)
+
+        decision = current_decision.get()
+        if decision is not None:
+            self.spans.append((decision[0], stage, time.time() - seconds, seconds))
+
+    def mark(self, stage):
+        """Record the time from the start of the current decision until now, e.g. up to an order ack."""
+        if not self.enabled:
+            return
+        decision = current_decision.get()
+        if decision is not None:
+            self.record(stage, time.perf_counter() - decision[1])
+
+    def keep(self):
+        """Persist every span of the current decision, called when it leads to an order."""
+        if not self.enabled:
+            return
+        decision = current_decision.get()
+        if decision is not None:
+            self.kept.add(decision[0])
+
+    def take_spans(self):
+        """
+        Hand over the spans recorded so far and forget them, for a tracer in an executor worker that never
+        flushes. The parent records them again under its own decision.
+
+        :return: List of (stage, seconds).
+        """
+        spans = [(stage, seconds) for _, stage, _, seconds in self.spans]
+        self.spans.clear()
+        self.histograms = {}
+        return spans
+
+    def summary(self):
+        """
+        :return: Dict of stage -> histogram summary for the current interval.
+        """
+        return {stage: histogram.summary() for stage, histogram in sorted(self.histograms.items())}
+
+    def flush(self, cursor):
+        """
+        Write the interval's histograms and the spans of kept decisions to SQLite, then start a new interval.
+
+        Doesn't commit, the caller commits.
+        """
+        if not self.enabled:
+            return
+
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS latency_histograms (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            interval_start REAL,
+            interval_end REAL,
+            stage TEXT,
+            count INTEGER,
+            p50_ms REAL,
+            p90_ms REAL,
+            p99_ms REAL,
+            max_ms REAL,
+            buckets TEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS trace_spans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            decision_id TEXT,
+            stage TEXT,
+            started REAL,
+            duration_ms REAL
+        )
+        """)
+
+        interval_end = time.time()
+        rows = []
+        for stage, histogram in self.histograms.items():
+            summary = histogram.summary()
+            rows.append((self.interval_start, interval_end, stage, summary['count'], summary['p50_ms'],
+                         summary['p90_ms'], summary['p99_ms'], summary['max_ms'], histogram.to_json()))
+        cursor.executemany("""
+        INSERT INTO latency_histograms
+        (interval_start, interval_end, stage, count, p50_ms, p90_ms, p99_ms, max_ms, buckets)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+        # Recent decisions may still send an order, their spans stay buffered until a later flush
+        pending = deque(maxlen=self.spans.maxlen)
+        span_rows = []
+        for decision_id, stage, started, seconds in self.spans:
+            if decision_id in self.kept:
+                span_rows.append((decision_id, stage, started, seconds * 1000))
+            elif started > interval_end - self.span_retention:
+                pending.append((decision_id, stage, started, seconds))
+        cursor.executemany("""
+        INSERT INTO trace_spans (decision_id, stage, started, duration_ms)
+        VALUES (?, ?, ?, ?)
+        """, span_rows)
+
+        self.spans = pending
+        self.kept.clear()
+        self.histograms = {}
+        self.interval_start = interval_end
+
+
+# Shared tracer used by live.py, get_signals and kraken_async
+tracer = Tracer()
+
+
+"""__________________________________________________________________________________________________________________"""
+
+# Usage
+"""
+tracer = Tracer(enabled=True)
+tracer.start_decision('analysis')
+with tracer.span('fetch_trades'):
+    trade_data = fetch_trades(hours=72)
+tracer.mark('decision_to_ack')
+print(tracer.summary())
+
+# Latency of a stage over the last day, merged from the stored intervals
+histogram = LatencyHistogram()
+for (buckets,) in cursor.execute("SELECT buckets FROM latency_histograms WHERE stage = ? AND interval_end > ?",
+                                 ('fetch_trades', time.time() - 86400)):
+    histogram.merge(LatencyHistogram.from_json(buckets))
+print(histogram.summary())"""
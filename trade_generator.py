@@ -0,0 +1,224 @@
+"""
+Seeded synthetic BTC trade streams for benchmarks and offline runs, from 10k to 100M trades.
+
+    python trade_generator.py 1000000 --seed 7
+    python trade_generator.py 100000000 --seed 7 --arrays synthetic_arrays
+
+Trades go to the trades table of TRADING_DB, or to the memory-mapped .npy columns sweep.py and footprint.py
+read. The stream is generated in fixed chunks, so memory stays flat at any size and the same seed always
+gives the same trades, whatever the count: with the same start time, a shorter stream is a prefix of a
+longer one.
+
+What makes it look like Kraken's tape rather than noise:
+- activity follows a slow log-normal regime, so trades arrive in clusters and are bigger when busy
+- the aggressor side comes in runs, a new trade keeps the previous side most of the time
+- market and limit orders are mixed, with more market orders when busy
+- the price is a random walk on the 0.1 tick, more volatile when busy and pushed by the aggressor's size
+"""
+import argparse
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+import constants
+from schema import create_trades_table
+from trade_history import BulkLoad, insert_query
+
+
+class TradeGenerator:
+    """
+    Trade stream of one seed. chunks() continues where the previous call stopped, so a stream can be
+    written in pieces.
+    """
+
+    chunk_size = 100000  # trades per generated chunk, fixed so the stream doesn't depend on the caller
+    block_size = 100  # trades sharing one activity level
+
+    def __init__(self, seed=7, start_time=None, start_price=60000.0, trades_per_second=2.0, mean_volume=0.05,
+                 volume_sigma=1.3, run_length=3.0, market_share=0.6, volatility=0.00015, impact=0.00004,
+                 regime_persistence=0.98, regime_sigma=0.15):
+        """
+        :param start_time: Epoch seconds of the first trade, defaults to 1M trades before now.
+        :param trades_per_second: Average arrival rate at the calm activity level.
+        :param mean_volume: Average trade size in BTC at the calm activity level.
+        :param volume_sigma: Sigma of the log-normal trade size, the tail of large prints.
+        :param run_length: Average number of consecutive trades with the same aggressor side.
+        :param market_share: Share of market orders at the calm activity level.
+        :param volatility: Standard deviation of the log return per trade at the calm activity level.
+        :param impact: Log return per sqrt(BTC) of aggressive volume, buys push the price up.
+        :param regime_persistence: AR(1) coefficient of the log activity per block of trades.
+        :param regime_sigma: Innovation of the log activity per block.
+        """
+        self.rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.trades_per_second = trades_per_second
+        self.volume_mu = np.log(mean_volume) - volume_sigma ** 2 / 2
+        self.volume_sigma = volume_sigma
+        self.switch_probability = 1.0 / run_length
+        self.market_share = market_share
+        self.volatility = volatility
+        self.impact = impact
+        self.regime_persistence = regime_persistence
+        self.regime_sigma = regime_sigma
+
+        # State carried from one chunk to the next
+        self.time = start_time if start_time is not None else time.time() - self.expected_span(1000000)
+        self.log_price = np.log(start_price)
+        self.log_activity = 0.0
+        self.side = 1  # 1 buy, 0 sell
+        self.generated = 0
+
+    def expected_span(self, count):
+        """Expected seconds between the first and the count-th trade, to make a stream end around now."""
+        # Gaps scale with 1 / activity, whose mean is exp(variance / 2) for the stationary log activity
+        variance = self.regime_sigma ** 2 / (1 - self.regime_persistence ** 2)
+        return count / self.trades_per_second * np.exp(variance / 2)
+
+    def activity(self, blocks):
+        # The AR(1) runs per block rather than per trade, a loop over 1% of the trades
+        shocks = self.rng.normal(0.0, self.regime_sigma, blocks)
+        levels = np.empty(blocks)
+        log_activity = self.log_activity
+        for index, shock in enumerate(shocks.tolist()):
+            log_activity = self.regime_persistence * log_activity + shock
+            levels[index] = log_activity
+        self.log_activity = log_activity
+        return np.exp(np.repeat(levels, self.block_size))
+
+    def next_chunk(self):
+        """
+        :return: Dict of timestamp, price, volume (float64), side (int8, 1 buy) and market (int8, 1 market
+                 order) arrays of chunk_size trades.
+        """
+        count = self.chunk_size
+        rng = self.rng
+        activity = self.activity(count // self.block_size)
+
+        gaps = rng.exponential(1.0 / (self.trades_per_second * activity))
+        timestamps = self.time + np.cumsum(gaps)
+        # Kraken reports trade times to 0.1 ms
+        timestamps = np.round(timestamps, 4)
+        self.time = float(timestamps[-1])
+
+        volumes = np.round(rng.lognormal(self.volume_mu, self.volume_sigma, count) * np.sqrt(activity), 8)
+        volumes = np.maximum(volumes, 1e-8)
+
+        switches = rng.random(count) < self.switch_probability
+        sides = ((self.side + np.cumsum(switches)) % 2).astype(np.int8)
+        self.side = int(sides[-1])
+
+        markets = (rng.random(count) < np.minimum(self.market_share * activity ** 0.25, 0.95)).astype(np.int8)
+
+        signs = sides * 2.0 - 1.0
+        returns = (rng.normal(0.0, self.volatility, count) * np.sqrt(activity) +
+                   self.impact * signs * np.sqrt(volumes) * markets)
+        log_prices = self.log_price + np.cumsum(returns)
+        self.log_price = float(log_prices[-1])
+        prices = np.round(np.exp(log_prices), 1)
+
+        self.generated += count
+        return {'timestamp': timestamps, 'price': prices, 'volume': volumes, 'side': sides, 'market': markets}
+
+    def chunks(self, count):
+        """Yield chunks of the next count trades, the last one cut to size."""
+        remaining = count
+        while remaining > 0:
+            chunk = self.next_chunk()
+            if remaining < self.chunk_size:
+                chunk = {name: column[:remaining] for name, column in chunk.items()}
+                # The cut-off trades are skipped, the next call starts after the full chunk
+            remaining -= len(chunk['timestamp'])
+            yield chunk
+
+
+def chunk_rows(chunk, pair):
+    """Rows of a chunk for the trades table insert."""
+    sides = np.array(['sell', 'buy'], dtype=object)[chunk['side']]
+    order_types = np.array(['limit', 'market'], dtype=object)[chunk['market']]
+    return zip(chunk['timestamp'].tolist(), chunk['price'].tolist(), chunk['volume'].tolist(), sides.tolist(),
+               order_types.tolist(), itertools.repeat(pair))
+
+
+def write_database(conn, generator, count, pair='XBT/USD'):
+    """
+    Append count trades to the trades table, one transaction per chunk with the indexes rebuilt at the end.
+
+    :return: Number of rows inserted.
+    """
+    cursor = conn.cursor()
+    cursor.execute(create_trades_table)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_timestamp ON trades (timestamp)")
+    conn.commit()
+
+    inserted = 0
+    with BulkLoad(conn):
+        for chunk in generator.chunks(count):
+            cursor.executemany(insert_query, chunk_rows(chunk, pair))
+            conn.commit()
+            inserted += len(chunk['timestamp'])
+    return inserted
+
+
+def write_arrays(directory, generator, count, pair='XBT/USD'):
+    """
+    Write count trades to .npy columns in the layout of sweep.export_arrays, readable with sweep.load_arrays.
+
+    :return: Number of trades written.
+    """
+    os.makedirs(directory, exist_ok=True)
+    arrays = {name: np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode='w+',
+                                              dtype=np.int8 if name in ('side', 'market') else np.float64,
+                                              shape=(count,))
+              for name in ('timestamp', 'price', 'volume', 'side', 'market')}
+
+    position = 0
+    for chunk in generator.chunks(count):
+        size = len(chunk['timestamp'])
+        for name, array in arrays.items():
+            array[position:position + size] = chunk[name]
+        position += size
+
+    for array in arrays.values():
+        array.flush()
+    meta = {'pair': pair, 'start': None, 'end': None, 'rows': position, 'seed': generator.seed}
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump(meta, meta_file)
+    return position
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic trade stream.")
+    parser.add_argument('count', type=int, help="number of trades")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--pair', default='XBT/USD')
+    parser.add_argument('--start', type=float, default=None,
+                        help="time of the first trade, Unix seconds; by default the stream ends around now")
+    parser.add_argument('--rate', type=float, default=2.0, help="average trades per second when calm")
+    parser.add_argument('--arrays', default=None, help="write .npy columns to this directory instead of TRADING_DB")
+    args = parser.parse_args()
+
+    generator = TradeGenerator(args.seed, args.start, trades_per_second=args.rate)
+    if args.start is None:
+        generator.time = time.time() - generator.expected_span(args.count)
+    started = time.perf_counter()
+
+    if args.arrays:
+        written = write_arrays(args.arrays, generator, args.count, args.pair)
+        target = args.arrays
+    else:
+        conn = sqlite3.connect(constants.db_path)
+        written = write_database(conn, generator, args.count, args.pair)
+        conn.close()
+        target = constants.db_path
+
+    elapsed = time.perf_counter() - started
+    print(f"{written} trades written to {target} in {elapsed:.1f}s ({written / elapsed:,.0f} trades/s), "
+          f"last trade at {generator.time:.0f}")
+
+
+if __name__ == '__main__':
+    main()
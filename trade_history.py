@@ -0,0 +1,391 @@
+"""
+Bulk import of historical trades into the trades table and bulk export of any time range.
+
+    python trade_history.py import-csv XBTUSD.csv --pair XBT/USD
+    python trade_history.py import-rest XBTUSD --pair XBT/USD --since 1717200000
+    python trade_history.py export trades.parquet --start 1717200000 --end 1719792000
+
+Imports commit in large chunks together with a checkpoint, so an interrupted import resumes where it
+stopped when run again with the same source. Kraken's downloadable CSVs only hold timestamp, price and
+volume; their side is inferred with the tick rule and their order type stored as 'unknown'.
+
+Trades already in the table (from the live feed or an overlapping import) are skipped, matched on pair,
+timestamp to the millisecond, price and volume. The side isn't compared, a CSV's is only inferred.
+"""
+import argparse
+import itertools
+import os
+import sqlite3
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+import constants
+import kraken_toolbox
+from snapshots import invalidate_snapshot
+
+insert_query = "INSERT INTO trades (timestamp, price, volume, side, type_order, pair) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def create_checkpoint_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS import_checkpoints (
+        source TEXT PRIMARY KEY,
+        position TEXT,
+        rows INTEGER,
+        updated INTEGER
+    )
+    """)
+
+
+def get_checkpoint(cursor, source):
+    cursor.execute("SELECT position, rows FROM import_checkpoints WHERE source = ?", (source,))
+    return cursor.fetchone()
+
+
+def set_checkpoint(cursor, source, position, rows):
+    cursor.execute("INSERT OR REPLACE INTO import_checkpoints (source, position, rows, updated) VALUES (?, ?, ?, ?)",
+                   (source, str(position), rows, int(time.time())))
+
+
+class BulkLoad:
+    """
+    Context manager relaxing durability and dropping the trades indexes for a bulk load.
+
+    The indexes are rebuilt in one pass at the end, which is much faster than updating them row by row.
+    Synchronous writes are off while loading: an application crash is still safe, a power loss during the
+    load can lose the last chunks but the checkpoints commit together with the rows they cover.
+    """
+
+    def __init__(self, conn, defer_indexes=True, keep=()):
+        """
+        :param keep: Names of indexes left in place, e.g. the timestamp index when the load looks up
+                     existing trades.
+        """
+        self.conn = conn
+        self.defer_indexes = defer_indexes
+        self.keep = keep
+        self.indexes = []
+        self.synchronous = None
+
+    def __enter__(self):
+        cursor = self.conn.cursor()
+        self.synchronous = cursor.execute("PRAGMA synchronous").fetchone()[0]
+        cursor.execute("PRAGMA synchronous = OFF")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        cursor.execute("PRAGMA cache_size = -262144")  # 256 MB
+
+        if self.defer_indexes:
+            cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'trades' "
+                           "AND sql IS NOT NULL")
+            self.indexes = [(name, sql) for name, sql in cursor.fetchall() if name not in self.keep]
+            for name, sql in self.indexes:
+                cursor.execute(f"DROP INDEX {name}")
+            self.conn.commit()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        cursor = self.conn.cursor()
+        for name, sql in self.indexes:
+            started = time.perf_counter()
+            cursor.execute(sql)
+            print(f"Rebuilt index {name} in {time.perf_counter() - started:.1f}s")
+        self.conn.commit()
+        cursor.execute(f"PRAGMA synchronous = {self.synchronous}")
+        return False
+
+
+def trade_key(timestamp, price, volume):
+    # Timestamps come with 4 to 6 decimals depending on the source
+    return round(float(timestamp), 3), float(price), float(volume)
+
+
+class ExistingTrades:
+    """
+    Filters out rows of an import that are already in the trades table, so overlapping imports and ranges
+    the live feed captured aren't stored twice. Only the time span the table held before the import is
+    looked up, a chunk outside it is inserted as is.
+    """
+
+    def __init__(self, cursor, pair):
+        self.cursor = cursor
+        self.pair = pair
+        cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM trades WHERE pair = ?", (pair,))
+        self.first, self.last = cursor.fetchone()
+
+    @property
+    def empty(self):
+        return self.first is None
+
+    def new_rows(self, rows):
+        """
+        :param rows: Rows of insert_query, in any order.
+        :return: The rows not in the table yet. Identical rows count separately: two same prints in the
+                 import and one in the table keep one.
+        """
+        if self.empty or not rows:
+            return rows
+        start = min(row[0] for row in rows)
+        end = max(row[0] for row in rows)
+        if end < self.first - 0.001 or start > self.last + 0.001:
+            return rows
+
+        self.cursor.execute("""
+        SELECT timestamp, price, volume FROM trades
+        WHERE timestamp >= ? AND timestamp <= ? AND pair = ?
+        """, (start - 0.001, end + 0.001, self.pair))
+        existing = Counter(trade_key(*row) for row in self.cursor.fetchall())
+        if not existing:
+            return rows
+
+        kept = []
+        for row in rows:
+            key = trade_key(row[0], row[1], row[2])
+            if existing[key]:
+                existing[key] -= 1
+            else:
+                kept.append(row)
+        return kept
+
+
+def tick_rule_sides(prices, last_price=None, last_side='buy'):
+    """
+    Infer the aggressor side from price changes: an uptick is a buy, a downtick a sell, an unchanged
+    price repeats the previous side.
+
+    :return: (numpy array of 'buy' / 'sell', last side) so the next chunk can continue the sequence.
+    """
+    previous = np.empty_like(prices)
+    previous[0] = prices[0] if last_price is None else last_price
+    previous[1:] = prices[:-1]
+    direction = np.sign(prices - previous)
+
+    # Unchanged prices take the last non-zero direction, the first one falls back to the previous chunk
+    direction[0] = direction[0] or (1 if last_side == 'buy' else -1)
+    nonzero = np.where(direction != 0, np.arange(len(direction)), 0)
+    np.maximum.accumulate(nonzero, out=nonzero)
+    direction = direction[nonzero]
+
+    sides = np.where(direction > 0, 'buy', 'sell')
+    return sides, sides[-1]
+
+
+def import_csv(conn, path, pair, chunk_size=1000000, defer_indexes=True):
+    """
+    Load a trade CSV: Kraken's timestamp, price, volume dumps, or timestamp, price, volume, side, type.
+
+    :return: Number of rows inserted.
+    """
+    cursor = conn.cursor()
+    create_checkpoint_table(cursor)
+    source = 'csv:' + os.path.abspath(path)
+    checkpoint = get_checkpoint(cursor, source)
+    done = checkpoint[1] if checkpoint else 0
+    if done:
+        print(f"Resuming {path} after {done} rows")
+
+    try:
+        chunks = pd.read_csv(path, header=None, chunksize=chunk_size, skiprows=done)
+    except pd.errors.EmptyDataError:
+        # Every row is past the checkpoint, the file was imported completely before
+        print(f"{path} is already imported ({done} rows)")
+        return 0
+
+    inserted = 0
+    skipped = 0
+    last_price = None
+    last_side = 'buy'
+    started = time.perf_counter()
+    existing = ExistingTrades(cursor, pair)
+
+    # The lookups of existing trades need the timestamp index, it is only dropped when there is nothing to look up
+    with BulkLoad(conn, defer_indexes, keep=() if existing.empty else ('idx_trades_timestamp',)):
+        for chunk in chunks:
+            # Skip a header row if the file has one
+            if not str(chunk.iat[0, 0]).replace('.', '', 1).isdigit():
+                chunk = chunk.iloc[1:]
+                done += 1
+
+            timestamps = pd.to_numeric(chunk[0]).to_numpy()
+            prices = pd.to_numeric(chunk[1]).to_numpy(dtype=float)
+            volumes = pd.to_numeric(chunk[2]).to_numpy(dtype=float)
+
+            if chunk.shape[1] >= 5:
+                sides = chunk[3].map(lambda side: 'buy' if str(side)[0] == 'b' else 'sell').to_numpy()
+                order_types = chunk[4].map(lambda order: 'market' if str(order)[0] == 'm' else 'limit').to_numpy()
+            else:
+                sides, last_side = tick_rule_sides(prices, last_price, last_side)
+                order_types = np.full(len(chunk), 'unknown', dtype=object)
+            last_price = prices[-1]
+
+            rows = list(zip(timestamps.tolist(), prices.tolist(), volumes.tolist(), sides.tolist(),
+                            order_types.tolist(), itertools.repeat(pair)))
+            new_rows = existing.new_rows(rows)
+            cursor.executemany(insert_query, new_rows)
+            done += len(chunk)
+            inserted += len(new_rows)
+            skipped += len(rows) - len(new_rows)
+            set_checkpoint(cursor, source, done, done)
+            conn.commit()
+
+            elapsed = time.perf_counter() - started
+            print(f"{inserted} rows, {done / elapsed:,.0f} rows/s, {skipped} already stored")
+
+    return inserted
+
+
+def import_rest(conn, rest_pair, pair, since=None, until=None, defer_indexes=False):
+    """
+    Page through Kraken's public Trades history from since (seconds) up to until or the present.
+
+    Each page is committed with its 'last' cursor as the checkpoint. The endpoint is rate limited to
+    roughly one call per second, so this runs at about 1000 trades per second at best.
+
+    :return: Number of rows inserted.
+    """
+    cursor = conn.cursor()
+    create_checkpoint_table(cursor)
+    source = f'rest:{rest_pair}'
+    checkpoint = get_checkpoint(cursor, source)
+    cursor_position = checkpoint[0] if checkpoint else since
+    done = checkpoint[1] if checkpoint else 0
+    if checkpoint:
+        print(f"Resuming {rest_pair} from cursor {cursor_position}")
+
+    inserted = 0
+    existing = ExistingTrades(cursor, pair)
+    with BulkLoad(conn, defer_indexes, keep=() if existing.empty else ('idx_trades_timestamp',)):
+        while True:
+            trades, last = kraken_toolbox.request_trades(rest_pair, cursor_position)
+            if until is not None:
+                trades = [trade for trade in trades if float(trade[2]) < until]
+
+            new_rows = existing.new_rows([
+                (float(trade[2]), float(trade[0]), float(trade[1]), 'buy' if trade[3] == 'b' else 'sell',
+                 'market' if trade[4] == 'm' else 'limit', pair)
+                for trade in trades
+            ])
+            cursor.executemany(insert_query, new_rows)
+            done += len(trades)
+            inserted += len(new_rows)
+            set_checkpoint(cursor, source, last, done)
+            conn.commit()
+
+            print(f"{inserted} rows ({len(trades) - len(new_rows)} of this page already stored), "
+                  f"up to {trades[-1][2] if trades else cursor_position}")
+
+            # An empty or unchanged page means the present was reached
+            if not trades or last == cursor_position or (until is not None and int(last) / 1e9 >= until):
+                break
+            cursor_position = last
+
+    return inserted
+
+
+def export_trades(conn, path, start=None, end=None, pair=None, batch_size=1000000):
+    """
+    Write the trades of a time range to Parquet (.parquet) or an Arrow IPC file (.arrow / .feather),
+    streaming batch by batch so memory stays flat.
+
+    :return: Number of rows written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([('timestamp', pa.float64()), ('price', pa.float64()), ('volume', pa.float64()),
+                        ('side', pa.string()), ('type_order', pa.string()), ('pair', pa.string())])
+
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("timestamp >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("timestamp < ?")
+        params.append(end)
+    if pair is not None:
+        conditions.append("pair = ?")
+        params.append(pair)
+    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    SELECT timestamp, price, volume, side, type_order, pair
+    FROM trades
+    {where}
+    ORDER BY timestamp
+    """, params)
+
+    if path.endswith('.parquet'):
+        writer = pq.ParquetWriter(path, schema, compression='zstd')
+        write = writer.write_table
+    else:
+        sink = pa.OSFile(path, 'wb')
+        writer = pa.ipc.new_file(sink, schema)
+        write = writer.write_table
+
+    written = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            write(pa.table([pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+                           schema=schema))
+            written += len(rows)
+            print(f"{written} rows, {written / (time.perf_counter() - started):,.0f} rows/s")
+    finally:
+        writer.close()
+        if not path.endswith('.parquet'):
+            sink.close()
+
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of the trades table.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    csv_parser = commands.add_parser('import-csv', help="load a Kraken trade CSV")
+    csv_parser.add_argument('path')
+    csv_parser.add_argument('--pair', default='XBT/USD', help="pair stored with the trades")
+    csv_parser.add_argument('--chunk', type=int, default=1000000, help="rows per transaction")
+    csv_parser.add_argument('--keep-indexes', action='store_true', help="don't drop and rebuild the indexes")
+
+    rest_parser = commands.add_parser('import-rest', help="page through Kraken's REST Trades history")
+    rest_parser.add_argument('rest_pair', help="Kraken REST pair, e.g. XBTUSD")
+    rest_parser.add_argument('--pair', default='XBT/USD', help="pair stored with the trades")
+    rest_parser.add_argument('--since', type=float, default=None, help="start, Unix seconds")
+    rest_parser.add_argument('--until', type=float, default=None, help="end, Unix seconds")
+
+    export_parser = commands.add_parser('export', help="write a time range to .parquet or .arrow")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--start', type=float, default=None)
+    export_parser.add_argument('--end', type=float, default=None)
+    export_parser.add_argument('--pair', default=None)
+
+    args = parser.parse_args()
+    conn = sqlite3.connect(constants.db_path)
+
+    if args.command == 'import-csv':
+        inserted = import_csv(conn, args.path, args.pair, args.chunk, not args.keep_indexes)
+    elif args.command == 'import-rest':
+        since = int(args.since) if args.since is not None else None
+        inserted = import_rest(conn, args.rest_pair, args.pair, since, args.until)
+    else:
+        export_trades(conn, args.path, args.start, args.end, args.pair)
+        inserted = 0
+
+    # A running bot skips rows timed before its bars, the warm-start snapshot would keep missing them too
+    if inserted:
+        invalidate_snapshot(reason='trades imported')
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()